@@ -90,6 +90,7 @@ class CSVReader(object):
                  ):
 
         self.messages = { 'MAV' : self }
+        self.condition_cache = mavutil.condition_cache()
         self.filename = filename
         self.separator = separator
         self.message_type = message_type
@@ -173,13 +174,13 @@ class CSVReader(object):
                 return None
             if type is not None and not m.get_type() in type:
                 continue
-            if not mavutil.evaluate_condition(condition, self.messages):
+            if not self.condition_cache.evaluate(condition, self.messages):
                 continue
             return m
 
     def check_condition(self, condition):
         '''check if a condition is true'''
-        return mavutil.evaluate_condition(condition, self.messages)
+        return self.condition_cache.evaluate(condition, self.messages)
 
     def _parse_next(self):
         '''read one message, returning it as an object'''
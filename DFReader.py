@@ -12,11 +12,17 @@ from builtins import range
 from builtins import object
 
 import array
+import bisect
+import copy
+import hashlib
+import io
+import json
 import math
 import sys
 import os
 import mmap
 import platform
+import time
 
 import struct
 import sys
@@ -101,10 +107,40 @@ class DFFormat(object):
             if self.msg_fmts[i] == 'a':
                 self.a_indexes.append(i)
 
+        # per-column converters from raw elements to field values, with
+        # and without multipliers applied
+        self.accessors = {
+            True : [self._make_accessor(i, True) for i in range(len(self.columns))],
+            False : [self._make_accessor(i, False) for i in range(len(self.columns))],
+        }
+
         if oldfmt is not None:
             self.set_unit_ids(oldfmt.unit_ids)
             self.set_mult_ids(oldfmt.mult_ids)
 
+    def _make_accessor(self, i, apply_multiplier):
+        '''return a function converting the raw element for column i into
+        the value DFMessage returns for that field'''
+        if i >= len(self.msg_fmts):
+            def no_format(v):
+                raise IndexError("no format for column %s" % self.columns[i])
+            return no_format
+        c = self.msg_fmts[i]
+        if c == 'Z' and self.name == 'FILE':
+            # special case for FILE contents as bytes
+            return lambda v: v
+        if c == 'a':
+            return decode_bytes
+        mtype = self.msg_types[i]
+        if mtype == str:
+            return lambda v: null_term(mtype(decode_bytes(v)))
+        mul = self.msg_mults[i]
+        if c == 'M' and not apply_multiplier:
+            return decode_bytes
+        if mul is not None and apply_multiplier:
+            return lambda v: mtype(decode_bytes(v)) * mul
+        return lambda v: mtype(decode_bytes(v))
+
     def set_unit_ids(self, unit_ids):
         '''set unit IDs string from FMTU'''
         if unit_ids is None:
@@ -148,6 +184,16 @@ def to_string(s):
             break
     return r + '_XXX'
     
+def decode_bytes(v):
+    '''decode bytes as UTF-8, falling back to western europe, leaving
+    other values unchanged'''
+    if isinstance(v, bytes):
+        try:
+            return v.decode("utf-8")
+        except UnicodeDecodeError:
+            return v.decode("ISO-8859-1")
+    return v
+
 def null_term(str):
     '''null terminate a string'''
     if isinstance(str, bytes):
@@ -158,13 +204,21 @@ def null_term(str):
     return str
 
 
+_unset = object()
+
 class DFMessage(object):
+    __slots__ = ('fmt', '_elements', '_apply_multiplier', '_fieldnames', '_parent',
+                 '_accessors', '_values', '_timestamp', '__dict__')
+
     def __init__(self, fmt, elements, apply_multiplier, parent):
         self.fmt = fmt
         self._elements = elements
         self._apply_multiplier = apply_multiplier
         self._fieldnames = fmt.columns
         self._parent = parent
+        self._accessors = fmt.accessors[apply_multiplier]
+        # decoded field values, filled in on first access
+        self._values = None
 
     def to_dict(self):
         d = {'mavpackettype': self.fmt.name}
@@ -180,25 +234,12 @@ class DFMessage(object):
             i = self.fmt.colhash[field]
         except Exception:
             raise AttributeError(field)
-        if self.fmt.msg_fmts[i] == 'Z' and self.fmt.name == 'FILE':
-            # special case for FILE contens as bytes
-            return self._elements[i]
-        if isinstance(self._elements[i], bytes):
-            try:
-                v = self._elements[i].decode("utf-8")
-            except UnicodeDecodeError:
-                # try western europe
-                v = self._elements[i].decode("ISO-8859-1")
-        else:
-            v = self._elements[i]
-        if self.fmt.format[i] == 'a':
-            pass
-        elif self.fmt.format[i] != 'M' or self._apply_multiplier:
-            v = self.fmt.msg_types[i](v)
-        if self.fmt.msg_types[i] == str:
-            v = null_term(v)
-        if self.fmt.msg_mults[i] is not None and self._apply_multiplier:
-            v *= self.fmt.msg_mults[i]
+        values = self._values
+        if values is None:
+            values = self._values = [_unset] * len(self._fieldnames)
+        v = values[i]
+        if v is _unset:
+            v = values[i] = self._accessors[i](self._elements[i])
         return v
 
     def __setattr__(self, field, value):
@@ -210,6 +251,8 @@ class DFMessage(object):
             if self.fmt.msg_mults[i] is not None and self._apply_multiplier:
                 value /= self.fmt.msg_mults[i]
             self._elements[i] = value
+            if self._values is not None:
+                self._values[i] = _unset
 
     def get_type(self):
         return self.fmt.name
@@ -287,6 +330,8 @@ class DFReaderClock(object):
     def __init__(self):
         self.set_timebase(0)
         self.timestamp = 0
+        # timestamp for messages without a time of their own at the start of the log
+        self.start_timestamp = 0
 
     def _gpsTimeToTime(self, week, msec):
         '''convert GPS week and TOW to a time in seconds since 1970'''
@@ -300,7 +345,15 @@ class DFReaderClock(object):
         pass
 
     def rewind_event(self):
-        pass
+        '''go back to the timestamp at the start of the log'''
+        self.timestamp = self.start_timestamp
+
+    def timestamps_numpy(self, fmt, column):
+        '''return a numpy array of timestamps for messages of format fmt,
+        where column(name) returns a numpy array of raw values for a
+        field. Returns None if this clock can only timestamp messages one
+        at a time'''
+        return None
 
 
 class DFReaderClock_usec(DFReaderClock):
@@ -314,6 +367,7 @@ class DFReaderClock_usec(DFReaderClock):
         self.set_timebase(t - gps.TimeUS*0.000001)
         # this ensures FMT messages get appropriate timestamp:
         self.timestamp = self.timebase + first_us_stamp*0.000001
+        self.start_timestamp = self.timestamp
 
     def type_has_good_TimeMS(self, type):
         '''The TimeMS in some messages is not from *our* clock!'''
@@ -344,6 +398,12 @@ class DFReaderClock_usec(DFReaderClock):
             m._timestamp = self.timestamp
         self.timestamp = m._timestamp
 
+    def timestamps_numpy(self, fmt, column):
+        '''vectorised set_message_timestamp() for TimeUS messages'''
+        if len(fmt.columns) > 0 and fmt.columns[0] == 'TimeUS':
+            return self.timebase + column('TimeUS')*0.000001
+        return None
+
 
 class DFReaderClock_msec(DFReaderClock):
     '''DFReaderClock_msec - a format where many messages have TimeMS in
@@ -353,6 +413,7 @@ class DFReaderClock_msec(DFReaderClock):
         t = self._gpsTimeToTime(gps.Week, gps.TimeMS)
         self.set_timebase(t - gps.T*0.001)
         self.timestamp = self.timebase + first_ms_stamp*0.001
+        self.start_timestamp = self.timestamp
 
     def set_message_timestamp(self, m):
         if 'TimeMS' == m._fieldnames[0]:
@@ -363,6 +424,14 @@ class DFReaderClock_msec(DFReaderClock):
             m._timestamp = self.timestamp
         self.timestamp = m._timestamp
 
+    def timestamps_numpy(self, fmt, column):
+        '''vectorised set_message_timestamp() for TimeMS and GPS messages'''
+        if len(fmt.columns) > 0 and fmt.columns[0] == 'TimeMS':
+            return self.timebase + column('TimeMS')*0.001
+        if fmt.name in ['GPS', 'GPS2']:
+            return self.timebase + column('T')*0.001
+        return None
+
 
 class DFReaderClock_px4(DFReaderClock):
     '''DFReaderClock_px4 - a format where a starting time is explicitly
@@ -399,6 +468,7 @@ class DFReaderClock_gps_interpolated(DFReaderClock):
 
     def rewind_event(self):
         '''reset counters on rewind'''
+        DFReaderClock.rewind_event(self)
         self.counts = {}
         self.counts_since_gps = {}
 
@@ -474,6 +544,7 @@ class DFReader(object):
         self.params = {}
         self._flightmodes = None
         self.messages = {}
+        self.condition_cache = mavutil.condition_cache()
 
     def _rewind(self):
         '''reset state on rewind'''
@@ -648,6 +719,74 @@ class DFReader(object):
             self.params[m.Name] = m.Value
         self._set_time(m)
 
+    def _binary_message(self, fmt, elements):
+        '''create a message from the elements unpacked from a binary log,
+        updating formats and units from FMT and FMTU messages. Returns None
+        if a FMT message can't be used'''
+        # transform elements which can't be done at unpack time:
+        for a_index in fmt.a_indexes:
+            try:
+                elements[a_index] = array.array('h', elements[a_index])
+            except Exception as e:
+                print("Failed to transform array: %s" % str(e),
+                      file=sys.stderr)
+
+        if fmt.name == 'FMT':
+            # add to formats
+            # name, len, format, headings
+            try:
+                ftype = elements[0]
+                mfmt = DFFormat(
+                    ftype,
+                    null_term(elements[2]), elements[1],
+                    null_term(elements[3]), null_term(elements[4]),
+                    oldfmt=self.formats.get(ftype,None))
+                self.formats[ftype] = mfmt
+            except Exception:
+                return None
+
+        m = DFMessage(fmt, elements, True, self)
+
+        if m.fmt.name == 'FMTU':
+            # add to units information
+            FmtType = int(elements[0])
+            UnitIds = elements[1]
+            MultIds = elements[2]
+            if FmtType in self.formats:
+                fmt = self.formats[FmtType]
+                fmt.set_unit_ids(UnitIds)
+                fmt.set_mult_ids(MultIds)
+
+        try:
+            self._add_msg(m)
+        except Exception as ex:
+            print("bad msg at offset %u" % self.offset, ex)
+            pass
+        return m
+
+    def _reset_skipped(self):
+        '''reset the count of bad bytes skipped'''
+        self.skipped_bytes = 0
+        self.skipped_gaps = 0
+        self.first_skipped = None
+
+    def _note_skipped(self, start, end):
+        '''record that the bytes from start to end were not part of a message'''
+        if self.verbose:
+            print("Skipped %u bad bytes in log at offset %u (prev=%s)" %
+                  (end - start, start, self.prev_type), file=sys.stderr)
+        self.skipped_bytes += end - start
+        self.skipped_gaps += 1
+        if self.first_skipped is None:
+            self.first_skipped = start
+
+    def _report_skipped(self):
+        '''print a summary of the bad bytes skipped, and reset the count'''
+        if self.skipped_bytes > 0:
+            print("Skipped %u bad bytes in %u places in log, first at offset %u" %
+                  (self.skipped_bytes, self.skipped_gaps, self.first_skipped), file=sys.stderr)
+        self._reset_skipped()
+
     def recv_match(self, condition=None, type=None, blocking=False):
         '''recv the next message that matches the given condition
         type can be a string or a list of strings'''
@@ -664,13 +803,64 @@ class DFReader(object):
                 return None
             if type is not None and not m.get_type() in type:
                 continue
-            if not mavutil.evaluate_condition(condition, self.messages):
+            if not self.condition_cache.evaluate(condition, self.messages):
                 continue
             return m
 
     def check_condition(self, condition):
         '''check if a condition is true'''
-        return mavutil.evaluate_condition(condition, self.messages)
+        return self.condition_cache.evaluate(condition, self.messages)
+
+    def _checkpoint(self, prev, positions=None):
+        '''return the reader state needed to carry on reading from here,
+        for the seek_time() of DFReader_binary and DFReader_text'''
+        if positions is None:
+            positions = mavutil.message_positions()
+        params = self.params
+        if prev is not None and prev['params'] == params:
+            # share params between checkpoints until they change
+            params = prev['params']
+        else:
+            params = dict(params)
+        return {
+            'offset' : self.offset,
+            'messages' : positions.refs(self.messages, prev['messages'] if prev is not None else None),
+            'params' : params,
+            'flightmode' : self.flightmode,
+            'mav_type' : self.mav_type,
+            'timestamp' : self.timestamp,
+            'clock' : copy.deepcopy(self.clock.__dict__) if self.clock else None,
+        }
+
+    def _restore_checkpoint(self, state):
+        '''go back to a state returned by _checkpoint()'''
+        messages = mavutil.restore_messages(state['messages'], self._decode_at, {})
+        self._rewind()
+        self.offset = state['offset']
+        self.messages.clear()
+        self.messages.update(messages)
+        self.params.clear()
+        self.params.update(state['params'])
+        self.flightmode = state['flightmode']
+        self.mav_type = state['mav_type']
+        self.timestamp = state['timestamp']
+        if self.clock:
+            self.clock.__dict__ = copy.deepcopy(state['clock'])
+
+    def _clear_params(self):
+        '''forget all params seen so far'''
+        self.params.clear()
+
+    def _tell(self):
+        '''return the position of the next message, for build_time_index()'''
+        return self.offset
+
+    def _decode_at(self, ofs):
+        '''decode the first message at or after offset ofs, for
+        _restore_checkpoint()'''
+        self.offset = ofs
+        self.remaining = self.data_len - ofs
+        return self._parse_next()
 
     def param(self, name, default=None):
         '''convenient function for returning an arbitrary MAVLink
@@ -706,11 +896,89 @@ class DFReader(object):
         self._rewind()
         return self._flightmodes
 
-class DFReader_binary(DFReader):
-    '''parse a binary dataflash file'''
-    def __init__(self, filename, zero_time_base=False, progress_callback=None):
+# the two bytes starting every message
+MSG_HEADER = struct.pack('BB', 0xA3, 0x95)
+
+# sidecar index files: header, JSON metadata, then little endian uint64 offsets
+INDEX_MAGIC = b'DFINDEX\0'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<8sIQd20sI')
+INDEX_HASH_LEN = 65536
+
+# number of consecutive messages which must chain together when
+# looking for the first message in a chunk of a log
+RESYNC_CHAIN_LEN = 3
+
+def _valid_chain(data_map, ofs, lengths, data_len):
+    '''return True if a chain of well formed messages starts at ofs'''
+    for i in range(RESYNC_CHAIN_LEN):
+        if ofs+3 > data_len:
+            return True
+        if data_map[ofs:ofs+2] != MSG_HEADER or lengths[u_ord(data_map[ofs+2])] <= 0:
+            return False
+        ofs += lengths[u_ord(data_map[ofs+2])]
+    return True
+
+def _scan_offsets(data_map, ofs, end, lengths, data_len, offsets, stop=None):
+    '''append the offset of every message starting between ofs and end to
+    offsets, a list of 256 arrays. Scanning stops early if an offset in the
+    set stop is reached. Returns the offset scanning stopped at and the
+    number of bad bytes skipped'''
+    bad = 0
+    while ofs < end and ofs+3 < data_len:
+        if stop is not None and ofs in stop:
+            break
+        mtype = u_ord(data_map[ofs+2])
+        if data_map[ofs:ofs+2] != MSG_HEADER or lengths[mtype] <= 0:
+            # not a message; skip to the next header
+            next_ofs = data_map.find(MSG_HEADER, ofs+1, end+1)
+            if next_ofs == -1:
+                next_ofs = end
+            bad += next_ofs - ofs
+            ofs = next_ofs
+            continue
+        offsets[mtype].append(ofs)
+        ofs += lengths[mtype]
+    return (ofs, bad)
+
+def _index_chunk(args):
+    '''find the message offsets in one chunk of a log, run in a worker
+    process by DFReader_binary.init_arrays_parallel()'''
+    (filename, start, end, lengths) = args
+    with open(filename, 'rb') as f:
+        f.seek(0, 2)
+        data_len = f.tell()
+        data_map = mmap.mmap(f.fileno(), data_len, access=mmap.ACCESS_READ)
+    ofs = start
+    if start != 0:
+        # resynchronise on a message header
+        while True:
+            ofs = data_map.find(MSG_HEADER, ofs, end)
+            if ofs == -1:
+                ofs = end
+                break
+            if _valid_chain(data_map, ofs, lengths, data_len):
+                break
+            ofs += 1
+    sync_ofs = ofs
+    offsets = [mavutil.offset_array() for i in range(256)]
+    (ofs, bad) = _scan_offsets(data_map, ofs, end, lengths, data_len, offsets)
+    data_map.close()
+    return (sync_ofs, ofs, bad, offsets)
+
+
+class DFReader_binary(DFReader, mavutil.time_indexed_log):
+    '''parse a binary dataflash file
+
+    If index_cache is True an index of message offsets is kept in
+    filename.idx, making re-opening the same log much faster. If
+    index_processes is more than 1 the log is indexed by that many worker
+    processes using init_arrays_parallel()'''
+    def __init__(self, filename, zero_time_base=False, progress_callback=None, index_cache=False,
+                 index_processes=1):
         DFReader.__init__(self)
         # read the whole file into memory for simplicity
+        self.filename = filename
         self.filehandle = open(filename, 'r')
         self.filehandle.seek(0, 2)
         self.data_len = self.filehandle.tell()
@@ -735,10 +1003,21 @@ class DFReader_binary(DFReader):
         }
         self._zero_time_base = zero_time_base
         self.prev_type = None
+        index_filename = filename + '.idx'
+        if index_cache and self.load_index(index_filename):
+            self._rewind()
+            if progress_callback is not None:
+                progress_callback(100)
+            return
         self.init_clock()
         self.prev_type = None
         self._rewind()
-        self.init_arrays(progress_callback)
+        if index_processes > 1:
+            self.init_arrays_parallel(progress_callback, processes=index_processes)
+        else:
+            self.init_arrays(progress_callback)
+        if index_cache:
+            self.save_index(index_filename)
 
     def _rewind(self):
         '''rewind to start of log'''
@@ -747,6 +1026,7 @@ class DFReader_binary(DFReader):
         self.remaining = self.data_len
         self.type_nums = None
         self.timestamp = 0
+        self._reset_skipped()
 
     def rewind(self):
         '''rewind to start of log'''
@@ -760,7 +1040,7 @@ class DFReader_binary(DFReader):
         self.name_to_id = {}
         self.id_to_name = {}
         for i in range(256):
-            self.offsets.append([])
+            self.offsets.append(mavutil.offset_array())
             self.counts.append(0)
         fmt_type = 0x80
         fmtu_type = None
@@ -770,15 +1050,17 @@ class DFReader_binary(DFReader):
         HEAD2 = self.HEAD2
         lengths = [-1] * 256
 
+        self._reset_skipped()
         while ofs+3 < self.data_len:
             hdr = self.data_map[ofs:ofs+3]
             if hdr[0] != HEAD1 or hdr[1] != HEAD2:
+                bad_ofs = ofs
+                ofs = self._find_header(ofs+1)
                 # avoid end of file garbage, 528 bytes has been use consistently throughout this implementation
                 # but it needs to be at least 249 bytes which is the block based logging page size (256) less a 6 byte header and
                 # one byte of data. Block based logs are sized in pages which means they can have up to 249 bytes of trailing space.
-                if self.data_len - ofs >= 528 or self.data_len < 528:
-                    print("bad header 0x%02x 0x%02x at %d" % (u_ord(hdr[0]), u_ord(hdr[1]), ofs), file=sys.stderr)
-                ofs += 1
+                if self.data_len - bad_ofs >= 528 or self.data_len < 528:
+                    self._note_skipped(bad_ofs, ofs)
                 continue
             mtype = u_ord(hdr[2])
             self.offsets[mtype].append(ofs)
@@ -841,6 +1123,243 @@ class DFReader_binary(DFReader):
         for i in range(256):
             self._count += self.counts[i]
         self.offset = 0
+        self._report_skipped()
+
+    def _find_header(self, ofs):
+        '''return the offset of the next message header at or after ofs
+        with a known message type, or the length of the log if there is none'''
+        while True:
+            ofs = self.data_map.find(MSG_HEADER, ofs)
+            if ofs == -1 or ofs+2 >= self.data_len:
+                return self.data_len
+            if u_ord(self.data_map[ofs+2]) in self.formats:
+                return ofs
+            ofs += 1
+
+    def _harvest_formats(self):
+        '''find the FMT and FMTU messages in the log without a full scan,
+        returning a list of message lengths indexed by type'''
+        self.name_to_id = {}
+        self.id_to_name = {}
+        lengths = [-1] * 256
+        lengths[0x80] = self.formats[0x80].len
+        fmt = self.formats[0x80]
+        ofs = 0
+        while True:
+            ofs = self.data_map.find(MSG_HEADER + struct.pack('B', 0x80), ofs)
+            if ofs == -1 or ofs + fmt.len > self.data_len:
+                break
+            # FMT messages are followed by another message or the end of the log
+            next_ofs = ofs + fmt.len
+            if next_ofs + 2 <= self.data_len and self.data_map[next_ofs:next_ofs+2] != MSG_HEADER:
+                ofs += 1
+                continue
+            elements = struct.unpack(fmt.msg_struct, self.data_map[ofs+3:next_ofs])
+            ftype = elements[0]
+            format = null_term(elements[3])
+            if elements[1] < 3 or any(c not in FORMAT_TO_STRUCT for c in format):
+                ofs += 1
+                continue
+            mfmt = DFFormat(ftype,
+                            null_term(elements[2]), elements[1],
+                            format, null_term(elements[4]),
+                            oldfmt=self.formats.get(ftype,None))
+            self.formats[ftype] = mfmt
+            self.name_to_id[mfmt.name] = mfmt.type
+            self.id_to_name[mfmt.type] = mfmt.name
+            if lengths[ftype] == -1:
+                lengths[ftype] = mfmt.len
+            ofs = next_ofs
+
+        fmtu_type = self.name_to_id.get('FMTU', None)
+        if fmtu_type is None:
+            return lengths
+        fmtu = self.formats[fmtu_type]
+        ofs = 0
+        while True:
+            ofs = self.data_map.find(MSG_HEADER + struct.pack('B', fmtu_type), ofs)
+            if ofs == -1 or ofs + fmtu.len > self.data_len:
+                break
+            if not _valid_chain(self.data_map, ofs, lengths, self.data_len):
+                ofs += 1
+                continue
+            elements = struct.unpack(fmtu.msg_struct, self.data_map[ofs+3:ofs+fmtu.len])
+            ftype = int(elements[1])
+            if ftype in self.formats:
+                fmt2 = self.formats[ftype]
+                if 'UnitIds' in fmtu.colhash:
+                    fmt2.set_unit_ids(null_term(elements[fmtu.colhash['UnitIds']]))
+                if 'MultIds' in fmtu.colhash:
+                    fmt2.set_mult_ids(null_term(elements[fmtu.colhash['MultIds']]))
+            ofs += fmtu.len
+        return lengths
+
+    def init_arrays_parallel(self, progress_callback=None, processes=None, chunk_size=None):
+        '''initialise arrays for fast recv_match() using a pool of worker
+        processes. A first pass finds the FMT and FMTU messages, then the
+        log is split into chunks which are scanned in parallel, each
+        resynchronising on a message header at its start. Chunk boundaries
+        are checked against the message chain of the previous chunk.
+        Bytes which are not part of a message are skipped'''
+        import multiprocessing
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if chunk_size is None:
+            chunk_size = max(self.data_len // (processes*4), 1<<20)
+        lengths = self._harvest_formats()
+
+        chunks = []
+        for start in range(0, self.data_len, chunk_size):
+            chunks.append((self.filename, start, min(start+chunk_size, self.data_len), lengths))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = []
+            for r in pool.imap(_index_chunk, chunks):
+                results.append(r)
+                if progress_callback is not None:
+                    progress_callback((100 * len(results)) // len(chunks))
+        finally:
+            pool.close()
+            pool.join()
+
+        offsets = [mavutil.offset_array() for i in range(256)]
+        bad = 0
+        next_ofs = 0
+        for (sync_ofs, end_ofs, chunk_bad, chunk_offsets) in results:
+            if sync_ofs != next_ofs:
+                # the previous chunk's last message ended somewhere other
+                # than where this chunk resynchronised; follow the message
+                # chain until it joins up with this chunk's offsets
+                known = set()
+                for a in chunk_offsets:
+                    known.update(a)
+                (next_ofs, skipped) = _scan_offsets(self.data_map, next_ofs, end_ofs, lengths,
+                                                    self.data_len, offsets, stop=known)
+                bad += skipped
+                if next_ofs not in known:
+                    continue
+                for i in range(256):
+                    a = chunk_offsets[i]
+                    chunk_offsets[i] = a[bisect.bisect_left(a, next_ofs):]
+            for i in range(256):
+                offsets[i].extend(chunk_offsets[i])
+            bad += chunk_bad
+            next_ofs = end_ofs
+        if bad > 0:
+            print("Skipped %u bad bytes in log" % bad, file=sys.stderr)
+
+        self.offsets = offsets
+        self.counts = [len(a) for a in offsets]
+        self._count = sum(self.counts)
+
+        # parse the same messages as init_arrays() so self.messages and
+        # the instance messages are populated
+        parse_ofs = []
+        for i in range(256):
+            if len(self.offsets[i]) == 0 or i not in self.formats:
+                continue
+            if self.formats[i].instance_field is not None:
+                parse_ofs.extend(self.offsets[i])
+            else:
+                parse_ofs.append(self.offsets[i][0])
+        for ofs in sorted(parse_ofs):
+            self.offset = ofs
+            self._parse_next()
+        self.offset = 0
+
+    def _index_header(self):
+        '''return the header identifying this log in an index file'''
+        st = os.fstat(self.filehandle.fileno())
+        digest = hashlib.sha1(self.data_map[:INDEX_HASH_LEN]).digest()
+        return (INDEX_MAGIC, INDEX_VERSION, self.data_len, st.st_mtime, digest)
+
+    def save_index(self, filename):
+        '''save the message offsets, formats and clock to an index file,
+        returning True on success'''
+        formats = []
+        for fmt in self.formats.values():
+            formats.append([fmt.type, fmt.name, fmt.len, fmt.format, ','.join(fmt.columns),
+                            fmt.unit_ids, fmt.mult_ids])
+        types = [i for i in range(256) if len(self.offsets[i]) > 0]
+        meta = {
+            'zero_time_base' : self._zero_time_base,
+            'clock' : (self.clock.__class__.__name__, self.clock.__dict__),
+            'formats' : formats,
+            'counts' : [[i, self.counts[i]] for i in range(256) if self.counts[i] != 0],
+            'offsets' : [[i, len(self.offsets[i])] for i in types],
+        }
+        meta = json.dumps(meta).encode('utf-8')
+        tmpname = filename + '.tmp'
+        try:
+            with open(tmpname, 'wb') as f:
+                f.write(INDEX_HEADER.pack(*(self._index_header() + (len(meta),))))
+                f.write(meta)
+                for i in types:
+                    mavutil.write_offsets(f, self.offsets[i])
+            mavutil.replace_file(tmpname, filename)
+        except (IOError, OSError) as ex:
+            print("Failed to save index %s: %s" % (filename, ex), file=sys.stderr)
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def load_index(self, filename):
+        '''load an index file written by save_index(), returning False if
+        it is missing or does not match this log'''
+        try:
+            f = open(filename, 'rb')
+        except (IOError, OSError):
+            return False
+        with f:
+            f.seek(0, 2)
+            idx_len = f.tell()
+            if idx_len < INDEX_HEADER.size:
+                return False
+            idx_map = mmap.mmap(f.fileno(), idx_len, access=mmap.ACCESS_READ)
+        try:
+            hdr = INDEX_HEADER.unpack_from(idx_map, 0)
+            if hdr[:5] != self._index_header():
+                return False
+            ofs = INDEX_HEADER.size
+            meta = json.loads(idx_map[ofs:ofs+hdr[5]].decode('utf-8'))
+            ofs += hdr[5]
+            if meta['zero_time_base'] != self._zero_time_base:
+                return False
+
+            offsets = [mavutil.offset_array() for i in range(256)]
+            for (i, n) in meta['offsets']:
+                a = mavutil.read_offsets(idx_map[ofs:ofs+8*n])
+                if len(a) != n:
+                    return False
+                offsets[i] = a
+                ofs += 8*n
+        except (ValueError, KeyError, TypeError, struct.error):
+            return False
+        finally:
+            idx_map.close()
+
+        self.name_to_id = {}
+        self.id_to_name = {}
+        for (ftype, name, flen, format, columns, unit_ids, mult_ids) in meta['formats']:
+            fmt = DFFormat(ftype, name, flen, format, columns)
+            fmt.set_unit_ids(unit_ids)
+            fmt.set_mult_ids(mult_ids)
+            self.formats[ftype] = fmt
+            self.name_to_id[fmt.name] = ftype
+            self.id_to_name[ftype] = fmt.name
+        self.offsets = offsets
+        self.counts = [0] * 256
+        for (i, n) in meta['counts']:
+            self.counts[i] = n
+        self._count = sum(self.counts)
+
+        (clock_name, clock_state) = meta['clock']
+        self.clock = globals()[clock_name]()
+        self.clock.__dict__.update(clock_state)
+        return True
 
     def last_timestamp(self):
         '''get the last timestamp in the log'''
@@ -864,6 +1383,102 @@ class DFReader_binary(DFReader):
             m = self.recv_msg()
         return m._timestamp
 
+    def extract_columns(self, type, fields=None, instance=None):
+        '''return a numpy structured array with one row for every message
+        of the given type, holding the fields listed in fields (default
+        all columns) plus a _timestamp column. Records are read straight
+        from the mmap using the offsets found by init_arrays(), and
+        multipliers are applied as in DFMessage. If instance is given only
+        messages with that value of the instance field are returned.
+
+        Timestamps come from the active clock; clocks which can't be
+        vectorised fall back to reading the whole log'''
+        import numpy as np
+        if type not in self.name_to_id:
+            raise KeyError("Unknown message type %s" % type)
+        fmt = self.formats[self.name_to_id[type]]
+        if fields is None:
+            fields = fmt.columns
+        for f in fields:
+            if f not in fmt.colhash:
+                raise KeyError("Unknown field %s.%s" % (type, f))
+
+        # build a dtype matching the on-disk layout of the message body
+        wire_fields = []
+        for (name, c) in zip(fmt.columns, fmt.msg_fmts):
+            if c == 'a':
+                wire_fields.append((name, '<i2', (32,)))
+                continue
+            s = FORMAT_TO_STRUCT[c][0]
+            if s.endswith('s'):
+                wire_fields.append((name, 'S' + s[:-1]))
+            else:
+                wire_fields.append((name, '<' + s))
+        wire_dtype = np.dtype(wire_fields)
+        rsize = wire_dtype.itemsize
+
+        offsets = np.array(self.offsets[fmt.type], dtype=np.int64)
+        # a truncated message at the end of the log can't be decoded
+        offsets = offsets[offsets + 3 + rsize <= self.data_len]
+        data = np.frombuffer(self.data_map, dtype=np.uint8)
+        raw = np.empty((len(offsets), rsize), dtype=np.uint8)
+        # gather in chunks to bound the size of the index array
+        col = np.arange(3, 3 + rsize)
+        chunk = 65536
+        for i in range(0, len(offsets), chunk):
+            ofs = offsets[i:i+chunk]
+            raw[i:i+chunk] = data[ofs[:,np.newaxis] + col[np.newaxis,:]]
+        records = raw.view(wire_dtype).reshape(len(offsets))
+
+        timestamps = self.clock.timestamps_numpy(fmt, lambda f: records[f]) if self.clock else None
+        if timestamps is None:
+            timestamps = self._message_timestamps(type, len(records))
+
+        if instance is not None:
+            if fmt.instance_field is None:
+                raise ValueError("%s has no instance field" % type)
+            ifield = records[fmt.instance_field]
+            if ifield.dtype.kind == 'S':
+                instance = np.array(instance).astype(ifield.dtype)
+            keep = ifield == instance
+            records = records[keep]
+            timestamps = timestamps[keep]
+
+        out_fields = []
+        for f in fields:
+            i = fmt.colhash[f]
+            if fmt.msg_mults[i] is not None:
+                out_fields.append((f, 'f8'))
+            else:
+                out_fields.append(wire_dtype.descr[i])
+        ret = np.zeros(len(records), dtype=out_fields + [('_timestamp', 'f8')])
+        for f in fields:
+            mul = fmt.msg_mults[fmt.colhash[f]]
+            if mul is not None:
+                ret[f] = records[f] * mul
+            else:
+                ret[f] = records[f]
+        ret['_timestamp'] = timestamps
+        return ret
+
+    def _message_timestamps(self, type, count):
+        '''timestamp the first count messages of a type by reading the
+        whole log, so the clock sees every message as it does for
+        recv_msg(). The reader is left where it was'''
+        import numpy as np
+        ret = np.zeros(count)
+        state = self._checkpoint(None)
+        self._rewind()
+        i = 0
+        while i < count:
+            m = self.recv_msg()
+            if m is None:
+                break
+            if m.get_type() == type:
+                ret[i] = m._timestamp
+                i += 1
+        self._restore_checkpoint(state)
+        return ret
 
     def skip_to_type(self, type):
         '''skip fwd to next msg matching given type set'''
@@ -872,26 +1487,13 @@ class DFReader_binary(DFReader):
             # always add some key msg types so we can track flightmode, params etc
             type = type.copy()
             type.update(set(['MODE','MSG','PARM','STAT']))
-            self.indexes = []
-            self.type_nums = []
-            for t in type:
-                if not t in self.name_to_id:
-                    continue
-                self.type_nums.append(self.name_to_id[t])
-                self.indexes.append(0)
-        smallest_index = -1
-        smallest_offset = self.data_len
-        for i in range(len(self.type_nums)):
-            mtype = self.type_nums[i]
-            if self.indexes[i] >= self.counts[mtype]:
-                continue
-            ofs = self.offsets[mtype][self.indexes[i]]
-            if ofs < smallest_offset:
-                smallest_offset = ofs
-                smallest_index = i
-        if smallest_index >= 0:
-            self.indexes[smallest_index] += 1
-            self.offset = smallest_offset
+            self.type_nums = [self.name_to_id[t] for t in type if t in self.name_to_id]
+            self.type_offsets = [self.offsets[mtype] for mtype in self.type_nums]
+            # start from the current position, which may follow a seek_time()
+            self.type_heap = mavutil.offset_heap(self.type_offsets, self.offset)
+        ofs = mavutil.pop_offset(self.type_heap, self.type_offsets)
+        if ofs is not None:
+            self.offset = ofs
 
     def _parse_next(self):
         '''read one message, returning it as an object'''
@@ -899,39 +1501,30 @@ class DFReader_binary(DFReader):
         # skip over bad messages; after this loop has run msg_type
         # indicates the message which starts at self.offset (including
         # signature bytes and msg_type itself)
-        skip_type = None
-        skip_start = 0
+        skip_start = None
         while True:
             if self.data_len - self.offset < 3:
+                self._report_skipped()
                 return None
 
             hdr = self.data_map[self.offset:self.offset+3]
             if hdr[0] == self.HEAD1 and hdr[1] == self.HEAD2:
-                # signature found
-                if skip_type is not None:
-                    # emit message about skipped bytes
-                    if self.remaining >= 528:
-                        # APM logs often contain garbage at end
-                        skip_bytes = self.offset - skip_start
-                        print("Skipped %u bad bytes in log at offset %u, type=%s (prev=%s)" %
-                              (skip_bytes, skip_start, skip_type, self.prev_type),
-                          file=sys.stderr)
-                    skip_type = None
-                # check we recognise this message type:
+                # signature found; check we recognise this message type:
                 msg_type = u_ord(hdr[2])
                 if msg_type in self.formats:
                     # recognised message found
-                    self.prev_type = msg_type
-                    break;
-                # message was not recognised; fall through so these
-                # bytes are considered "skipped".  The signature bytes
-                # are easily recognisable in the "Skipped bytes"
-                # message.
-            if skip_type is None:
-                skip_type = (u_ord(hdr[0]), u_ord(hdr[1]), u_ord(hdr[2]))
+                    break
+            # search for the next recognised message, these bytes are
+            # considered "skipped"
+            if skip_start is None:
                 skip_start = self.offset
-            self.offset += 1
-            self.remaining -= 1
+            self.offset = self._find_header(self.offset+1)
+            self.remaining = self.data_len - self.offset
+
+        if skip_start is not None and self.remaining >= 528:
+            # APM logs often contain garbage at end
+            self._note_skipped(skip_start, self.offset)
+        self.prev_type = msg_type
 
         self.offset += 3
         self.remaining = self.data_len - self.offset
@@ -941,6 +1534,7 @@ class DFReader_binary(DFReader):
             # out of data - can often happen half way through a message
             if self.verbose:
                 print("out of data", file=sys.stderr)
+            self._report_skipped()
             return None
         body = self.data_map[self.offset:self.offset+fmt.len-3]
         elements = None
@@ -952,6 +1546,7 @@ class DFReader_binary(DFReader):
             print(ex)
             if self.remaining < 528:
                 # we can have garbage at the end of an APM2 log
+                self._report_skipped()
                 return None
             # we should also cope with other corruption; logs
             # transferred via DataFlash_MAVLink may have blocks of 0s
@@ -961,50 +1556,171 @@ class DFReader_binary(DFReader):
                   file=sys.stderr)
         if elements is None:
             return self._parse_next()
-        name = fmt.name
-        # transform elements which can't be done at unpack time:
-        for a_index in fmt.a_indexes:
-            try:
-                elements[a_index] = array.array('h', elements[a_index])
-            except Exception as e:
-                print("Failed to transform array: %s" % str(e),
-                      file=sys.stderr)
+        m = self._binary_message(fmt, elements)
+        if m is None:
+            return self._parse_next()
+        self.offset += fmt.len - 3
+        self.remaining = self.data_len - self.offset
+        self.percent = 100.0 * (self.offset / float(self.data_len))
 
-        if name == 'FMT':
-            # add to formats
-            # name, len, format, headings
+        return m
+
+class DFReader_stream(DFReader):
+    '''parse a binary dataflash log incrementally from a filename, a
+    file-like object or an iterator of byte strings, for logs which are
+    still being written or which arrive over a pipe or socket.
+
+    Only a small buffer of the log is held in memory, so the log can't be
+    rewound or indexed. The start of the log is read ahead (up to
+    clock_lookahead bytes) to work out the clock. With follow=True
+    recv_msg() waits for more data at the end of a regular file instead
+    of returning None'''
+    def __init__(self, source, zero_time_base=False, follow=False,
+                 chunk_size=65536, clock_lookahead=4*1024*1024, poll_interval=0.1):
+        DFReader.__init__(self)
+        if isinstance(source, str):
+            source = open(source, 'rb')
+        self.source = source
+        if hasattr(source, 'read'):
+            self._read = getattr(source, 'read1', source.read)
             try:
-                ftype = elements[0]
-                mfmt = DFFormat(
-                    ftype,
-                    null_term(elements[2]), elements[1],
-                    null_term(elements[3]), null_term(elements[4]),
-                    oldfmt=self.formats.get(ftype,None))
-                self.formats[ftype] = mfmt
+                import stat
+                self._regular_file = stat.S_ISREG(os.fstat(source.fileno()).st_mode)
             except Exception:
-                return self._parse_next()
+                self._regular_file = False
+        else:
+            chunks = iter(source)
+            self._read = lambda n: next(chunks, b'')
+            self._regular_file = False
+        self.follow = follow
+        self.chunk_size = chunk_size
+        self.clock_lookahead = clock_lookahead
+        self.poll_interval = poll_interval
+        self.buf = bytearray()
+        # offset in buf of the next message, and of buf in the log
+        self.buf_index = 0
+        self.buf_offset = 0
+        self.eof = False
 
-        self.offset += fmt.len - 3
-        self.remaining = self.data_len - self.offset
-        m = DFMessage(fmt, elements, True, self)
+        self.unpackers = {}
+        self.formats = {
+            0x80: DFFormat(0x80,
+                           'FMT',
+                           89,
+                           'BBnNZ',
+                           "Type,Length,Name,Format,Columns")
+        }
+        self._zero_time_base = zero_time_base
+        self.prev_type = None
+        self._reset_skipped()
 
-        if m.fmt.name == 'FMTU':
-            # add to units information
-            FmtType = int(elements[0])
-            UnitIds = elements[1]
-            MultIds = elements[2]
-            if FmtType in self.formats:
-                fmt = self.formats[FmtType]
-                fmt.set_unit_ids(UnitIds)
-                fmt.set_mult_ids(MultIds)
+        # the clock is worked out from buffered data, which is kept until
+        # it is known and then parsed again
+        self._init_done = False
+        self.init_clock()
+        self._init_done = True
+        self.prev_type = None
+
+    def _rewind(self):
+        '''go back to the start of the data read while finding the clock'''
+        DFReader._rewind(self)
+        self.timestamp = 0
+        self.percent = 0
+        if not self._init_done:
+            self.buf_index = 0
+            self._reset_skipped()
+
+    def skip_to_type(self, type):
+        '''streams have no index, so recv_match() reads every message'''
+        pass
 
+    def seek_time(self, t):
+        '''streams only hold a small buffer of the log and can't be
+        rewound, so they can't seek. Use DFReader_binary for that'''
+        raise io.UnsupportedOperation("seek_time() is not supported on streams")
+
+    def iter_range(self, t0, t1, types=None):
+        '''streams can't seek, see seek_time()'''
+        raise io.UnsupportedOperation("iter_range() is not supported on streams")
+
+    @property
+    def offset(self):
+        '''offset in the log of the next message'''
+        return self.buf_offset + self.buf_index
+
+    def _fill(self, n):
+        '''make sure at least n bytes are buffered from buf_index, returning
+        False if the log ends first'''
+        while len(self.buf) - self.buf_index < n:
+            if not self._init_done and len(self.buf) >= self.clock_lookahead:
+                # give up looking ahead for the clock
+                return False
+            data = None
+            if not self.eof:
+                data = self._read(self.chunk_size)
+                if not data:
+                    self.eof = True
+            if not data:
+                if not (self.follow and self._regular_file and self._init_done):
+                    return False
+                # tail a file which is still being written
+                time.sleep(self.poll_interval)
+                self.eof = False
+                continue
+            if self._init_done and self.buf_index > self.chunk_size:
+                # discard data which has been parsed
+                del self.buf[:self.buf_index]
+                self.buf_offset += self.buf_index
+                self.buf_index = 0
+            self.buf.extend(data)
+        return True
+
+    def _parse_next(self):
+        '''read one message, returning it as an object'''
+        skip_start = None
+        while True:
+            if not self._fill(3):
+                self._report_skipped()
+                return None
+            i = self.buf_index
+            if self.buf[i:i+2] == MSG_HEADER and self.buf[i+2] in self.formats:
+                msg_type = self.buf[i+2]
+                break
+            # search for the next header, these bytes are considered "skipped"
+            if skip_start is None:
+                skip_start = self.offset
+            j = self.buf.find(MSG_HEADER, i+1)
+            if j == -1:
+                # keep a possible partial header at the end of the buffer
+                j = max(len(self.buf)-1, i+1)
+            self.buf_index = j
+
+        if skip_start is not None:
+            self._note_skipped(skip_start, self.offset)
+        self.prev_type = msg_type
+
+        fmt = self.formats[msg_type]
+        if not self._fill(fmt.len):
+            # out of data - can often happen half way through a message
+            if self.verbose:
+                print("out of data", file=sys.stderr)
+            self._report_skipped()
+            return None
         try:
-            self._add_msg(m)
+            if not msg_type in self.unpackers:
+                self.unpackers[msg_type] = struct.Struct(fmt.msg_struct).unpack_from
+            elements = list(self.unpackers[msg_type](self.buf, self.buf_index+3))
         except Exception as ex:
-            print("bad msg at offset %u" % self.offset, ex)
-            pass
-        self.percent = 100.0 * (self.offset / float(self.data_len))
+            print("Failed to parse %s/%s: %s" % (fmt.name, fmt.msg_struct, ex),
+                  file=sys.stderr)
+            self.buf_index += 1
+            return self._parse_next()
 
+        m = self._binary_message(fmt, elements)
+        if m is None:
+            self.buf_index += 1
+            return self._parse_next()
+        self.buf_index += fmt.len
         return m
 
 
@@ -1016,7 +1732,7 @@ def DFReader_is_text_log(filename):
     return ret
 
 
-class DFReader_text(DFReader):
+class DFReader_text(DFReader, mavutil.time_indexed_log):
     '''parse a text dataflash file'''
     def __init__(self, filename, zero_time_base=False, progress_callback=None):
         DFReader.__init__(self)
@@ -1075,7 +1791,7 @@ class DFReader_text(DFReader):
                 mtype = mtype[0:3]
             if not mtype in self.offsets:
                 self.counts[mtype] = 0
-                self.offsets[mtype] = []
+                self.offsets[mtype] = mavutil.offset_array()
                 self.offset = ofs
                 self._parse_next()
             self.offsets[mtype].append(ofs)
@@ -1110,26 +1826,13 @@ class DFReader_text(DFReader):
             # always add some key msg types so we can track flightmode, params etc
             self.type_list = type.copy()
             self.type_list.update(set(['MODE','MSG','PARM','STAT']))
-            self.type_list = list(self.type_list)
-            self.indexes = []
-            self.type_nums = []
-            for t in self.type_list:
-                self.indexes.append(0)
-        smallest_index = -1
-        smallest_offset = self.data_len
-        for i in range(len(self.type_list)):
-            mtype = self.type_list[i]
-            if not mtype in self.counts:
-                continue
-            if self.indexes[i] >= self.counts[mtype]:
-                continue
-            ofs = self.offsets[mtype][self.indexes[i]]
-            if ofs < smallest_offset:
-                smallest_offset = ofs
-                smallest_index = i
-        if smallest_index >= 0:
-            self.indexes[smallest_index] += 1
-            self.offset = smallest_offset
+            self.type_list = [t for t in self.type_list if t in self.offsets]
+            self.type_offsets = [self.offsets[t] for t in self.type_list]
+            # start from the current position, which may follow a seek_time()
+            self.type_heap = mavutil.offset_heap(self.type_offsets, self.offset)
+        ofs = mavutil.pop_offset(self.type_heap, self.type_offsets)
+        if ofs is not None:
+            self.offset = ofs
 
     def _parse_next(self):
         '''read one message, returning it as an object'''
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+'''
+benchmark the x25crc backends and MAVLink pack/decode
+'''
+from __future__ import print_function
+import time
+import random
+
+from pymavlink.generator import mavcrc
+
+#using argparse to receive options from the command line
+from argparse import ArgumentParser
+parser = ArgumentParser(description=__doc__)
+
+parser.add_argument("--count", type=int, default=20000, help="number of frames")
+parser.add_argument("--length", type=int, default=40, help="frame length")
+args = parser.parse_args()
+
+
+def bitwise_crc(buf):
+    '''the original byte-at-a-time implementation, for comparison'''
+    accum = 0xffff
+    for b in buf:
+        tmp = b ^ (accum & 0xff)
+        tmp = (tmp ^ (tmp<<4)) & 0xFF
+        accum = (accum>>8) ^ (tmp<<8) ^ (tmp<<3) ^ (tmp>>4)
+    return accum
+
+frames = [bytearray(random.getrandbits(8) for i in range(args.length)) for j in range(args.count)]
+nbytes = args.count * args.length
+
+
+def report(name, dt, base=None):
+    speedup = ""
+    if base is not None:
+        speedup = " (%.1fx)" % (base / dt)
+    print("%-12s %8.3fs %8.1f MB/s%s" % (name, dt, nbytes * 1.0e-6 / dt, speedup))
+
+t0 = time.time()
+expected = [bitwise_crc(f) for f in frames]
+base = time.time() - t0
+report("bitwise", base)
+
+for name in sorted(mavcrc.backends.keys()):
+    mavcrc.set_backend(name)
+    t0 = time.time()
+    got = [mavcrc.x25crc(f).crc for f in frames]
+    report(name, time.time() - t0, base)
+    assert got == expected
+
+    t0 = time.time()
+    got = mavcrc.crc_many(frames)
+    report(name + " many", time.time() - t0, base)
+    assert got == expected
+
+try:
+    from pymavlink.dialects.v20 import common as mavlink2
+except ImportError:
+    mavlink2 = None
+
+if mavlink2 is not None:
+    # time a complete pack and decode cycle for ATTITUDE
+    class fifo(object):
+        def write(self, data):
+            pass
+    mav = mavlink2.MAVLink(fifo())
+    msg = mav.attitude_encode(1, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6)
+    buf = msg.pack(mav)
+    for name in sorted(mavcrc.backends.keys()):
+        mavcrc.set_backend(name)
+        t0 = time.time()
+        for i in range(args.count):
+            mav.decode(bytearray(buf))
+        dt = time.time() - t0
+        print("%-12s %8.3fs %8.0f decodes/s" % (name + " decode", dt, args.count / dt))
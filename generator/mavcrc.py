@@ -5,6 +5,77 @@ Copyright Andrew Tridgell
 Released under GNU LGPL version 3 or later
 '''
 from builtins import object
+from builtins import range
+import sys
+
+
+def _crc_table_entry(i):
+    '''return the CRC update for a single (crc ^ byte) value'''
+    tmp = (i ^ (i<<4)) & 0xFF
+    return ((tmp<<8) ^ (tmp<<3) ^ (tmp>>4)) & 0xFFFF
+
+# 256 entry lookup table, allowing one table lookup per byte
+crc_table = [_crc_table_entry(i) for i in range(256)]
+
+
+def accumulate_table(crc, buf):
+    '''add in some more bytes using the lookup table (pure python)'''
+    if sys.version_info.major < 3 and isinstance(buf, memoryview):
+        # python2 memoryviews give single character strings, not ints
+        buf = bytearray(buf)
+    table = crc_table
+    for b in buf:
+        crc = (crc>>8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+try:
+    # the C implementation from the mavnative extension
+    from mavnative import x25crc_accumulate as _native_accumulate
+except ImportError:
+    _native_accumulate = None
+
+
+def accumulate_native(crc, buf):
+    '''add in some more bytes using the mavnative C extension'''
+    try:
+        return _native_accumulate(buf, crc)
+    except TypeError:
+        # not a bytes-like object, for example a list of ints
+        return accumulate_table(crc, buf)
+
+backends = {'table': accumulate_table}
+if _native_accumulate is not None:
+    backends['native'] = accumulate_native
+
+_accumulate = accumulate_table
+backend = 'table'
+
+
+def set_backend(name):
+    '''select the CRC implementation used by x25crc, one of backends'''
+    global _accumulate, backend
+    if name not in backends:
+        raise ValueError("Unknown CRC backend '%s' (available: %s)" % (
+            name, ', '.join(sorted(backends.keys()))))
+    _accumulate = backends[name]
+    backend = name
+
+if _native_accumulate is not None:
+    set_backend('native')
+
+
+def crc_many(buffers, crc_extra=None):
+    '''calculate the CRC of each buffer in buffers, returning a list of crcs.
+    If crc_extra is given it is accumulated after each buffer, as is done
+    when checking a MAVLink frame'''
+    accumulate = _accumulate
+    ret = []
+    for buf in buffers:
+        crc = accumulate(0xffff, buf)
+        if crc_extra is not None:
+            crc = (crc>>8) ^ crc_table[(crc ^ crc_extra) & 0xFF]
+        ret.append(crc)
+    return ret
 
 
 class x25crc(object):
@@ -19,12 +90,7 @@ class x25crc(object):
 
     def accumulate(self, buf):
         '''add in some more bytes'''
-        accum = self.crc
-        for b in buf:
-            tmp = b ^ (accum & 0xff)
-            tmp = (tmp ^ (tmp<<4)) & 0xFF
-            accum = (accum>>8) ^ (tmp<<8) ^ (tmp<<3) ^ (tmp>>4)
-        self.crc = accum
+        self.crc = _accumulate(self.crc, buf)
 
     def accumulate_str(self, buf):
         '''add in some more bytes'''
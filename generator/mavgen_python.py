@@ -104,6 +104,16 @@ def to_string(s):
     return r + '_XXX'
 
 
+def decode_string(s):
+    '''convert a char[] field to a string, stopping at the first NUL'''
+    if sys.version_info.major >= 3:
+        s = to_string(s)
+    i = s.find(chr(0))
+    if i == -1:
+        return s
+    return s[0:i]
+
+
 class MAVLink_header(object):
     '''MAVLink message header'''
     def __init__(self, msgId, incompat_flags=0, compat_flags=0, mlen=0, seq=0, srcSystem=0, srcComponent=0):
@@ -126,17 +136,49 @@ class MAVLink_header(object):
 
 class MAVLink_message(object):
     '''base MAVLink message class'''
+    # per-instance bookkeeping. The header is kept packed into a single
+    # int and only turned into a MAVLink_header by get_header(). __dict__
+    # is kept for fields which clash with class attributes and for
+    # attributes added by applications
+    __slots__ = ('_header_bits', '_payload_buf', '_msgbuf', '_crc', '_signed',
+                 '_link_id', '_instances', '_timestamp', '_posted', '_link', '__dict__')
+
+    # per message type metadata, set as class attributes by each message class
+    _type = None
+    _fieldnames = []
+    _instance_field = None
+    _instance_offset = -1
+
     def __init__(self, msgId, name):
-        self._header     = MAVLink_header(msgId)
-        self._payload    = None
+        self._set_header(msgId)
+        self._payload_buf = None
         self._msgbuf     = None
         self._crc        = None
-        self._fieldnames = []
-        self._type       = name
         self._signed     = False
         self._link_id    = None
         self._instances  = None
-        self._instance_field = None
+        if name != self._type:
+            # a generic message, not one of the generated classes
+            self._type = name
+
+    def _set_header(self, msgId, incompat_flags=0, compat_flags=0, mlen=0, seq=0, srcSystem=0, srcComponent=0):
+        '''store the header fields packed into a single int'''
+        self._header_bits = (seq | (srcSystem<<8) | (srcComponent<<16) | (mlen<<24) |
+                             (incompat_flags<<32) | (compat_flags<<40) | (msgId<<48))
+
+    def _get_header(self):
+        bits = self._header_bits
+        return MAVLink_header(bits>>48, incompat_flags=(bits>>32)&0xFF, compat_flags=(bits>>40)&0xFF,
+                              mlen=(bits>>24)&0xFF, seq=bits&0xFF,
+                              srcSystem=(bits>>8)&0xFF, srcComponent=(bits>>16)&0xFF)
+
+    def _set_header_object(self, header):
+        self._set_header(header.msgId, header.incompat_flags, header.compat_flags,
+                         header.mlen, header.seq, header.srcSystem, header.srcComponent)
+
+    # the header object is built on each access; changing its attributes
+    # does not change the message, assign a new MAVLink_header instead
+    _header = property(_get_header, _set_header_object)
 
     def format_attr(self, field):
         '''override field getter'''
@@ -148,10 +190,28 @@ class MAVLink_message(object):
     def get_msgbuf(self):
         if isinstance(self._msgbuf, bytearray):
             return self._msgbuf
-        return bytearray(self._msgbuf)
+        # decoded messages may reference bytes or an array; copy it on first use
+        self._msgbuf = bytearray(self._msgbuf)
+        return self._msgbuf
 
     def get_header(self):
-        return self._header
+        return self._get_header()
+
+    def _get_payload(self):
+        if self._payload_buf is None and self._crc is not None and self._msgbuf is not None:
+            # decoded messages copy the payload out of _msgbuf on first use
+            if self._msgbuf[0] == PROTOCOL_MARKER_V2:
+                start = HEADER_LEN_V2
+            else:
+                start = HEADER_LEN_V1
+            mlen = (self._header_bits>>24) & 0xFF
+            self._payload_buf = bytearray(self._msgbuf[start:start+mlen])
+        return self._payload_buf
+
+    def _set_payload(self, payload):
+        self._payload_buf = payload
+
+    _payload = property(_get_payload, _set_payload)
 
     def get_payload(self):
         return self._payload
@@ -166,16 +226,16 @@ class MAVLink_message(object):
         return self._type
 
     def get_msgId(self):
-        return self._header.msgId
+        return self._header_bits>>48
 
     def get_srcSystem(self):
-        return self._header.srcSystem
+        return (self._header_bits>>8) & 0xFF
 
     def get_srcComponent(self):
-        return self._header.srcComponent
+        return (self._header_bits>>16) & 0xFF
 
     def get_seq(self):
-        return self._header.seq
+        return self._header_bits & 0xFF
 
     def get_signed(self):
         return self._signed
@@ -254,11 +314,12 @@ class MAVLink_message(object):
         incompat_flags = 0
         if mav.signing.sign_outgoing:
             incompat_flags |= MAVLINK_IFLAG_SIGNED
-        self._header  = MAVLink_header(self._header.msgId,
-                                       incompat_flags=incompat_flags, compat_flags=0,
-                                       mlen=len(self._payload), seq=mav.seq,
-                                       srcSystem=mav.srcSystem, srcComponent=mav.srcComponent)
-        self._msgbuf = self._header.pack(force_mavlink1=force_mavlink1) + self._payload
+        header = MAVLink_header(self.get_msgId(),
+                                incompat_flags=incompat_flags, compat_flags=0,
+                                mlen=len(self._payload), seq=mav.seq,
+                                srcSystem=mav.srcSystem, srcComponent=mav.srcComponent)
+        self._header = header
+        self._msgbuf = header.pack(force_mavlink1=force_mavlink1) + self._payload
         crc = x25crc(self._msgbuf[1:])
         if ${crc_extra}: # using CRC extra
             crc.accumulate_str(struct.pack('B', crc_extra))
@@ -333,11 +394,20 @@ def byname_hash_from_field_attribute(m, attribute):
         strings.append('"%s": "%s"' % (field.name, value))
     return ", ".join(strings)
 
+# class attributes of the generated message classes. Fields with these
+# names can't be slots, so they are stored in the instance __dict__
+message_class_attributes = set(['id', 'name', 'fieldnames', 'ordered_fieldnames', 'fieldtypes',
+                                'fielddisplays_by_name', 'fieldenums_by_name', 'fieldunits_by_name',
+                                'format', 'native_format', 'orders', 'lengths', 'array_lengths',
+                                'crc_extra', 'unpacker', 'instance_field', 'instance_offset', 'pack'])
+
 def generate_classes(outf, msgs):
     print("Generating class definitions")
     wrapper = textwrap.TextWrapper(initial_indent="        ", subsequent_indent="        ")
     for m in msgs:
         classname = "MAVLink_%s_message" % m.name.lower()
+        slots = [f for f in m.fieldnames if f not in message_class_attributes]
+        slots_str = "".join(["'%s', " % s for s in slots])
         fieldname_str = ", ".join(["'%s'" % s for s in m.fieldnames])
         ordered_fieldname_str = ", ".join(["'%s'" % s for s in m.ordered_fieldnames])
         fielddisplays_str = byname_hash_from_field_attribute(m, "display")
@@ -373,6 +443,11 @@ class %s(MAVLink_message):
         unpacker = struct.Struct('%s')
         instance_field = %s
         instance_offset = %d
+        _type = name
+        _fieldnames = fieldnames
+        _instance_field = instance_field
+        _instance_offset = instance_offset
+        __slots__ = (%s)
 
         def __init__(self""" % (classname, wrapper.fill(m.description.strip()),
             m.name.upper(),
@@ -391,7 +466,8 @@ class %s(MAVLink_message):
             m.crc_extra,
             m.fmtstr,
             instance_field,
-            instance_offset))
+            instance_offset,
+            slots_str))
         for i in range(len(m.fields)):
                 fname = m.fieldnames[i]
                 if m.extensions_start is not None and i >= m.extensions_start:
@@ -401,9 +477,6 @@ class %s(MAVLink_message):
                         outf.write(", %s" % fname)
         outf.write("):\n")
         outf.write("                MAVLink_message.__init__(self, %s.id, %s.name)\n" % (classname, classname))
-        outf.write("                self._fieldnames = %s.fieldnames\n" % (classname))
-        outf.write("                self._instance_field = %s.instance_field\n" % (classname))
-        outf.write("                self._instance_offset = %s.instance_offset\n" % (classname))
         for f in m.fields:
                 outf.write("                self.%s = %s\n" % (f.name, f.name))
         outf.write("""
@@ -418,6 +491,53 @@ class %s(MAVLink_message):
         outf.write("), force_mavlink1=force_mavlink1)\n")
 
 
+def generate_decoders(outf, msgs):
+    print("Generating decoders")
+    outf.write('''
+# per message decoders, called by MAVLink.decode() with the buffer and
+# offset of a full length payload. These do the field reordering, array
+# slicing and string termination of the generic decoder with the
+# indexes worked out when the module was generated
+''')
+    for m in msgs:
+        classname = "MAVLink_%s_message" % m.name.lower()
+        tip = 0
+        wire_index = {}
+        for f in m.ordered_fields:
+            if f.type != 'char' and f.array_length > 1:
+                count = f.array_length
+            else:
+                count = 1
+            wire_index[f.name] = (tip, count)
+            tip += count
+        args = []
+        for f in m.fields:
+            (i, count) = wire_index[f.name]
+            if f.type == 'char':
+                args.append("decode_string(t[%u])" % i)
+            elif count > 1:
+                args.append("list(t[%u:%u])" % (i, i+count))
+            else:
+                args.append("t[%u]" % i)
+        outf.write("\ndef _decode_%s(buf, ofs, unpack_from=%s.unpacker.unpack_from):\n" % (m.name.lower(), classname))
+        if args == ["t[%u]" % i for i in range(len(args))]:
+            # fields are already in wire order with no arrays or strings
+            outf.write("    return %s(*unpack_from(buf, ofs))\n" % classname)
+        else:
+            outf.write("    t = unpack_from(buf, ofs)\n")
+            outf.write("    return %s(%s)\n" % (classname, ", ".join(args)))
+
+    outf.write('''
+# the generated class and decoder for each message ID. The decoder is
+# only used while mavlink_map still holds the generated class
+mavlink_decoders = {
+''')
+    for m in msgs:
+        outf.write("        MAVLINK_MSG_ID_%s : (MAVLink_%s_message, _decode_%s),\n" % (
+            m.name.upper(), m.name.lower(), m.name.lower()))
+    outf.write("}\n")
+
+
 def native_mavfmt(field):
     '''work out the struct format for a type (in a form expected by mavnative)'''
     map = {
@@ -502,13 +622,15 @@ class MAVLink_bad_data(MAVLink_message):
         '''
         a piece of bad data in a mavlink stream
         '''
+        __slots__ = ('data', 'reason')
+        _type = 'BAD_DATA'
+        _fieldnames = ['data', 'reason']
+
         def __init__(self, data, reason):
                 MAVLink_message.__init__(self, MAVLINK_MSG_ID_BAD_DATA, 'BAD_DATA')
-                self._fieldnames = ['data', 'reason']
                 self.data = data
                 self.reason = reason
                 self._msgbuf = data
-                self._instance_field = None
 
         def __str__(self):
             '''Override the __str__ function from MAVLink_messages because non-printable characters are common in to be the reason for this message to exist.'''
@@ -667,15 +789,13 @@ class MAVLink(object):
                 raise MAVError("invalid MAVLink prefix '%s'" % magic)
             self.have_prefix_error = False
             if self.buf_len() >= 3:
-                sbuf = self.buf[self.buf_index:3+self.buf_index]
-                if sys.version_info.major < 3:
-                    sbuf = str(sbuf)
-                (magic, self.expected_length, incompat_flags) = self.mav20_h3_unpacker.unpack(sbuf)
+                (magic, self.expected_length, incompat_flags) = self.mav20_h3_unpacker.unpack_from(self.buf, self.buf_index)
                 if magic == PROTOCOL_MARKER_V2 and (incompat_flags & MAVLINK_IFLAG_SIGNED):
                         self.expected_length += MAVLINK_SIGNATURE_BLOCK_LEN
                 self.expected_length += header_len + 2
             if self.expected_length >= (header_len+2) and self.buf_len() >= self.expected_length:
-                mbuf = array.array('B', self.buf[self.buf_index:self.buf_index+self.expected_length])
+                # this is the only copy of the frame made while decoding
+                mbuf = self.buf[self.buf_index:self.buf_index+self.expected_length]
                 self.buf_index += self.expected_length
                 self.expected_length = header_len+2
                 if self.robust_parsing:
@@ -695,17 +815,92 @@ class MAVLink(object):
 
         def parse_buffer(self, s):
             '''input some data bytes, possibly returning a list of new messages'''
-            m = self.parse_char(s)
-            if m is None:
+            ret = []
+            self.parse_buffer_into(s, ret)
+            if len(ret) == 0:
                 return None
-            ret = [m]
-            while True:
-                m = self.parse_char("")
-                if m is None:
-                    return ret
-                ret.append(m)
             return ret
 
+        def parse_buffer_into(self, s, msgs):
+            '''input some data bytes, appending all complete messages to
+            msgs. This frames the whole buffer in one pass rather than
+            calling parse_char() once per message. Returns the number of
+            messages added'''
+            if self.native:
+                count = 0
+                m = self.parse_char(s)
+                while m is not None:
+                    msgs.append(m)
+                    count += 1
+                    m = self.parse_char("")
+                return count
+
+            buf = self.buf
+            buf.extend(s)
+            self.total_bytes_received += len(s)
+            idx = self.buf_index
+            buflen = len(buf)
+            count = 0
+            while idx < buflen:
+                magic = buf[idx]
+                if magic == PROTOCOL_MARKER_V2:
+                    header_len = HEADER_LEN_V2
+                elif magic == PROTOCOL_MARKER_V1:
+                    header_len = HEADER_LEN_V1
+                else:
+                    idx += 1
+                    if not self.robust_parsing:
+                        if self.have_prefix_error:
+                            continue
+                        self.have_prefix_error = True
+                        self.total_receive_errors += 1
+                        self.buf_index = idx
+                        raise MAVError("invalid MAVLink prefix '%s'" % magic)
+                    m = MAVLink_bad_data(bytearray([magic]), 'Bad prefix')
+                    self.expected_length = HEADER_LEN_V1+2
+                    self.total_receive_errors += 1
+                    self.total_packets_received += 1
+                    msgs.append(m)
+                    count += 1
+                    self.__callbacks(m)
+                    continue
+                self.have_prefix_error = False
+                if buflen - idx < 3:
+                    self.expected_length = header_len+2
+                    break
+                incompat_flags = buf[idx+2]
+                frame_len = buf[idx+1] + header_len + 2
+                if magic == PROTOCOL_MARKER_V2 and (incompat_flags & MAVLINK_IFLAG_SIGNED):
+                    frame_len += MAVLINK_SIGNATURE_BLOCK_LEN
+                if buflen - idx < frame_len:
+                    self.expected_length = frame_len
+                    break
+                mbuf = buf[idx:idx+frame_len]
+                idx += frame_len
+                self.expected_length = header_len+2
+                self.buf_index = idx
+                try:
+                    if magic == PROTOCOL_MARKER_V2 and (incompat_flags & ~MAVLINK_IFLAG_SIGNED) != 0:
+                        raise MAVError('invalid incompat_flags 0x%x 0x%x %u' % (incompat_flags, magic, frame_len))
+                    m = self.decode(mbuf)
+                except MAVError as reason:
+                    if not self.robust_parsing:
+                        raise
+                    m = MAVLink_bad_data(mbuf, reason.message)
+                    self.total_receive_errors += 1
+                self.total_packets_received += 1
+                msgs.append(m)
+                count += 1
+                self.__callbacks(m)
+
+            if idx == buflen:
+                # everything has been consumed, free the buffer
+                self.buf = bytearray()
+                self.buf_index = 0
+            else:
+                self.buf_index = idx
+            return count
+
         def check_signature(self, msgbuf, srcSystem, srcComponent):
             '''check signature on incoming message'''
             if isinstance(msgbuf, array.array):
@@ -713,6 +908,8 @@ class MAVLink(object):
                     msgbuf = msgbuf.tostring()
                 except:
                     msgbuf = msgbuf.tobytes()
+            elif isinstance(msgbuf, memoryview):
+                msgbuf = msgbuf.tobytes()
             timestamp_buf = msgbuf[-12:-6]
             link_id = msgbuf[-13]
             (tlow, thigh) = self.mav_sign_unpacker.unpack(timestamp_buf)
@@ -754,12 +951,21 @@ class MAVLink(object):
             return True
 
         def decode(self, msgbuf):
-                '''decode a buffer as a MAVLink message'''
+                '''decode a buffer as a MAVLink message.
+
+                msgbuf may be a bytearray, bytes, array or memoryview.
+                Fields are unpacked in place and the message keeps a
+                reference to msgbuf, so it must not be changed afterwards.
+                A memoryview is copied, as it is usually over a receive
+                buffer that will be reused. So are python2 strings,
+                whose items are characters rather than ints'''
+                if isinstance(msgbuf, memoryview) or (sys.version_info.major < 3 and isinstance(msgbuf, str)):
+                    msgbuf = bytearray(msgbuf)
                 # decode the header
                 if msgbuf[0] != PROTOCOL_MARKER_V1:
                     headerlen = 10
                     try:
-                        magic, mlen, incompat_flags, compat_flags, seq, srcSystem, srcComponent, msgIdlow, msgIdhigh = self.mav20_unpacker.unpack(msgbuf[:headerlen])
+                        magic, mlen, incompat_flags, compat_flags, seq, srcSystem, srcComponent, msgIdlow, msgIdhigh = self.mav20_unpacker.unpack_from(msgbuf, 0)
                     except struct.error as emsg:
                         raise MAVError('Unable to unpack MAVLink header: %s' % emsg)
                     msgId = msgIdlow | (msgIdhigh<<16)
@@ -767,7 +973,7 @@ class MAVLink(object):
                 else:
                     headerlen = 6
                     try:
-                        magic, mlen, seq, srcSystem, srcComponent, msgId = self.mav10_unpacker.unpack(msgbuf[:headerlen])
+                        magic, mlen, seq, srcSystem, srcComponent, msgId = self.mav10_unpacker.unpack_from(msgbuf, 0)
                         incompat_flags = 0
                         compat_flags = 0
                     except struct.error as emsg:
@@ -789,19 +995,17 @@ class MAVLink(object):
                 # decode the payload
                 type = mavlink_map[mapkey]
                 fmt = type.format
-                order_map = type.orders
-                len_map = type.lengths
                 crc_extra = type.crc_extra
 
                 # decode the checksum
+                crc_ofs = headerlen + mlen
                 try:
-                    crc, = self.mav_csum_unpacker.unpack(msgbuf[-(2+signature_len):][:2])
+                    crc, = self.mav_csum_unpacker.unpack_from(msgbuf, crc_ofs)
                 except struct.error as emsg:
                     raise MAVError('Unable to unpack MAVLink CRC: %s' % emsg)
-                crcbuf = msgbuf[1:-(2+signature_len)]
+                crc2 = x25crc(msgbuf[1:crc_ofs])
                 if ${crc_extra}: # using CRC extra
-                    crcbuf.append(crc_extra)
-                crc2 = x25crc(crcbuf)
+                    crc2.accumulate(bytearray((crc_extra,)))
                 if crc != crc2.crc and not MAVLINK_IGNORE_CRC:
                     raise MAVError('invalid MAVLink CRC in msgID %u 0x%04x should be 0x%04x' % (msgId, crc, crc2.crc))
 
@@ -833,19 +1037,45 @@ class MAVLink(object):
                         raise MAVError('Invalid signature')
 
                 csize = type.unpacker.size
-                mbuf = msgbuf[headerlen:-(2+signature_len)]
-                if len(mbuf) < csize:
-                    # zero pad to give right size
-                    mbuf.extend([0]*(csize - len(mbuf)))
-                if len(mbuf) < csize:
-                    raise MAVError('Bad message of type %s length %u needs %s' % (
-                        type, len(mbuf), csize))
-                mbuf = mbuf[:csize]
+                if mlen >= csize:
+                    (pbuf, pofs) = (msgbuf, headerlen)
+                else:
+                    # MAVLink2 truncated payload, zero pad to give right size
+                    pbuf = bytearray(msgbuf[headerlen:crc_ofs])
+                    pbuf.extend(bytearray(csize - mlen))
+                    pofs = 0
+
+                (decoder_type, decoder) = mavlink_decoders.get(mapkey, (None, None))
+                if decoder_type is type:
+                    try:
+                        m = decoder(pbuf, pofs)
+                    except struct.error as emsg:
+                        raise MAVError('Unable to unpack MAVLink payload type=%s fmt=%s payloadLength=%u: %s' % (
+                            type, fmt, mlen, emsg))
+                    except Exception as emsg:
+                        raise MAVError('Unable to instantiate MAVLink message of type %s : %s' % (type, emsg))
+                else:
+                    m = self.decode_payload(type, pbuf, pofs, mlen)
+                m._signed = sig_ok
+                if m._signed:
+                    m._link_id = msgbuf[-13]
+                m._msgbuf = msgbuf
+                m._crc = crc
+                m._set_header(msgId, incompat_flags, compat_flags, mlen, seq, srcSystem, srcComponent)
+                return m
+
+        def decode_payload(self, type, pbuf, pofs, mlen):
+                '''generic payload decoder, used for message types without
+                a generated decoder in mavlink_decoders, or whose class
+                in mavlink_map has been replaced'''
+                fmt = type.format
+                order_map = type.orders
+                len_map = type.lengths
                 try:
-                    t = type.unpacker.unpack(mbuf)
+                    t = type.unpacker.unpack_from(pbuf, pofs)
                 except struct.error as emsg:
                     raise MAVError('Unable to unpack MAVLink payload type=%s fmt=%s payloadLength=%u: %s' % (
-                        type, fmt, len(mbuf), emsg))
+                        type, fmt, mlen, emsg))
 
                 tlist = list(t)
                 # handle sorted fields
@@ -880,13 +1110,6 @@ class MAVLink(object):
                     m = type(*t)
                 except Exception as emsg:
                     raise MAVError('Unable to instantiate MAVLink message of type %s : %s' % (type, emsg))
-                m._signed = sig_ok
-                if m._signed:
-                    m._link_id = msgbuf[-13]
-                m._msgbuf = msgbuf
-                m._payload = msgbuf[6:-(2+signature_len)]
-                m._crc = crc
-                m._header = MAVLink_header(msgId, incompat_flags, compat_flags, mlen, seq, srcSystem, srcComponent)
                 return m
 """, xml)
 
@@ -993,6 +1216,7 @@ def generate(basename, xml):
     generate_enums(outf, enums)
     generate_message_ids(outf, msgs)
     generate_classes(outf, msgs)
+    generate_decoders(outf, msgs)
     generate_mavlink_class(outf, msgs, xml[0])
     generate_methods(outf, msgs)
     outf.close()
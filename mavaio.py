@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+'''
+asyncio interface to mavlink connections
+
+This wraps the connection classes in mavutil, so messages are parsed and
+bookkept by the usual mavfile code, but received from the asyncio event
+loop instead of by polling. It needs python 3.6 or later, so it is kept
+out of mavutil to leave that importable on python 2.
+
+  conn = await mavaio.aio_mavlink_connection('udpin:0.0.0.0:14550')
+  m = await conn.recv_match(type='HEARTBEAT', timeout=5)
+  async for m in conn:
+      print(m)
+
+Copyright Andrew Tridgell 2011-2019
+Released under GNU LGPL version 3 or later
+'''
+
+import asyncio
+import collections
+import functools
+import socket
+
+from pymavlink import mavutil
+
+
+class fd_reader(object):
+    '''receive messages whenever the file descriptor of a link is
+    readable. This is used for sockets, serial ports and child
+    processes'''
+    def __init__(self, max_batch=1000):
+        self.max_batch = max_batch
+        self.conn = None
+        self.fd = None
+
+    def start(self, conn):
+        self.conn = conn
+        self.watch()
+
+    def stop(self):
+        if self.fd is not None:
+            self.conn.loop.remove_reader(self.fd)
+            self.fd = None
+
+    def watch(self):
+        '''follow the link to a new file descriptor, as happens when a
+        tcpin link accepts a client or a tcp link reconnects'''
+        fd = self.conn.master.fd
+        if fd == self.fd:
+            return
+        self.stop()
+        if fd is not None:
+            self.fd = fd
+            self.conn.loop.add_reader(fd, self.readable)
+
+    def at_eof(self):
+        '''return True if the link is a stream socket that has been closed by the peer'''
+        port = getattr(self.conn.master, 'port', None)
+        if not isinstance(port, socket.socket) or port.type != socket.SOCK_STREAM:
+            return False
+        try:
+            return len(port.recv(1, socket.MSG_PEEK)) == 0
+        except socket.error:
+            return False
+
+    def readable(self):
+        if self.fd is None:
+            return
+        master = self.conn.master
+        count = 0
+        while count < self.max_batch:
+            m = master.recv_msg()
+            if m is None:
+                break
+            self.conn.dispatch(m)
+            count += 1
+        else:
+            # the link may hold parsed messages that won't make the fd
+            # readable again, so come back once other tasks have run
+            self.conn.loop.call_soon(self.readable)
+        fd = self.fd
+        self.watch()
+        if count == 0 and self.fd == fd and self.at_eof():
+            self.stop()
+            self.conn.set_eof()
+
+
+class thread_reader(object):
+    '''receive messages in a worker thread, for links without a
+    selectable file descriptor such as serial ports on Windows'''
+    def __init__(self, timeout=0.1, max_batch=1000):
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.conn = None
+        self.task = None
+
+    def start(self, conn):
+        self.conn = conn
+        self.task = conn.loop.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            # don't leave the worker waiting out its select()
+            self.conn.master.wakeup()
+
+    def read_batch(self):
+        master = self.conn.master
+        ret = []
+        while len(ret) < self.max_batch:
+            m = master.recv_msg()
+            if m is None:
+                break
+            ret.append(m)
+        if len(ret) == 0:
+            master.select(self.timeout)
+        return ret
+
+    async def run(self):
+        while True:
+            msgs = await self.conn.loop.run_in_executor(None, self.read_batch)
+            for m in msgs:
+                self.conn.dispatch(m)
+
+
+class log_reader(object):
+    '''replay the messages in a log. If speed is given messages are
+    released at that multiple of the rate they were recorded, otherwise
+    as fast as the consumers take them. Nothing is dropped: the replay
+    waits for room in the receive queue and in bounded subscriptions'''
+    def __init__(self, speed=None, max_batch=100):
+        self.speed = speed
+        self.max_batch = max_batch
+        self.conn = None
+        self.task = None
+
+    def start(self, conn):
+        self.conn = conn
+        self.task = conn.loop.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        master = self.conn.master
+        loop = self.conn.loop
+        first_timestamp = None
+        start_time = None
+        while True:
+            for i in range(self.max_batch):
+                m = master.recv_msg()
+                if m is None:
+                    self.task = None
+                    await self.conn.set_eof_waiting()
+                    return
+                timestamp = getattr(m, '_timestamp', None)
+                if self.speed and timestamp is not None:
+                    if first_timestamp is None:
+                        first_timestamp = timestamp
+                        start_time = loop.time()
+                    delay = start_time + (timestamp - first_timestamp) / self.speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await self.conn.dispatch_waiting(m)
+            await asyncio.sleep(0)
+
+
+def default_reader(master):
+    '''choose a reader for a mavfile or log reader'''
+    if isinstance(master, mavutil.mavlogfile) or not isinstance(master, mavutil.mavfile):
+        return log_reader()
+    if master.fd is None:
+        return thread_reader()
+    return fd_reader()
+
+
+class aio_mavfile(object):
+    '''an asyncio interface to a mavfile. Received messages go through
+    the usual recv_msg() and post_message() processing of the link, so
+    master.messages and the other link state stay up to date.
+    Attributes not defined here, such as mav, are those of the link.
+
+    Messages not yet taken by recv_msg(), recv_match() or iteration are
+    held in a queue of at most max_queue messages (None for no limit).
+    When it is full live links drop the oldest message, while log
+    replay waits for it to be read'''
+    def __init__(self, master, reader=None, max_queue=1000):
+        self.master = master
+        if reader is None:
+            reader = default_reader(master)
+        self.reader = reader
+        self.loop = None
+        self.eof = False
+        self.queue = collections.deque(maxlen=max_queue)
+        self.subscriptions = {}
+        self._ready = None
+        self._space = None
+        # set once messages are taken from the queue, until then a
+        # replay only feeding subscriptions doesn't wait for the queue
+        self._receiving = False
+
+    def __getattr__(self, name):
+        if name == 'master':
+            raise AttributeError(name)
+        return getattr(self.master, name)
+
+    def start(self):
+        '''start receiving, this must be called from a running event loop'''
+        self.loop = asyncio.get_event_loop()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self.reader.start(self)
+
+    def close(self):
+        '''stop receiving and close the link'''
+        self.reader.stop()
+        if hasattr(self.master, 'close'):
+            # DataFlash log readers have no close()
+            self.master.close()
+        self.set_eof()
+
+    def _subscribers(self, m):
+        mtype = m.get_type()
+        return self.subscriptions.get(mtype, []) + self.subscriptions.get(None, [])
+
+    def dispatch(self, m):
+        '''queue a newly received message for consumers'''
+        self.queue.append(m)
+        self._ready.set()
+        for q in self._subscribers(m):
+            put_dropping_oldest(q, m)
+
+    def _queue_full(self):
+        return (self._receiving and self.queue.maxlen is not None and
+                len(self.queue) >= self.queue.maxlen)
+
+    async def dispatch_waiting(self, m):
+        '''queue a message for consumers, waiting until they have room
+        for it rather than dropping older messages'''
+        while self._queue_full() and not self.eof:
+            self._space.clear()
+            await self._space.wait()
+        self.queue.append(m)
+        self._ready.set()
+        for q in self._subscribers(m):
+            await q.put(m)
+
+    def _popleft(self):
+        self._space.set()
+        return self.queue.popleft()
+
+    def _mark_eof(self):
+        '''mark the end of the messages, returning the subscriptions to
+        be told of it'''
+        self.eof = True
+        if self._ready is not None:
+            self._ready.set()
+            self._space.set()
+        ret = []
+        for queues in self.subscriptions.values():
+            for q in queues:
+                if not any(q is x for x in ret):
+                    ret.append(q)
+        return ret
+
+    def set_eof(self):
+        '''mark the end of the messages, waking up all consumers'''
+        if self.eof:
+            return
+        for q in self._mark_eof():
+            put_dropping_oldest(q, None)
+
+    async def set_eof_waiting(self):
+        '''mark the end of the messages, waiting for room in the
+        subscriptions rather than dropping older messages'''
+        if self.eof:
+            return
+        for q in self._mark_eof():
+            await q.put(None)
+
+    def subscribe(self, type=None, maxsize=0):
+        '''return an asyncio.Queue that receives all messages of the given
+        type or list of types, or all messages if type is None. None is
+        put on the queue when the link reaches EOF. Subscriptions are fed
+        independently of recv_msg() and each other'''
+        q = asyncio.Queue(maxsize=maxsize)
+        if type is None or isinstance(type, str):
+            type = [type]
+        for t in type:
+            self.subscriptions.setdefault(t, []).append(q)
+        if self.eof:
+            q.put_nowait(None)
+        return q
+
+    def unsubscribe(self, q):
+        '''stop feeding a queue returned by subscribe()'''
+        for t in list(self.subscriptions.keys()):
+            queues = [x for x in self.subscriptions[t] if x is not q]
+            if queues:
+                self.subscriptions[t] = queues
+            else:
+                del self.subscriptions[t]
+
+    async def recv_msg(self):
+        '''wait for the next message, returning None at EOF'''
+        self._receiving = True
+        while len(self.queue) == 0:
+            if self.eof:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self._popleft()
+
+    def _match(self, m, condition, type):
+        if type is not None and not m.get_type() in type:
+            return False
+        if condition is None:
+            return True
+        # the reader may have run ahead of us, so see the message itself
+        # along with the latest messages of other types
+        vars = collections.ChainMap({m.get_type(): m}, self.master.messages)
+        return self.master.condition_cache.evaluate(condition, vars)
+
+    async def _recv_match(self, condition, type):
+        while True:
+            m = await self.recv_msg()
+            if m is None or self._match(m, condition, type):
+                return m
+
+    async def recv_match(self, condition=None, type=None, blocking=True, timeout=None):
+        '''wait for the next message that matches the given condition.
+        type can be a string or a list of strings. Unlike
+        mavfile.recv_match() this waits by default; with blocking=False
+        only messages already queued are considered. Returns None on
+        timeout or EOF'''
+        if type is not None and not isinstance(type, list) and not isinstance(type, set):
+            type = [type]
+        if not blocking:
+            self._receiving = True
+            while len(self.queue) > 0:
+                m = self._popleft()
+                if self._match(m, condition, type):
+                    return m
+            return None
+        if timeout is None:
+            return await self._recv_match(condition, type)
+        try:
+            return await asyncio.wait_for(self._recv_match(condition, type), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def wait_heartbeat(self, timeout=None):
+        '''wait for a heartbeat so we know the target system IDs'''
+        return await self.recv_match(type='HEARTBEAT', timeout=timeout)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        m = await self.recv_msg()
+        if m is None:
+            raise StopAsyncIteration
+        return m
+
+
+def put_dropping_oldest(q, m):
+    '''put on an asyncio.Queue, dropping the oldest entry if it is full'''
+    if q.full():
+        q.get_nowait()
+    q.put_nowait(m)
+
+
+async def aio_mavlink_connection(device, reader=None, max_queue=1000, **kwargs):
+    '''open a mavlink connection for use with asyncio. The arguments are
+    those of mavutil.mavlink_connection(), plus the reader used to
+    receive messages (see default_reader()) and the size of the
+    receive queue. The link is opened in a worker thread, as opening
+    tcp links and large logs can take a while'''
+    loop = asyncio.get_event_loop()
+    master = await loop.run_in_executor(None, functools.partial(mavutil.mavlink_connection, device, **kwargs))
+    conn = aio_mavfile(master, reader=reader, max_queue=max_queue)
+    conn.start()
+    return conn
@@ -6,11 +6,22 @@ Copyright Andrew Tridgell 2011
 Released under GNU GPL version 3 or later
 '''
 
+import ast
+import collections
+import math
 import os
+import sys
+import types
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
 
 # these imports allow for mavgraph and mavlogdump to use maths expressions more easily
 from math import *
 from .mavextra import *
+from . import mavextra
 
 '''
 Support having a $HOME/.pymavlink/mavextra.py for extra graphing functions
@@ -23,27 +34,409 @@ if home is not None:
         mavuser = imp.load_source('pymavlink.mavuser', extra)
         from pymavlink.mavuser import *
 
-def evaluate_expression(expression, vars, nocondition=False):
-    '''evaluation an expression'''
-    # first check for conditions which take the form EXPRESSION{CONDITION}
-    if expression[-1] == '}':
-        startidx = expression.rfind('{')
-        if startidx == -1:
+# number of compiled expressions kept by compile_expression()
+EXPRESSION_CACHE_SIZE = 256
+
+_expression_cache = collections.OrderedDict()
+
+# builtins which keep no state, so calling them doesn't stop a condition
+# result being reused by recv_match()
+PURE_BUILTINS = set(['abs', 'all', 'any', 'bool', 'chr', 'divmod', 'float', 'hex', 'int',
+                     'isinstance', 'len', 'max', 'min', 'ord', 'pow', 'round', 'sorted', 'str'])
+
+def _is_pure_function(name):
+    '''return True if calling name can't depend on or change any state,
+    which is only assumed of the math functions and some builtins'''
+    if name in globals():
+        return getattr(math, name, None) is globals()[name]
+    return name in PURE_BUILTINS
+
+def _analyse(code):
+    '''return the names an expression looks up other than builtins and the
+    functions and modules available to it, which are normally message
+    names, and whether it only calls functions without state'''
+    names = set()
+    pure = True
+    for node in ast.walk(ast.parse(code, mode='eval')):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            if hasattr(builtins, node.id):
+                continue
+            v = globals().get(node.id, None)
+            if callable(v) or isinstance(v, types.ModuleType):
+                continue
+            names.add(node.id)
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or not _is_pure_function(node.func.id):
+                pure = False
+    return (names, pure)
+
+class MAVExpression(object):
+    '''an expression of the form EXPRESSION or EXPRESSION{CONDITION},
+    compiled once so it can be evaluated for many messages'''
+    def __init__(self, expression):
+        self.text = expression
+        self.expression = expression
+        self.condition = None
+        self.names = set()
+        # False if the expression calls a function which may keep state,
+        # such as the mavextra filters
+        self.pure = True
+        self._condition_code = None
+        self._expression_code = None
+        self._error = None
+        # a condition which can never be evaluated makes the expression None
+        self._invalid = False
+
+        # first check for conditions which take the form EXPRESSION{CONDITION}
+        if expression[-1] == '}':
+            startidx = expression.rfind('{')
+            if startidx == -1:
+                self._invalid = True
+                return
+            self.condition = expression[startidx+1:-1]
+            self.expression = expression[:startidx]
+            try:
+                # eval() of a string ignores leading spaces and tabs, compile() doesn't
+                condition = self.condition.lstrip(' \t')
+                self._condition_code = compile(condition, '<condition>', 'eval')
+                self._add_names(condition)
+            except Exception:
+                self._invalid = True
+                return
+        try:
+            expression = self.expression.lstrip(' \t')
+            self._expression_code = compile(expression, '<expression>', 'eval')
+            self._add_names(expression)
+        except Exception as ex:
+            # raised when evaluated, as eval() would
+            self._error = ex
+
+    def _add_names(self, code):
+        '''add the names used by part of the expression'''
+        (names, pure) = _analyse(code)
+        self.names.update(names)
+        self.pure = self.pure and pure
+
+    def evaluate(self, vars, nocondition=False, state=None):
+        '''evaluate the expression with vars, normally the messages
+        dictionary of a mavfile. Returns None if the condition is false
+        or a value the expression needs is missing. state is the
+        mavextra.FilterState for filters like lowpass() to use'''
+        if state is None:
+            return self._evaluate(vars, nocondition)
+        previous = mavextra.set_state(state)
+        try:
+            return self._evaluate(vars, nocondition)
+        finally:
+            mavextra.set_state(previous)
+
+    def _evaluate(self, vars, nocondition):
+        '''evaluate the expression with the current filter state'''
+        if self._invalid:
             return None
-        condition=expression[startidx+1:-1]
-        expression=expression[:startidx]
+        if self._condition_code is not None:
+            try:
+                v = eval(self._condition_code, globals(), vars)
+            except Exception:
+                return None
+            if not nocondition and not v:
+                return None
+        if self._error is not None:
+            raise self._error
         try:
-            v = eval(condition, globals(), vars)
-        except Exception:
+            v = eval(self._expression_code, globals(), vars)
+        except NameError:
             return None
-        if not nocondition and not v:
+        except ZeroDivisionError:
             return None
+        except IndexError:
+            return None
+        return v
+
+def compile_expression(expression):
+    '''return a MAVExpression for an expression string, reusing the one
+    from an earlier call with the same string where possible'''
     try:
-        v = eval(expression, globals(), vars)
-    except NameError:
+        expr = _expression_cache.pop(expression)
+    except KeyError:
+        expr = MAVExpression(expression)
+        if len(_expression_cache) >= EXPRESSION_CACHE_SIZE:
+            _expression_cache.popitem(last=False)
+    _expression_cache[expression] = expr
+    return expr
+
+def evaluate_expression(expression, vars, nocondition=False, state=None):
+    '''evaluation an expression'''
+    return compile_expression(expression).evaluate(vars, nocondition, state)
+
+class _Unsupported(Exception):
+    '''raised for expressions evaluate_columns() can't vectorise'''
+    pass
+
+# numpy ufuncs which match the math functions and builtins of the same name
+NUMPY_FUNCTIONS = {
+    'abs' : 'absolute', 'acos' : 'arccos', 'asin' : 'arcsin', 'atan' : 'arctan', 'atan2' : 'arctan2',
+    'ceil' : 'ceil', 'cos' : 'cos', 'degrees' : 'degrees', 'exp' : 'exp', 'fabs' : 'fabs',
+    'floor' : 'floor', 'hypot' : 'hypot', 'log' : 'log', 'log10' : 'log10', 'max' : 'maximum',
+    'min' : 'minimum', 'radians' : 'radians', 'sin' : 'sin', 'sqrt' : 'sqrt', 'tan' : 'tan',
+}
+
+def _is_constant(node):
+    '''return True if an ast node is a constant'''
+    if sys.version_info >= (3, 8):
+        return isinstance(node, ast.Constant)
+    return isinstance(node, (ast.Num, getattr(ast, 'NameConstant', ast.Num)))
+
+def _constant_value(node):
+    '''return the value of a constant ast node'''
+    if sys.version_info < (3, 8) and isinstance(node, ast.Num):
+        return node.n
+    return node.value
+
+def _column_refs(node, refs):
+    '''add the MSG.field references in an expression to refs, a dictionary
+    of sets of field names, raising _Unsupported if evaluate_columns()
+    can't evaluate the expression'''
+    if isinstance(node, ast.Attribute):
+        if not isinstance(node.value, ast.Name):
+            raise _Unsupported()
+        refs.setdefault(node.value.id, set()).add(node.attr)
+        return
+    if isinstance(node, ast.Call):
+        if (not isinstance(node.func, ast.Name) or not node.func.id in NUMPY_FUNCTIONS or
+            not _is_pure_function(node.func.id) or len(getattr(node, 'keywords', [])) > 0 or
+            getattr(node, 'starargs', None) is not None or getattr(node, 'kwargs', None) is not None):
+            raise _Unsupported()
+        import numpy as np
+        if len(node.args) != getattr(np, NUMPY_FUNCTIONS[node.func.id]).nin:
+            raise _Unsupported()
+        for arg in node.args:
+            _column_refs(arg, refs)
+        return
+    if isinstance(node, ast.Name):
+        if node.id in ('True', 'False'):
+            return
+        if isinstance(globals().get(node.id, None), (int, float)):
+            # a constant such as pi
+            return
+        raise _Unsupported()
+    if _is_constant(node):
+        if isinstance(_constant_value(node), (int, float)):
+            return
+        raise _Unsupported()
+    if not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+                             ast.IfExp, ast.operator, ast.unaryop, ast.boolop, ast.cmpop,
+                             ast.Load)):
+        raise _Unsupported()
+    if isinstance(node, (ast.BitAnd, ast.BitOr, ast.BitXor, ast.LShift, ast.RShift, ast.Invert,
+                         ast.Is, ast.IsNot, ast.In, ast.NotIn)):
+        raise _Unsupported()
+    if hasattr(ast, 'MatMult') and isinstance(node, ast.MatMult):
+        raise _Unsupported()
+    for child in ast.iter_child_nodes(node):
+        _column_refs(child, refs)
+
+def _column_eval(node, env):
+    '''evaluate an expression checked by _column_refs() over numpy arrays,
+    returning the values and a mask of the rows where evaluate_expression()
+    would have given a value'''
+    import numpy as np
+    if isinstance(node, ast.Expression):
+        return _column_eval(node.body, env)
+    if isinstance(node, ast.Attribute):
+        (data, seen) = env[node.value.id]
+        return (data[node.attr], seen)
+    if isinstance(node, ast.Name):
+        if node.id in ('True', 'False'):
+            return (np.array(node.id == 'True'), True)
+        return (np.array(globals()[node.id]), True)
+    if _is_constant(node):
+        return (np.array(_constant_value(node)), True)
+    if isinstance(node, ast.Call):
+        args = [_column_eval(arg, env) for arg in node.args]
+        valid = True
+        for (v, ok) in args:
+            valid = valid & ok
+        return (getattr(np, NUMPY_FUNCTIONS[node.func.id])(*[v for (v, ok) in args]), valid)
+    if isinstance(node, ast.UnaryOp):
+        (v, valid) = _column_eval(node.operand, env)
+        if isinstance(node.op, ast.Not):
+            return (v == 0, valid)
+        if isinstance(node.op, ast.USub):
+            return (-v, valid)
+        return (v, valid)
+    if isinstance(node, ast.BinOp):
+        (a, valid_a) = _column_eval(node.left, env)
+        (b, valid_b) = _column_eval(node.right, env)
+        valid = valid_a & valid_b
+        op = node.op
+        if isinstance(op, ast.Add):
+            return (a + b, valid)
+        if isinstance(op, ast.Sub):
+            return (a - b, valid)
+        if isinstance(op, ast.Mult):
+            return (a * b, valid)
+        if isinstance(op, ast.Pow):
+            # 0 to a negative power raises ZeroDivisionError
+            return (np.float_power(a, b), valid & ~((a == 0) & (b < 0)))
+        # the division operators raise ZeroDivisionError for a zero divisor
+        valid = valid & (b != 0)
+        b = np.where(b != 0, b, 1)
+        if isinstance(op, ast.Div):
+            return (np.true_divide(a, b), valid)
+        if isinstance(op, ast.FloorDiv):
+            return (np.floor_divide(a, b), valid)
+        return (np.mod(a, b), valid)
+    if isinstance(node, ast.BoolOp):
+        # the result is the first operand deciding the outcome, and later
+        # operands are not evaluated
+        (v, valid) = _column_eval(node.values[0], env)
+        for operand in node.values[1:]:
+            (v2, valid2) = _column_eval(operand, env)
+            if isinstance(node.op, ast.And):
+                take2 = v != 0
+            else:
+                take2 = v == 0
+            v = np.where(take2, v2, v)
+            valid = valid & (~take2 | valid2)
+        return (v, valid)
+    if isinstance(node, ast.Compare):
+        (a, valid) = _column_eval(node.left, env)
+        result = np.array(True)
+        for (op, comparator) in zip(node.ops, node.comparators):
+            (b, valid_b) = _column_eval(comparator, env)
+            # later comparisons are only evaluated while the chain is true
+            valid = valid & (~result | valid_b)
+            if isinstance(op, ast.Eq):
+                r = a == b
+            elif isinstance(op, ast.NotEq):
+                r = a != b
+            elif isinstance(op, ast.Lt):
+                r = a < b
+            elif isinstance(op, ast.LtE):
+                r = a <= b
+            elif isinstance(op, ast.Gt):
+                r = a > b
+            else:
+                r = a >= b
+            result = result & r
+            a = b
+        return (result, valid)
+    if isinstance(node, ast.IfExp):
+        (test, valid) = _column_eval(node.test, env)
+        (a, valid_a) = _column_eval(node.body, env)
+        (b, valid_b) = _column_eval(node.orelse, env)
+        test = test != 0
+        return (np.where(test, a, b), valid & np.where(test, valid_a, valid_b))
+    raise _Unsupported()
+
+def evaluate_columns(expression, triggers, columns):
+    '''evaluate an expression once for every message in a log with a type
+    in triggers, giving the same values as calling evaluate_expression()
+    with the latest message of each type, but over whole numpy columns.
+
+    columns(mtype, fields) must return (order, data) for all messages of
+    mtype, where order is an increasing array giving the position of each
+    message in the log and data a structured array of the fields plus a
+    _timestamp column, as from log_columns().
+
+    Returns arrays of the timestamps and values for the messages where the
+    expression has a value, or None if the expression uses something which
+    can't be vectorised, such as a mavextra function'''
+    import numpy as np
+    expr = compile_expression(expression)
+    if expr._invalid or expr._error is not None:
+        return None
+    try:
+        trees = [ast.parse(expr.expression.lstrip(' \t'), mode='eval')]
+        if expr.condition is not None:
+            trees.append(ast.parse(expr.condition.lstrip(' \t'), mode='eval'))
+        refs = {}
+        for tree in trees:
+            _column_refs(tree, refs)
+    except (_Unsupported, SyntaxError):
         return None
-    except ZeroDivisionError:
+
+    try:
+        data = {}
+        for mtype in set(refs.keys()).union(triggers):
+            data[mtype] = columns(mtype, sorted(refs.get(mtype, [])))
+    except (KeyError, ValueError):
+        # an unknown field raises an exception when evaluated per message
+        return None
+
+    # the messages the expression is evaluated for, in log order
+    if len(triggers) == 0:
+        return (np.zeros(0), np.zeros(0))
+    order = np.concatenate([data[mtype][0] for mtype in triggers])
+    timestamps = np.concatenate([data[mtype][1]['_timestamp'] for mtype in triggers])
+    idx = np.argsort(order, kind='mergesort')
+    order = order[idx]
+    timestamps = timestamps[idx]
+
+    # as-of join of the latest message of each type
+    env = {}
+    for mtype in refs:
+        (mtype_order, mtype_data) = data[mtype]
+        idx = np.searchsorted(mtype_order, order, side='right') - 1
+        seen = idx >= 0
+        idx = np.maximum(idx, 0)
+        fields = {}
+        for f in refs[mtype]:
+            col = mtype_data[f]
+            if col.dtype.kind == 'f' or (col.dtype.kind == 'u' and col.dtype.itemsize == 8):
+                col = col.astype(np.float64)
+            elif col.dtype.kind in 'iub':
+                col = col.astype(np.int64)
+            else:
+                return None
+            if col.ndim != 1:
+                # array fields
+                return None
+            if len(col) == 0:
+                col = np.zeros(len(order), dtype=col.dtype)
+            else:
+                col = col[idx]
+            fields[f] = col
+        env[mtype] = (fields, seen)
+
+    with np.errstate(all='ignore'):
+        try:
+            (values, valid) = _column_eval(trees[0], env)
+            if len(trees) > 1:
+                (cond, cond_valid) = _column_eval(trees[1], env)
+                valid = valid & cond_valid & (cond != 0)
+        except _Unsupported:
+            return None
+    values = np.broadcast_to(values, order.shape)
+    valid = np.broadcast_to(valid, order.shape)
+    if values.dtype.kind == 'b':
+        values = values.astype(np.int64)
+    if values.dtype.kind not in 'iuf':
+        return None
+    return (timestamps[valid], values[valid])
+
+def log_columns(mlog):
+    '''return a function for evaluate_columns() reading the columns of a
+    log with DFReader_binary.extract_columns() or mavmmaplog.to_numpy(),
+    or None if the log can't be read by columns or numpy is missing'''
+    try:
+        import numpy as np
+    except ImportError:
         return None
-    except IndexError:
+    if hasattr(mlog, 'extract_columns'):
+        extract = mlog.extract_columns
+    elif hasattr(mlog, 'to_numpy'):
+        extract = mlog.to_numpy
+    else:
         return None
-    return v
+    def columns(mtype, fields):
+        if not mtype in mlog.name_to_id:
+            # never seen, so never the latest message
+            dtype = [(f, 'f8') for f in fields] + [('_timestamp', 'f8')]
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=dtype))
+        data = extract(mtype, fields)
+        order = np.array(mlog.offsets[mlog.name_to_id[mtype]], dtype=np.int64)
+        # a truncated message at the end of a log is left out of data
+        return (order[:len(data)], data)
+    return columns
@@ -9,21 +9,58 @@ from __future__ import print_function
 from __future__ import absolute_import
 from builtins import object
 
+import collections
+import threading
 from math import *
 
 try:
     # in case numpy isn't installed
-    from .quaternion import Quaternion
+    from .quaternion import Quaternion, QuaternionArray
 except:
     pass
 
 try:
     # rotmat doesn't work on Python3.2 yet
-    from .rotmat import Vector3, Matrix3
+    from .rotmat import Vector3, Matrix3, Vector3Array, Matrix3Array
 except Exception:
     pass
 
 
+def _is_columns(*args):
+    '''return True if any argument is a numpy array or a dict of arrays
+       holding many samples rather than a single message or value'''
+    for a in args:
+        if isinstance(a, dict) or getattr(a, 'ndim', 0) > 0:
+            return True
+    return False
+
+def _field(MSG, name):
+    '''get a field from a message, a structured array or a dict of columns'''
+    if isinstance(MSG, dict) or hasattr(MSG, 'dtype'):
+        return MSG[name]
+    return getattr(MSG, name)
+
+def _has_field(MSG, name):
+    '''check for a field in a message, a structured array or a dict of columns'''
+    if isinstance(MSG, dict):
+        return name in MSG
+    if hasattr(MSG, 'dtype'):
+        return MSG.dtype.names is not None and name in MSG.dtype.names
+    return hasattr(MSG, name)
+
+def _float_columns(MSG, *names):
+    '''return float64 copies of some columns'''
+    import numpy
+    return [numpy.array(_field(MSG, name), dtype=numpy.float64) for name in names]
+
+def columns_at(columns, timestamps):
+    '''return the rows of a structured array which were current at each of
+       the given timestamps, so columns from different message types can
+       be combined. Timestamps before the first row use the first row'''
+    import numpy
+    idx = numpy.searchsorted(columns['_timestamp'], timestamps, side='right') - 1
+    return columns[numpy.maximum(idx, 0)]
+
 def kmh(mps):
     '''convert m/s to Km/h'''
     return mps*3.6
@@ -34,12 +71,19 @@ def altitude(SCALED_PRESSURE, ground_pressure=None, ground_temp=None):
     self = mavutil.mavfile_global
     if ground_pressure is None:
         if self.param('GND_ABS_PRESS', None) is None:
+            if _is_columns(SCALED_PRESSURE):
+                import numpy
+                return numpy.zeros(len(SCALED_PRESSURE))
             return 0
         ground_pressure = self.param('GND_ABS_PRESS', 1)
     if ground_temp is None:
         ground_temp = self.param('GND_TEMP', 0)
-    scaling = ground_pressure / (SCALED_PRESSURE.press_abs*100.0)
     temp = ground_temp + 273.15
+    if _is_columns(SCALED_PRESSURE):
+        import numpy
+        (press_abs,) = _float_columns(SCALED_PRESSURE, 'press_abs')
+        return numpy.log(ground_pressure / (press_abs*100.0)) * temp * 29271.267 * 0.001
+    scaling = ground_pressure / (SCALED_PRESSURE.press_abs*100.0)
     return log(scaling) * temp * 29271.267 * 0.001
 
 def altitude2(SCALED_PRESSURE, ground_pressure=None, ground_temp=None):
@@ -61,6 +105,8 @@ def mag_heading(RAW_IMU, ATTITUDE, declination=None, SENSOR_OFFSETS=None, ofs=No
     if declination is None:
         from . import mavutil
         declination = degrees(mavutil.mavfile_global.param('COMPASS_DEC', 0))
+    if _is_columns(RAW_IMU, ATTITUDE):
+        return _mag_heading_columns(RAW_IMU, ATTITUDE, declination, SENSOR_OFFSETS, ofs)
     mag_x = RAW_IMU.xmag
     mag_y = RAW_IMU.ymag
     mag_z = RAW_IMU.zmag
@@ -80,6 +126,27 @@ def mag_heading(RAW_IMU, ATTITUDE, declination=None, SENSOR_OFFSETS=None, ofs=No
         heading += 360
     return heading
 
+def _mag_heading_columns(RAW_IMU, ATTITUDE, declination, SENSOR_OFFSETS, ofs):
+    '''calculate heading from arrays of raw magnetometer and attitude samples'''
+    import numpy
+    (mag_x, mag_y, mag_z) = _float_columns(RAW_IMU, 'xmag', 'ymag', 'zmag')
+    if SENSOR_OFFSETS is not None and ofs is not None:
+        mag_x += ofs[0] - _field(SENSOR_OFFSETS, 'mag_ofs_x')
+        mag_y += ofs[1] - _field(SENSOR_OFFSETS, 'mag_ofs_y')
+        mag_z += ofs[2] - _field(SENSOR_OFFSETS, 'mag_ofs_z')
+
+    # only the bottom row of the DCM is needed
+    (roll, pitch) = _float_columns(ATTITUDE, 'roll', 'pitch')
+    c_x = -numpy.sin(pitch)
+    c_y = numpy.sin(roll) * numpy.cos(pitch)
+    c_z = numpy.cos(roll) * numpy.cos(pitch)
+    cos_pitch_sq = 1.0-(c_x*c_x)
+    headY = mag_y * c_z - mag_z * c_y
+    headX = mag_x * cos_pitch_sq - c_x * (mag_y * c_y + mag_z * c_z)
+
+    heading = numpy.degrees(numpy.arctan2(-headY,headX)) + declination
+    return numpy.where(heading < 0, heading + 360, heading)
+
 def mag_field_df(MAG, ofs=None, diagonals=(1.0,1.0,1.0), offdiagonals=(0.0,0.0,0.0)):
     '''calculate magnetic field strength from raw magnetometer for DF '''
     mag = Vector3(MAG.MagX, MAG.MagY, MAG.MagZ)
@@ -212,34 +279,114 @@ def angle_diff(angle1, angle2):
         ret += 360
     return ret
 
-average_data = {}
+class FilterState(object):
+    '''values kept between calls by the filter functions such as lowpass()
+    and delta(), by key. Each log being analysed can have its own, see
+    set_state(). mlog gives the timestamps for second_derivative_5/9()
+    and delta(), defaulting to mavutil.mavfile_global'''
+    def __init__(self, mlog=None):
+        self.mlog = mlog
+        self.average = {}
+        self.derivative = {}
+        self.lowpass = {}
+        self.lowpass_hz = {}
+        self.diff = {}
+        self.delta = {}
+        self.sum = {}
+        self.integral = {}
+        self.downsample_N = 0
+
+    def timestamp(self):
+        '''return the timestamp of the current message'''
+        mlog = self.mlog
+        if mlog is None:
+            from . import mavutil
+            mlog = mavutil.mavfile_global
+        return mlog.timestamp
+
+    def reset(self, key=None):
+        '''reset all filters, or only the filters using key'''
+        for data in [self.average, self.derivative, self.lowpass, self.lowpass_hz,
+                     self.diff, self.delta, self.sum, self.integral]:
+            if key is None:
+                data.clear()
+            else:
+                data.pop(key, None)
+        if key is None:
+            self.downsample_N = 0
+
+_default_state = FilterState()
+_thread_state = threading.local()
+
+def get_state():
+    '''return the FilterState used by filter functions in this thread'''
+    state = getattr(_thread_state, 'state', None)
+    if state is None:
+        return _default_state
+    return state
+
+def set_state(state):
+    '''set the FilterState used by filter functions in this thread, or None
+    for the shared default state. Returns the previous state'''
+    previous = getattr(_thread_state, 'state', None)
+    _thread_state.state = state
+    return previous
+
+# the default state, for code which looks at it directly
+average_data = _default_state.average
+derivative_data = _default_state.derivative
+lowpass_data = _default_state.lowpass
+lowpass_hz_data = _default_state.lowpass_hz
+last_diff = _default_state.diff
+last_delta = _default_state.delta
+last_sum = _default_state.sum
+last_integral = _default_state.integral
+
+class _Window(object):
+    '''the last N values and their running sum'''
+    def __init__(self, var, N):
+        self.values = collections.deque([var]*N, maxlen=N)
+        self.total = var*N
+        self.count = 0
+
+    def add(self, var):
+        '''add a value, dropping the oldest'''
+        self.total += var - self.values[0]
+        self.values.append(var)
+        self.count += 1
+        if self.count % len(self.values) == 0:
+            # stop rounding errors building up
+            self.total = fsum(self.values)
 
 def average(var, key, N):
     '''average over N points'''
-    global average_data
-    if not key in average_data:
-        average_data[key] = [var]*N
+    data = get_state().average
+    if not key in data:
+        data[key] = _Window(var, N)
         return var
-    average_data[key].pop(0)
-    average_data[key].append(var)
-    return sum(average_data[key])/N
-
-derivative_data = {}
+    window = data[key]
+    window.add(var)
+    return window.total/N
+
+def _derivative_data(var, key, N):
+    '''return the time step and last N values for a derivative, or None
+    on the first call for key'''
+    state = get_state()
+    tnow = state.timestamp()
+    if not key in state.derivative:
+        state.derivative[key] = (tnow, collections.deque([var]*N, maxlen=N))
+        return None
+    (last_time, data) = state.derivative[key]
+    data.append(var)
+    state.derivative[key] = (tnow, data)
+    return (tnow - last_time, data)
 
 def second_derivative_5(var, key):
     '''5 point 2nd derivative'''
-    global derivative_data
-    from . import mavutil
-    tnow = mavutil.mavfile_global.timestamp
-
-    if not key in derivative_data:
-        derivative_data[key] = (tnow, [var]*5)
+    ret = _derivative_data(var, key, 5)
+    if ret is None:
         return 0
-    (last_time, data) = derivative_data[key]
-    data.pop(0)
-    data.append(var)
-    derivative_data[key] = (tnow, data)
-    h = (tnow - last_time)
+    (h, data) = ret
     # N=5 2nd derivative from
     # http://www.holoborodko.com/pavel/numerical-methods/numerical-derivative/smooth-low-noise-differentiators/
     ret = ((data[4] + data[0]) - 2*data[2]) / (4*h**2)
@@ -247,34 +394,23 @@ def second_derivative_5(var, key):
 
 def second_derivative_9(var, key):
     '''9 point 2nd derivative'''
-    global derivative_data
-    from . import mavutil
-    tnow = mavutil.mavfile_global.timestamp
-
-    if not key in derivative_data:
-        derivative_data[key] = (tnow, [var]*9)
+    ret = _derivative_data(var, key, 9)
+    if ret is None:
         return 0
-    (last_time, data) = derivative_data[key]
-    data.pop(0)
-    data.append(var)
-    derivative_data[key] = (tnow, data)
-    h = (tnow - last_time)
+    (h, f) = ret
     # N=5 2nd derivative from
     # http://www.holoborodko.com/pavel/numerical-methods/numerical-derivative/smooth-low-noise-differentiators/
-    f = data
     ret = ((f[8] + f[0]) + 4*(f[7] + f[1]) + 4*(f[6]+f[2]) - 4*(f[5]+f[3]) - 10*f[4])/(64*h**2)
     return ret
 
-lowpass_data = {}
-
 def lowpass(var, key, factor):
     '''a simple lowpass filter'''
-    global lowpass_data
-    if not key in lowpass_data:
-        lowpass_data[key] = var
+    data = get_state().lowpass
+    if not key in data:
+        data[key] = var
     else:
-        lowpass_data[key] = factor*lowpass_data[key] + (1.0 - factor)*var
-    return lowpass_data[key]
+        data[key] = factor*data[key] + (1.0 - factor)*var
+    return data[key]
 
 def lpalpha(sample_rate_hz, cutoff_hz):
     '''find alpha for low pass filter'''
@@ -282,104 +418,82 @@ def lpalpha(sample_rate_hz, cutoff_hz):
     dt = 1.0 / sample_rate_hz
     return 1.0 - dt/(dt+rc)
 
-lowpass_hz_data = {}
-
 def lowpassHz(var, key, sample_rate_hz, cutoff_hz):
     '''a simple lowpass filter with specified frequency'''
-    global lowpass_hz_data
+    data = get_state().lowpass_hz
     alpha = lpalpha(sample_rate_hz, cutoff_hz)
-    if not key in lowpass_hz_data:
-        lowpass_hz_data[key] = var
+    if not key in data:
+        data[key] = var
     else:
-        lowpass_hz_data[key] = alpha*lowpass_hz_data[key] + (1.0-alpha)*var
-    return lowpass_hz_data[key]
-
-last_diff = {}
+        data[key] = alpha*data[key] + (1.0-alpha)*var
+    return data[key]
 
 def diff(var, key):
     '''calculate differences between values'''
-    global last_diff
-    ret = 0
-    if not key in last_diff:
-        last_diff[key] = var
+    data = get_state().diff
+    if not key in data:
+        data[key] = var
         return 0
-    ret = var - last_diff[key]
-    last_diff[key] = var
+    ret = var - data[key]
+    data[key] = var
     return ret
 
-last_delta = {}
-
 def delta(var, key, tusec=None):
     '''calculate slope'''
-    global last_delta
+    state = get_state()
     if tusec is not None:
         tnow = tusec * 1.0e-6
     else:
-        from . import mavutil
-        tnow = mavutil.mavfile_global.timestamp
+        tnow = state.timestamp()
     ret = 0
-    if key in last_delta:
-        (last_v, last_t, last_ret) = last_delta[key]
+    if key in state.delta:
+        (last_v, last_t, last_ret) = state.delta[key]
         if last_t == tnow:
             return last_ret
-        if tnow == last_t:
-            ret = 0
-        else:
-            ret = (var - last_v) / (tnow - last_t)
-    last_delta[key] = (var, tnow, ret)
+        ret = (var - last_v) / (tnow - last_t)
+    state.delta[key] = (var, tnow, ret)
     return ret
 
-last_sum = {}
-
 def sum(var, key):
     '''sum variable'''
-    global last_sum
-    ret = 0
-    if not key in last_sum:
-        last_sum[key] = 0
-    last_sum[key] += var
-    return last_sum[key]
-
-last_integral = {}
+    data = get_state().sum
+    if not key in data:
+        data[key] = 0
+    data[key] += var
+    return data[key]
 
 def integral(var, key, timeus):
     '''integrate variable'''
-    global last_integral
-    ret = 0
-    if not key in last_integral:
-        last_integral[key] = (0,timeus)
-    (lastsum,lastt) = last_integral[key]
+    data = get_state().integral
+    if not key in data:
+        data[key] = (0,timeus)
+    (lastsum,lastt) = data[key]
     dt = (timeus - lastt) * 1.0e-6
     dv = var * dt
     newv = lastsum + dv
-    last_integral[key] = (newv,timeus)
+    data[key] = (newv,timeus)
     return newv
 
 
 def delta_angle(var, key, tusec=None):
     '''calculate slope of an angle'''
-    global last_delta
+    state = get_state()
     if tusec is not None:
         tnow = tusec * 1.0e-6
     else:
-        from . import mavutil
-        tnow = mavutil.mavfile_global.timestamp
-    dv = 0
+        tnow = state.timestamp()
     ret = 0
-    if key in last_delta:
-        (last_v, last_t, last_ret) = last_delta[key]
+    if key in state.delta:
+        (last_v, last_t, last_ret) = state.delta[key]
         if last_t == tnow:
             return last_ret
-        if tnow == last_t:
-            ret = 0
-        else:
-            dv = var - last_v
-            if dv > 180:
-                dv -= 360
-            if dv < -180:
-                dv += 360
-            ret = dv / (tnow - last_t)
-    last_delta[key] = (var, tnow, ret)
+        dv = var - last_v
+        if dv > 180:
+            dv -= 360
+        if dv < -180:
+            dv += 360
+        ret = dv / (tnow - last_t)
+    state.delta[key] = (var, tnow, ret)
     return ret
 
 def roll_estimate(RAW_IMU,GPS_RAW_INT=None,ATTITUDE=None,SENSOR_OFFSETS=None, ofs=None, mul=None,smooth=0.7):
@@ -538,6 +652,51 @@ def get_lat_lon_alt(MSG):
         return None
     return (lat, lon, alt)
 
+def _lat_lon_alt_columns(MSG):
+    '''gets arrays of lat and lon in radians and alt in meters from position columns'''
+    import numpy
+    if _has_field(MSG, 'Lat'):
+        (lat, lon, alt) = _float_columns(MSG, 'Lat', 'Lng', 'Alt')
+        return (numpy.radians(lat), numpy.radians(lon), alt)
+    if _has_field(MSG, 'lat'):
+        (lat, lon, alt) = _float_columns(MSG, 'lat', 'lon', 'alt')
+        if _has_field(MSG, 'cog'):
+            return (numpy.radians(lat)*1.0e-7, numpy.radians(lon)*1.0e-7, alt*0.001)
+        return (numpy.radians(lat), numpy.radians(lon), alt*0.001)
+    if _has_field(MSG, 'PN'):
+        # origin relative position from EKF, as in gps_offset()
+        global ORGN
+        if ORGN is None:
+            ORGN = get_origin()
+        if ORGN is None:
+            return None
+        (north, east, down) = _float_columns(MSG, 'PN', 'PE', 'PD')
+        lat1 = radians(ORGN.Lat)
+        lon1 = radians(ORGN.Lng)
+        brng = numpy.arctan2(east, north)
+        dr = numpy.sqrt(east**2 + north**2) / radius_of_earth
+        lat = numpy.arcsin(sin(lat1)*numpy.cos(dr) + cos(lat1)*numpy.sin(dr)*numpy.cos(brng))
+        lon = lon1 + numpy.arctan2(numpy.sin(brng)*numpy.sin(dr)*cos(lat1),
+                                   numpy.cos(dr)-sin(lat1)*numpy.sin(lat))
+        lon = numpy.radians(wrap_valid_longitude(numpy.degrees(lon)))
+        return (lat, lon, ORGN.Alt - down)
+    return None
+
+def _distance_two_columns(MSG1, MSG2, horizontal=True):
+    '''distance between two arrays of points'''
+    import numpy
+    (lat1, lon1, alt1) = _lat_lon_alt_columns(MSG1)
+    (lat2, lon2, alt2) = _lat_lon_alt_columns(MSG2)
+    dLat = lat2 - lat1
+    dLon = lon2 - lon1
+
+    a = numpy.sin(0.5*dLat)**2 + numpy.sin(0.5*dLon)**2 * numpy.cos(lat1) * numpy.cos(lat2)
+    c = 2.0 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1.0-a))
+    ground_dist = 6371 * 1000 * c
+    if horizontal:
+        return ground_dist
+    return numpy.sqrt(ground_dist**2 + (alt2-alt1)**2)
+
 def _distance_two(MSG1, MSG2, horizontal=True):
     '''distance between two points'''
     (lat1, lon1, alt1) = get_lat_lon_alt(MSG1)
@@ -555,6 +714,8 @@ def _distance_two(MSG1, MSG2, horizontal=True):
 def distance_two(MSG1, MSG2, horizontal=True):
     '''distance between two points'''
     try:
+        if _is_columns(MSG1, MSG2):
+            return _distance_two_columns(MSG1, MSG2)
         return _distance_two(MSG1, MSG2)
     except Exception as ex:
         print(ex)
@@ -606,6 +767,13 @@ def airspeed(VFR_HUD, ratio=None, used_ratio=None, offset=None):
         else:
             print("no ARSPD_RATIO in mav.params")
             used_ratio = ratio
+    if _is_columns(VFR_HUD):
+        import numpy
+        (airspeed,) = _float_columns(VFR_HUD, 'airspeed' if _has_field(VFR_HUD, 'airspeed') else 'Airspeed')
+        airspeed_pressure = (airspeed**2) / used_ratio
+        if offset is not None:
+            airspeed_pressure = numpy.maximum(airspeed_pressure + offset, 0)
+        return numpy.sqrt(airspeed_pressure * ratio)
     if hasattr(VFR_HUD,'airspeed'):
         airspeed = VFR_HUD.airspeed
     else:
@@ -707,8 +875,10 @@ def gps_velocity_body(GPS_RAW_INT, ATTITUDE):
 def earth_accel(RAW_IMU,ATTITUDE):
     '''return earth frame acceleration vector'''
     r = rotation(ATTITUDE)
-    accel = Vector3(RAW_IMU.xacc, RAW_IMU.yacc, RAW_IMU.zacc) * 9.81 * 0.001
-    return r * accel
+    accel = Vector3(RAW_IMU.xacc, RAW_IMU.yacc, RAW_IMU.zacc)
+    accel *= 9.81 * 0.001
+    accel.rotate_inplace(r)
+    return accel
 
 def earth_gyro(RAW_IMU,ATTITUDE):
     '''return earth frame gyro vector'''
@@ -820,6 +990,10 @@ def mix2(servo1, servo2, mixtype=1, gain=0.5):
     return v2
 
 def wrap_180(angle):
+    if _is_columns(angle):
+        import numpy
+        angle = numpy.where(angle > 180, angle - 360.0, angle)
+        return numpy.where(angle < -180, angle + 360.0, angle)
     if angle > 180:
         angle -= 360.0
     if angle < -180:
@@ -862,12 +1036,14 @@ class DCM_State(object):
 
     def update(self, gyro, accel, mag, GPS):
         if self.gyro != gyro or self.accel != accel:
-            delta_angle = old_div((gyro+self.omega_I), self.rate)
+            delta_angle = gyro + self.omega_I
+            delta_angle /= self.rate
             self.dcm.rotate(delta_angle)
             correction = self.last_delta_angle % delta_angle
             #print (delta_angle - self.last_delta_angle) * 58.0
-            corrected_delta = delta_angle + 0.0833333 * correction
-            self.dcm2.rotate(corrected_delta)
+            correction *= 0.0833333
+            correction += delta_angle
+            self.dcm2.rotate(correction)
             self.last_delta_angle = delta_angle
 
             self.dcm.normalize()
@@ -926,13 +1102,11 @@ def PX4_update(IMU, ATT):
     px4_state.update(gyro, accel, IMU._timestamp)
     return px4_state
 
-_downsample_N = 0
-
 def downsample(N):
     '''conditional that is true on every Nth sample'''
-    global _downsample_N
-    _downsample_N = (_downsample_N + 1) % N
-    return _downsample_N == 0
+    state = get_state()
+    state.downsample_N = (state.downsample_N + 1) % N
+    return state.downsample_N == 0
 
 def armed(HEARTBEAT):
     '''return 1 if armed, 0 if not'''
@@ -1042,12 +1216,27 @@ def ekf1_pos(EKF1):
 def quat_to_euler(q):
   '''
   Get Euler angles from a quaternion
-  :param q: quaternion [w, x, y , z]
-  :returns: euler angles [roll, pitch, yaw]
+  :param q: quaternion [w, x, y , z], or an Nx4 array or list of
+            quaternions. Use numpy.column_stack() to combine w, x, y
+            and z arrays
+  :returns: euler angles [roll, pitch, yaw], or an Nx3 array
   '''
+  import numpy
+  if numpy.ndim(q) == 2:
+      return numpy.stack(_quat_euler_columns(numpy.asarray(q)), axis=-1)
   quat = Quaternion(q)
   return quat.euler
 
+def _quat_euler_columns(q):
+  '''return roll, pitch and yaw arrays for an Nx4 array of quaternions,
+  converting via the DCM as Quaternion.euler does'''
+  return Matrix3Array(QuaternionArray(q).dcm).to_euler()
+
+def _msg_quat_euler(MSG):
+  '''return roll, pitch and yaw arrays from the Q1..Q4 columns of a message'''
+  import numpy
+  return _quat_euler_columns(numpy.stack(_float_columns(MSG, 'Q1', 'Q2', 'Q3', 'Q4'), axis=-1))
+
 def euler_to_quat(e):
   '''
   Get quaternion from euler angles
@@ -1065,7 +1254,15 @@ def rotate_quat(attitude, roll, pitch, yaw):
   :param pitch: rotation in rad
   :param yaw: rotation in rad
   :returns: quaternion [w, x, y , z]
+
+  attitude can be an Nx4 array and the angles arrays, giving an Nx4 array
   '''
+  import numpy
+  if numpy.ndim(attitude) == 2 or _is_columns(roll, pitch, yaw):
+      (roll, pitch, yaw) = numpy.broadcast_arrays(numpy.atleast_1d(roll), numpy.atleast_1d(pitch),
+                                                  numpy.atleast_1d(yaw))
+      rotation = QuaternionArray(numpy.stack([roll, pitch, yaw], axis=-1))
+      return (rotation * numpy.atleast_2d(attitude)).q
   quat = Quaternion(attitude)
   rotation = Quaternion([roll, pitch, yaw])
   res = rotation * quat
@@ -1074,18 +1271,27 @@ def rotate_quat(attitude, roll, pitch, yaw):
 
 def qroll(MSG):
     '''return quaternion roll in degrees'''
+    if _is_columns(MSG):
+        import numpy
+        return numpy.degrees(_msg_quat_euler(MSG)[0])
     q = Quaternion([MSG.Q1,MSG.Q2,MSG.Q3,MSG.Q4])
     return degrees(q.euler[0])
 
     
 def qpitch(MSG):
     '''return quaternion pitch in degrees'''
+    if _is_columns(MSG):
+        import numpy
+        return numpy.degrees(_msg_quat_euler(MSG)[1])
     q = Quaternion([MSG.Q1,MSG.Q2,MSG.Q3,MSG.Q4])
     return degrees(q.euler[1])
 
     
 def qyaw(MSG):
     '''return quaternion yaw in degrees'''
+    if _is_columns(MSG):
+        import numpy
+        return numpy.degrees(_msg_quat_euler(MSG)[2])
     q = Quaternion([MSG.Q1,MSG.Q2,MSG.Q3,MSG.Q4])
     return degrees(q.euler[2])
 
@@ -1134,9 +1340,15 @@ def earth_accel2(RAW_IMU,ATTITUDE):
 
 def earth_accel_df(IMU,ATT):
     '''return earth frame acceleration vector from df log'''
+    if _is_columns(IMU, ATT):
+        import numpy
+        r = Matrix3Array()
+        r.from_euler(*[numpy.radians(a) for a in _float_columns(ATT, 'Roll', 'Pitch', 'Yaw')])
+        return r * Vector3Array(*_float_columns(IMU, 'AccX', 'AccY', 'AccZ'))
     r = rotation_df(ATT)
     accel = Vector3(IMU.AccX, IMU.AccY, IMU.AccZ)
-    return r * accel
+    accel.rotate_inplace(r)
+    return accel
 
 def earth_accel2_df(IMU,IMU2,ATT):
     '''return earth frame acceleration vector from df log'''
@@ -1148,6 +1360,10 @@ def earth_accel2_df(IMU,IMU2,ATT):
 
 def gps_velocity_df(GPS):
     '''return GPS velocity vector'''
+    if _is_columns(GPS):
+        import numpy
+        (spd, gcrs, vz) = _float_columns(GPS, 'Spd', 'GCrs', 'VZ')
+        return Vector3Array(spd * numpy.cos(numpy.radians(gcrs)), spd * numpy.sin(numpy.radians(gcrs)), vz)
     vx = GPS.Spd * cos(radians(GPS.GCrs))
     vy = GPS.Spd * sin(radians(GPS.GCrs))
     return Vector3(vx, vy, GPS.VZ)
@@ -1508,24 +1724,15 @@ def sim_body_rates(SIM):
     r = cos(phi)*psiDot*cos(theta) - sin(phi)*thetaDot
     return Vector3(p, q, r)
 
-def reset_state_data():
-    '''reset state data, used on log rewind'''
-    global average_data
-    global derivative_data
-    global lowpass_data
-    global last_diff
-    global last_delta
+def reset_state_data(key=None):
+    '''reset state data, used on log rewind. If key is given only the
+    filters using that key are reset'''
+    get_state().reset(key)
+    if key is not None:
+        return
     global first_fix
     global dcm_state
     global earth_field
-    global last_sum
-    global last_integral
-    average_data.clear()
-    derivative_data.clear()
-    lowpass_data.clear()
-    last_delta.clear()
-    last_sum.clear()
-    last_integral.clear()
     first_fix = None
     dcm_state = None
     earth_field = None
@@ -625,17 +625,12 @@ static PyObject *msg_to_py(PyObject* msgclass, const py_message_t *pymsg) {
     assert(obj);
     Py_DECREF(argList);
 
-    // Find the header subobject
-    PyObject *header = PyObject_GetAttrString(obj, "_header");
-    assert(header);
-
-    // msgid already set in the constructor call
-    set_attribute(header, "mlen", PyInt_FromLong(msg->len));
-    set_attribute(header, "seq", PyInt_FromLong(msg->seq));
-    set_attribute(header, "srcSystem", PyInt_FromLong(msg->sysid));
-    set_attribute(header, "srcComponent", PyInt_FromLong(msg->compid));
-    Py_DECREF(header);
-    header = NULL;
+    // The header is stored packed, so set all of it at once
+    PyObject *ret = PyObject_CallMethod(obj, "_set_header", "Oiiiiii", info->id,
+                                        0, 0, (int) msg->len, (int) msg->seq,
+                                        (int) msg->sysid, (int) msg->compid);
+    assert(ret);
+    Py_DECREF(ret);
 
     // FIXME - we should generate this expensive field only as needed (via a getattr override)
     set_attribute(obj, "_msgbuf", PyByteArray_FromStringAndSize((const char *) pymsg->bytes, pymsg->numBytes));
@@ -818,6 +813,34 @@ py_parse_buffer(NativeConnection *self, PyObject *args)
     PYTHON_EXIT
 }
 
+/**
+  Accumulate the CRC-16/MCRF4XX checksum over a bytes-like object.
+  Used by pymavlink.generator.mavcrc as an accelerated backend.
+*/
+static PyObject *
+py_x25crc_accumulate(PyObject *self, PyObject *args)
+{
+    Py_buffer buf;
+    unsigned short crc = X25_INIT_CRC;
+
+#if PY_MAJOR_VERSION >= 3
+    if (!PyArg_ParseTuple(args, "y*|H", &buf, &crc))
+#else
+    if (!PyArg_ParseTuple(args, "s*|H", &buf, &crc))
+#endif
+        return NULL;
+
+    uint16_t accum = crc;
+    const uint8_t *p = (const uint8_t *)buf.buf;
+    Py_ssize_t len = buf.len;
+    while (len--) {
+        crc_accumulate(*p++, &accum);
+    }
+    PyBuffer_Release(&buf);
+
+    return PyInt_FromLong(accum);
+}
+
 static PyObject *
 NativeConnection_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 {
@@ -950,11 +973,13 @@ PyMODINIT_FUNC
     if (PyType_Ready(&NativeConnectionType) < 0)
         MOD_RETURN(NULL);
 
-#if PY_MAJOR_VERSION < 3
     static PyMethodDef ModuleMethods[] = {
+        {"x25crc_accumulate", (PyCFunction) py_x25crc_accumulate, METH_VARARGS,
+         "Given a bytes-like object and an optional starting crc, return the accumulated CRC-16/MCRF4XX"},
         {NULL, NULL, 0, NULL}        /* Sentinel */
     };
 
+#if PY_MAJOR_VERSION < 3
     PyObject *m = Py_InitModule3("mavnative", ModuleMethods, "Mavnative module");
     if (m == NULL)
         MOD_RETURN(m);
@@ -964,7 +989,7 @@ PyMODINIT_FUNC
         "mavnative",
         "EMavnative module",
         -1,
-        NULL, NULL, NULL, NULL, NULL
+        ModuleMethods, NULL, NULL, NULL, NULL
     };
 
     PyObject *m = PyModule_Create(&mod_def);
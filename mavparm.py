@@ -57,10 +57,10 @@ class MAVParmDict(dict):
             mav.param_set_send(name.upper(), vfloat, parm_type=parm_type)
             tstart = time.time()
             while time.time() - tstart < 1:
-                ack = mav.recv_match(type='PARAM_VALUE', blocking=False)
+                ack = mav.recv_match(type='PARAM_VALUE', blocking=True,
+                                     timeout=tstart + 1 - time.time())
                 if ack is None:
-                    time.sleep(0.1)
-                    continue
+                    break
                 if str(name).upper() == str(ack.param_id).upper():
                     got_ack = True
                     self.__setitem__(name, float(value))
@@ -9,16 +9,23 @@ from __future__ import print_function
 from builtins import object
 
 import socket, math, struct, time, os, fnmatch, array, sys, errno
+import bisect
 import select
 import copy
+import collections
+import hashlib
+import heapq
+import json
 import re
+import threading
 from pymavlink import mavexpression
+# re-exported as mavutil.x25crc, which examples/mav2pcap.py uses
+from pymavlink.generator.mavcrc import x25crc  # noqa: F401
 
 # adding these extra imports allows pymavlink to be used directly with pyinstaller
 # without having complex spec files. To allow for installs that don't have ardupilotmega
 # at all we avoid throwing an exception if it isn't installed
 try:
-    import json
     from pymavlink.dialects.v10 import ardupilotmega
 except Exception:
     pass
@@ -26,6 +33,21 @@ except Exception:
 # maximum packet length for a single receive call - use the UDP limit
 UDP_MAX_PACKET_LEN = 65535
 
+# maximum number of bytes read from a TCP socket in one recv_msg() call
+TCP_MAX_RECV_LEN = 65535
+
+# how often a blocking recv_match() polls links with no file descriptor
+# to wait on, or with idle hooks that expect to be called regularly
+IDLE_POLL_INTERVAL = 0.05
+
+# guards creation of the socket pairs used by mavfile.wakeup()
+wakeup_lock = threading.Lock()
+
+# sidecar index files for tlogs: header, JSON metadata, then little endian uint64 offsets
+TLOG_INDEX_MAGIC = b'TLINDEX\0'
+TLOG_INDEX_VERSION = 1
+TLOG_INDEX_HEADER = struct.Struct('<8sIQd20sI')
+
 # Store the MAVLink library for the currently-selected dialect
 # (set by set_dialect())
 mavlink = None
@@ -52,9 +74,9 @@ def mavlink20():
     '''return True if using MAVLink 2.0'''
     return 'MAVLINK20' in os.environ
 
-def evaluate_expression(expression, vars, nocondition=False):
+def evaluate_expression(expression, vars, nocondition=False, state=None):
     '''evaluation an expression'''
-    return mavexpression.evaluate_expression(expression, vars, nocondition)
+    return mavexpression.evaluate_expression(expression, vars, nocondition, state)
 
 def evaluate_condition(condition, vars):
     '''evaluation a conditional (boolean) statement'''
@@ -65,6 +87,47 @@ def evaluate_condition(condition, vars):
         return False
     return v
 
+class condition_cache(object):
+    '''evaluates a recv_match() condition, reusing the last result until
+    one of the messages the condition uses changes. A condition like
+    GPS.Status>=3 then only needs evaluating when a GPS message arrives,
+    not for every message in between'''
+    def __init__(self):
+        self.condition = None
+        self.expression = None
+        self.depends = None
+        self.values = None
+        self.result = None
+
+    def evaluate(self, condition, vars):
+        '''evaluate a condition, as evaluate_condition() does'''
+        if condition is None:
+            return True
+        if condition != self.condition:
+            self.condition = condition
+            self.expression = mavexpression.compile_expression(condition)
+            self.values = None
+            self.depends = None
+            if self.expression.pure and not 'MAV' in self.expression.names:
+                # MAV holds state which changes without a message arriving
+                self.depends = sorted(self.expression.names)
+        if self.depends is None:
+            return evaluate_condition(condition, vars)
+        # messages are replaced rather than changed when a new one arrives
+        values = [vars.get(name, None) for name in self.depends]
+        if self.values is not None:
+            for (v1, v2) in zip(values, self.values):
+                if v1 is not v2:
+                    break
+            else:
+                return self.result
+        v = self.expression.evaluate(vars)
+        if v is None:
+            v = False
+        self.values = values
+        self.result = v
+        return v
+
 def u_ord(c):
 	return ord(c) if sys.version_info.major < 3 else c
 
@@ -152,6 +215,224 @@ class param_state(object):
     def __init__(self):
         self.params = {}
 
+def copy_param_state(param_state, shared=None):
+    '''copy a dictionary of param_state, with their own params
+    dictionaries. Params that are unchanged from those in the copy shared
+    use its dictionary rather than a new one, so it must not be changed'''
+    ret = {}
+    for (key, state) in param_state.items():
+        state2 = copy.copy(state)
+        prev = shared.get(key, None) if shared is not None else None
+        if prev is not None and prev.params == state.params:
+            state2.params = prev.params
+        else:
+            state2.params = dict(state.params)
+        ret[key] = state2
+    return ret
+
+def _offset_typecode():
+    '''return the array typecode for 64 bit message offsets, or None if
+    there is none. python2 has no 'Q', but 'L' is 64 bits on most 64 bit
+    platforms'''
+    for typecode in ['Q', 'L']:
+        try:
+            if array.array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+OFFSET_TYPECODE = _offset_typecode()
+
+def offset_array(offsets=()):
+    '''return a compact array of message offsets in a log, or a list if
+    there is no 64 bit array type'''
+    if OFFSET_TYPECODE is None:
+        return list(offsets)
+    return array.array(OFFSET_TYPECODE, offsets)
+
+def write_offsets(f, offsets):
+    '''write message offsets to an index file as little endian uint64'''
+    if OFFSET_TYPECODE is not None and sys.byteorder == 'little':
+        offsets.tofile(f)
+        return
+    chunk = 65536
+    for i in range(0, len(offsets), chunk):
+        block = offsets[i:i+chunk]
+        f.write(struct.pack('<%uQ' % len(block), *block))
+
+def read_offsets(data):
+    '''return the offset array held in bytes written by write_offsets()'''
+    if OFFSET_TYPECODE is None or sys.byteorder != 'little':
+        return offset_array(struct.unpack('<%uQ' % (len(data) // 8), data))
+    offsets = offset_array()
+    if sys.version_info.major < 3:
+        offsets.fromstring(data)
+    else:
+        offsets.frombytes(data)
+    return offsets
+
+def replace_file(src, dst):
+    '''rename src to dst, replacing dst if it exists'''
+    if sys.version_info.major >= 3:
+        os.replace(src, dst)
+    else:
+        # os.rename() fails on Windows if dst exists
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+def offset_heap(offset_lists, start):
+    '''return a heap for merging sorted lists of message offsets, beginning
+    with the first offset of each list at or after start'''
+    heap = []
+    for (i, offsets) in enumerate(offset_lists):
+        pos = bisect.bisect_left(offsets, start)
+        if pos < len(offsets):
+            heap.append((offsets[pos], i, pos))
+    heapq.heapify(heap)
+    return heap
+
+def pop_offset(heap, offset_lists):
+    '''return the smallest offset from an offset_heap(), or None once all
+    the lists are used up'''
+    if not heap:
+        return None
+    (ofs, i, pos) = heap[0]
+    pos += 1
+    if pos < len(offset_lists[i]):
+        heapq.heapreplace(heap, (offset_lists[i][pos], i, pos))
+    else:
+        heapq.heappop(heap)
+    return ofs
+
+class message_positions(object):
+    '''the log positions of the messages read while building a time
+    index. Checkpoints hold messages read from the log as their position
+    and timestamp, and decode them again when restored, so the index
+    doesn't keep the latest message of every type alive for each
+    checkpoint'''
+    def __init__(self):
+        self.read = {}
+        self.in_use = {}
+
+    def add(self, m, position):
+        '''note that m was read from the given log position'''
+        self.read[id(m)] = (m, position)
+
+    def refs(self, messages, prev=None):
+        '''return a messages dictionary in the form held by a checkpoint,
+        for restore_messages(). Entries not read from the log, such as
+        'MAV', are kept as they are. The keys are shared with prev, the
+        same dictionary from the previous checkpoint, if unchanged'''
+        keys = []
+        positions = offset_array()
+        timestamps = array.array('d')
+        others = {}
+        for (key, m) in messages.items():
+            r = self.read.get(id(m))
+            if r is None:
+                others[key] = m
+                continue
+            self.in_use[id(m)] = r
+            keys.append(key)
+            positions.append(r[1])
+            timestamps.append(m._timestamp)
+        if prev is not None and prev[0] == keys:
+            keys = prev[0]
+        return (keys, positions, timestamps, others)
+
+    def checkpoint_done(self):
+        '''forget the messages the last checkpoint does not refer to'''
+        self.read = self.in_use
+        self.in_use = {}
+
+def restore_messages(refs, decode, decoded):
+    '''return a messages dictionary from message_positions.refs(),
+    decoding messages with decode(position). decoded caches messages by
+    position, so a message held under several keys is decoded once'''
+    (keys, positions, timestamps, others) = refs
+    ret = dict(others)
+    for (key, position, timestamp) in zip(keys, positions, timestamps):
+        m = decoded.get(position)
+        if m is None:
+            m = decode(position)
+            m._timestamp = timestamp
+            decoded[position] = m
+        ret[key] = m
+    return ret
+
+class time_indexed_log(object):
+    '''seek_time() and iter_range() for log readers that can rewind.
+    Readers provide _checkpoint(prev, positions), returning the state
+    needed to carry on reading from the current position, sharing
+    anything unchanged with the previous checkpoint prev and holding
+    messages through a message_positions. They also provide
+    _restore_checkpoint(state), _clear_params(), _tell() giving the
+    position of the next message and _decode_at(position) decoding it'''
+
+    def build_time_index(self, interval=1000):
+        '''read the log once, keeping a checkpoint of the reader state
+        every interval messages for seek_time(). Timestamps, params and
+        flightmode depend on the messages before them, so this decodes
+        the whole log; the offset index only reads message headers.
+        Each checkpoint is keyed by the latest timestamp before it, so
+        the keys never decrease even where the log's timestamps do'''
+        self._rewind()
+        # params are kept over a rewind; checkpoints hold the params seen
+        # so far in the log
+        self._clear_params()
+        keys = []
+        checkpoints = []
+        latest = float('-inf')
+        positions = message_positions()
+        state = None
+        count = 0
+        while True:
+            if count % interval == 0:
+                state = self._checkpoint(state, positions)
+                positions.checkpoint_done()
+                keys.append(latest)
+                checkpoints.append(state)
+            position = self._tell()
+            m = self.recv_msg()
+            if m is None:
+                break
+            positions.add(m, position)
+            latest = max(latest, m._timestamp)
+            count += 1
+        self._time_index = (keys, checkpoints)
+        self._rewind()
+
+    def seek_time(self, t):
+        '''move to the first message in the log with a timestamp of at
+        least t, returning it, or None if there is none. messages, params
+        and flightmode are restored from the last checkpoint with no such
+        message before it, so only the messages after it are read. The
+        time index is built on first use'''
+        if getattr(self, '_time_index', None) is None:
+            self.build_time_index()
+        (keys, checkpoints) = self._time_index
+        i = max(bisect.bisect_left(keys, t) - 1, 0)
+        self._restore_checkpoint(checkpoints[i])
+        while True:
+            m = self.recv_msg()
+            if m is None or m._timestamp >= t:
+                return m
+
+    def iter_range(self, t0, t1, types=None):
+        '''iterate over the messages with timestamps from t0 to t1,
+        optionally only those of the given types'''
+        if isinstance(types, str):
+            types = set([types])
+        elif types is not None:
+            types = set(types)
+        m = self.seek_time(t0)
+        while m is not None and m._timestamp <= t1:
+            if types is None or m.get_type() in types:
+                yield m
+            m = self.recv_match(type=types)
+
 class mavfile(object):
     '''a generic mavlink port'''
     def __init__(self, fd, address, source_system=255, source_component=0, notimestamps=False, input=True, use_native=default_native):
@@ -194,6 +475,11 @@ class mavfile(object):
         self.WIRE_PROTOCOL_VERSION = mavlink.WIRE_PROTOCOL_VERSION
         self.stop_on_EOF = False
         self.portdead = False
+        # messages already parsed from the link but not yet returned by recv_msg()
+        self.pending_msgs = collections.deque()
+        self.condition_cache = condition_cache()
+        # socket pair used by wakeup(), created when first needed
+        self.wakeup_sockets = None
 
     @property
     def target_system(self):
@@ -313,16 +599,81 @@ class mavfile(object):
         raise RuntimeError('no write() method supplied')
 
 
+    def wakeup_socket(self):
+        '''return the receiving end of the socket pair used by wakeup(),
+        or None if socket pairs are not available'''
+        with wakeup_lock:
+            if self.wakeup_sockets is None:
+                try:
+                    self.wakeup_sockets = socket.socketpair()
+                except (AttributeError, socket.error):
+                    # python 2 has no socketpair() on Windows
+                    self.wakeup_sockets = ()
+                for s in self.wakeup_sockets:
+                    s.setblocking(0)
+                    set_close_on_exec(s.fileno())
+        if len(self.wakeup_sockets) == 0:
+            return None
+        return self.wakeup_sockets[0]
+
+    def wakeup(self):
+        '''wake up a thread waiting in select() or a blocking
+        recv_match() on this link, so it looks at the link again. This
+        may be called from any thread'''
+        if self.wakeup_socket() is None:
+            return
+        try:
+            self.wakeup_sockets[1].send(b'\0')
+        except socket.error:
+            # the socket buffer is full, so a wakeup is already pending
+            pass
+
+    def close_wakeup(self):
+        '''close the socket pair used by wakeup(), called by close()'''
+        with wakeup_lock:
+            if self.wakeup_sockets:
+                for s in self.wakeup_sockets:
+                    s.close()
+            self.wakeup_sockets = None
+
     def select(self, timeout):
-        '''wait for up to timeout seconds for more data'''
-        if self.fd is None:
-            time.sleep(min(timeout,0.5))
+        '''wait for up to timeout seconds for more data, or until
+        wakeup() is called. A timeout of None waits forever, unless
+        the link has no file descriptor in which case it is polled'''
+        wake = self.wakeup_socket()
+        rlist = []
+        if self.fd is not None:
+            rlist.append(self.fd)
+        else:
+            timeout = 0.5 if timeout is None else min(timeout, 0.5)
+        if wake is not None:
+            rlist.append(wake)
+        if len(rlist) == 0:
+            time.sleep(timeout)
             return True
         try:
-            (rin, win, xin) = select.select([self.fd], [], [], timeout)
+            (rin, win, xin) = select.select(rlist, [], [], timeout)
         except select.error:
             return False
-        return len(rin) == 1
+        if wake in rin:
+            try:
+                while wake.recv(64):
+                    pass
+            except socket.error:
+                pass
+        return self.fd is None or self.fd in rin
+
+    def idle_timeout(self, start_time, timeout):
+        '''return how long a blocking recv_match() started at start_time
+        can wait for data, None meaning forever'''
+        if timeout is None:
+            wait = None
+        else:
+            wait = max(start_time + timeout - time.time(), 0)
+        if self.fd is None or len(self.idle_hooks) > 0:
+            if wait is None or wait > IDLE_POLL_INTERVAL:
+                wait = IDLE_POLL_INTERVAL
+        return wait
 
     def pre_message(self):
         '''default pre message call'''
@@ -344,16 +695,19 @@ class mavfile(object):
 
     def post_message(self, msg):
         '''default post message call'''
-        if '_posted' in msg.__dict__:
+        if getattr(msg, '_posted', False):
             return
         msg._posted = True
         msg._timestamp = time.time()
         type = msg.get_type()
 
-        if 'usec' in msg.__dict__:
-            self.uptime = msg.usec * 1.0e-6
-        if 'time_boot_ms' in msg.__dict__:
-            self.uptime = msg.time_boot_ms * 1.0e-3
+        # messages are slotted objects, so use getattr() rather than __dict__
+        usec = getattr(msg, 'usec', None)
+        if usec is not None:
+            self.uptime = usec * 1.0e-6
+        time_boot_ms = getattr(msg, 'time_boot_ms', None)
+        if time_boot_ms is not None:
+            self.uptime = time_boot_ms * 1.0e-3
 
         if self._timestamp is not None:
             if self.notimestamps:
@@ -483,21 +837,18 @@ class mavfile(object):
                 if blocking:
                     for hook in self.idle_hooks:
                         hook(self)
-                    if timeout is None:
-                        self.select(0.05)
-                    else:
-                        self.select(timeout/2)
+                    self.select(self.idle_timeout(start_time, timeout))
                     continue
                 return None
             if type is not None and not m.get_type() in type:
                 continue
-            if not evaluate_condition(condition, self.messages):
+            if not self.condition_cache.evaluate(condition, self.messages):
                 continue
             return m
 
     def check_condition(self, condition):
         '''check if a condition is true'''
-        return evaluate_condition(condition, self.messages)
+        return self.condition_cache.evaluate(condition, self.messages)
 
     def mavlink10(self):
         '''return True if using MAVLink 1.0 or later'''
@@ -956,6 +1307,7 @@ class mavserial(mavfile):
     
     def close(self):
         self.port.close()
+        self.close_wakeup()
 
     def recv(self,n=None):
         if n is None:
@@ -997,6 +1349,7 @@ class mavserial(mavfile):
                 self.fd = self.port.fileno()
             except Exception:
                 self.fd = None
+            self.wakeup()
             self.set_baudrate(self.baud)
             if self.rtscts:
                 self.set_rtscts(self.rtscts)
@@ -1034,6 +1387,7 @@ class mavudp(mavfile):
 
     def close(self):
         self.port.close()
+        self.close_wakeup()
 
     def recv(self,n=None):
         try:
@@ -1079,15 +1433,19 @@ class mavudp(mavfile):
     def recv_msg(self):
         '''message receive routine for UDP link'''
         self.pre_message()
-        s = self.recv()
-        if len(s) > 0:
-            if self.first_byte:
-                self.auto_mavlink_version(s)
+        if len(self.pending_msgs) == 0:
+            s = self.recv()
+            if len(s) > 0:
+                if self.first_byte:
+                    self.auto_mavlink_version(s)
 
-        m = self.mav.parse_char(s)
-        if m is not None:
-            self.post_message(m)
+            # parse the whole datagram in one call, queueing all its messages
+            self.mav.parse_buffer_into(s, self.pending_msgs)
+            if len(self.pending_msgs) == 0:
+                return None
 
+        m = self.pending_msgs.popleft()
+        self.post_message(m)
         return m
 
 class mavmcast(mavfile):
@@ -1128,6 +1486,7 @@ class mavmcast(mavfile):
     def close(self):
         self.port.close()
         self.port_out.close()
+        self.close_wakeup()
 
     def recv(self,n=None):
         try:
@@ -1211,9 +1570,12 @@ class mavtcp(mavfile):
         self.port.setblocking(0)
         set_close_on_exec(self.port.fileno())
         self.port.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+        # keep select() on the new socket after a reconnect
+        self.fd = self.port.fileno()
 
     def close(self):
         self.port.close()
+        self.close_wakeup()
 
     def handle_disconnect(self):
         print("Connection reset or closed by peer on TCP socket")
@@ -1242,6 +1604,29 @@ class mavtcp(mavfile):
 
         return data
 
+    def recv_msg(self):
+        '''message receive routine for TCP link'''
+        self.pre_message()
+        if len(self.pending_msgs) == 0:
+            s = self.recv(TCP_MAX_RECV_LEN)
+            if len(s) > 0:
+                if self.logfile_raw:
+                    self.logfile_raw.write(str(s))
+                if self.first_byte:
+                    self.auto_mavlink_version(s)
+
+            # parse everything available in one call, queueing all complete messages
+            self.mav.parse_buffer_into(s, self.pending_msgs)
+            if len(self.pending_msgs) == 0:
+                return None
+
+        m = self.pending_msgs.popleft()
+        if self.logfile and m.get_type() != 'BAD_DATA':
+            usec = int(time.time() * 1.0e6) & ~3
+            self.logfile.write(str(struct.pack('>Q', usec) + m.get_msgbuf()))
+        self.post_message(m)
+        return m
+
     def write(self, buf):
         if self.port is None:
             try:
@@ -1264,6 +1649,7 @@ class mavtcp(mavfile):
                 self.port.close()
                 self.port = None
             self.do_connect()
+            self.wakeup()
 
 
 class mavtcpin(mavfile):
@@ -1285,7 +1671,10 @@ class mavtcpin(mavfile):
         self.port = None
 
     def close(self):
+        if self.port is not None:
+            self.port.close()
         self.listen.close()
+        self.close_wakeup()
 
     def recv(self,n=None):
         if not self.port:
@@ -1305,12 +1694,20 @@ class mavtcpin(mavfile):
         except socket.error as e:
             if e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK ]:
                 return ""
-            self.port.close()
-            self.port = None
-            self.fd = self.listen.fileno()
+            self.drop_client()
             return ''
+        if len(data) == 0:
+            # EOF, go back to waiting for a new client
+            self.drop_client()
         return data
 
+    def drop_client(self):
+        '''close the client connection and listen for a new one'''
+        self.port.close()
+        self.port = None
+        self.fd = self.listen.fileno()
+        self.wakeup()
+
     def write(self, buf):
         if self.port is None:
             return
@@ -1318,9 +1715,7 @@ class mavtcpin(mavfile):
             self.port.send(buf)
         except socket.error as e:
             if e.errno in [ errno.EPIPE ]:
-                self.port.close()
-                self.port = None
-                self.fd = self.listen.fileno()
+                self.drop_client()
             pass
 
 
@@ -1355,6 +1750,7 @@ class mavlogfile(mavfile):
 
     def close(self):
         self.f.close()
+        self.close_wakeup()
 
     def recv(self,n=None):
         if n is None:
@@ -1419,10 +1815,14 @@ class mavlogfile(mavfile):
         msg._link = self._link
 
 
-class mavmmaplog(mavlogfile):
+class mavmmaplog(mavlogfile, time_indexed_log):
     '''a MAVLink log file accessed via mmap. Used for fast read-only
-    access with low memory overhead where particular message types are wanted'''
-    def __init__(self, filename, progress_callback=None):
+    access with low memory overhead where particular message types are wanted.
+
+    If index_cache is True an index of message offsets is kept in
+    filename.idx. The index is extended if the log has grown since it was
+    written, which suits logs that are still being recorded'''
+    def __init__(self, filename, progress_callback=None, index_cache=False):
         import platform, mmap
         mavlogfile.__init__(self, filename)
         self.f.seek(0, 2)
@@ -1433,7 +1833,14 @@ class mavmmaplog(mavlogfile):
         else:
             self.data_map = mmap.mmap(self.f.fileno(), self.data_len, mmap.MAP_PRIVATE, mmap.PROT_READ)
         self._rewind()
-        self.init_arrays(progress_callback)
+        index_filename = filename + '.idx'
+        if index_cache and self.load_index(index_filename, progress_callback):
+            if self._indexed_len != self.data_len:
+                self.save_index(index_filename)
+        else:
+            self.init_arrays(progress_callback)
+            if index_cache:
+                self.save_index(index_filename)
         self._flightmodes = None
 
     def _rewind(self):
@@ -1455,7 +1862,8 @@ class mavmmaplog(mavlogfile):
         '''initialise arrays for fast recv_match()'''
 
         # dictionary indexed by msgid, mapping to arrays of file offsets where
-        # each instance of a msg type is found
+        # each instance of a msg type is found. These are compact uint64
+        # arrays rather than lists, as a long log has millions of messages
         self.offsets = {}
 
         # number of msgs of each msg type
@@ -1470,9 +1878,14 @@ class mavmmaplog(mavlogfile):
 
         self.instance_offsets = {}
 
+        # instance values seen for each msg type with an instance field
+        self.instances = {}
+
         self.type_nums = None
+        self._scan(0, progress_callback)
 
-        ofs = 0
+    def _scan(self, ofs, progress_callback=None):
+        '''add the messages from ofs onwards to the offset arrays'''
         pct = 0
 
         MARKER_V1 = 0xFE
@@ -1503,7 +1916,7 @@ class mavmmaplog(mavlogfile):
                 if not mtype in mavlink.mavlink_map:
                     ofs += mlen
                     continue
-                self.offsets[mtype] = []
+                self.offsets[mtype] = offset_array()
                 self.counts[mtype] = 0
                 msg = mavlink.mavlink_map[mtype]
                 self.name_to_id[msg.name] = mtype
@@ -1513,6 +1926,7 @@ class mavmmaplog(mavlogfile):
                 add_message(self.messages, msg.name, m)
                 if m._instance_field is not None:
                     self.instance_offsets[mtype] = m._instance_offset
+                    self.instances[mtype] = set()
 
             if mtype in self.instance_offsets:
                 # populate the messages array with a new instance. This assumes we can get the instance
@@ -1524,6 +1938,7 @@ class mavmmaplog(mavlogfile):
                 self.f.seek(instance_field_ofs)
                 b = self.f.read(1)
                 instance, = struct.unpack('b', b)
+                self.instances[mtype].add(instance)
                 mname = self.id_to_name[mtype]
                 if mname in self.messages:
                     self.messages["%s[%s]" % (mname, str(instance))] = self.messages[mname]
@@ -1537,38 +1952,257 @@ class mavmmaplog(mavlogfile):
                 progress_callback(new_pct)
                 pct = new_pct
 
-        for mtype in self.counts:
-            self._count += self.counts[mtype]
+        self.scan_ofs = ofs
+        self._count = sum(self.counts.values())
         self.offset = 0
         self._rewind()
 
+    def _index_header(self, indexed_len):
+        '''return the header identifying the first indexed_len bytes of
+        this log in an index file'''
+        h = hashlib.sha1(self.data_map[:min(indexed_len, 65536)])
+        h.update(self.data_map[max(indexed_len-256, 0):indexed_len])
+        st = os.fstat(self.f.fileno())
+        return (TLOG_INDEX_MAGIC, TLOG_INDEX_VERSION, indexed_len, st.st_mtime, h.digest())
+
+    def save_index(self, filename):
+        '''save the message offsets to an index file, returning True on success'''
+        types = sorted(self.offsets.keys())
+        meta = {
+            'scan_ofs' : self.scan_ofs,
+            'types' : [[mtype, self.id_to_name[mtype], self.counts[mtype]] for mtype in types],
+            'instances' : [[mtype, sorted(self.instances[mtype])] for mtype in self.instances],
+        }
+        meta = json.dumps(meta).encode('utf-8')
+        tmpname = filename + '.tmp'
+        try:
+            with open(tmpname, 'wb') as f:
+                f.write(TLOG_INDEX_HEADER.pack(*(self._index_header(self.data_len) + (len(meta),))))
+                f.write(meta)
+                for mtype in types:
+                    write_offsets(f, self.offsets[mtype])
+            replace_file(tmpname, filename)
+        except (IOError, OSError) as ex:
+            print("Failed to save index %s: %s" % (filename, ex), file=sys.stderr)
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+            return False
+        self._indexed_len = self.data_len
+        return True
+
+    def load_index(self, filename, progress_callback=None):
+        '''load an index file written by save_index(), returning False if
+        it is missing or does not match this log. If the log has grown
+        since the index was written the new messages are scanned'''
+        import mmap
+        try:
+            f = open(filename, 'rb')
+        except (IOError, OSError):
+            return False
+        with f:
+            f.seek(0, 2)
+            idx_len = f.tell()
+            if idx_len < TLOG_INDEX_HEADER.size:
+                return False
+            idx_map = mmap.mmap(f.fileno(), idx_len, access=mmap.ACCESS_READ)
+        try:
+            hdr = TLOG_INDEX_HEADER.unpack_from(idx_map, 0)
+            indexed_len = hdr[2]
+            if indexed_len > self.data_len:
+                return False
+            expected = self._index_header(indexed_len)
+            if hdr[:3] != expected[:3] or hdr[4] != expected[4]:
+                return False
+            if indexed_len == self.data_len and hdr[3] != expected[3]:
+                # same size but modified
+                return False
+            ofs = TLOG_INDEX_HEADER.size
+            meta = json.loads(idx_map[ofs:ofs+hdr[5]].decode('utf-8'))
+            ofs += hdr[5]
+            offsets = {}
+            counts = {}
+            for (mtype, name, n) in meta['types']:
+                if not mtype in mavlink.mavlink_map or mavlink.mavlink_map[mtype].name != name:
+                    # index was written with a different dialect
+                    return False
+                a = read_offsets(idx_map[ofs:ofs+8*n])
+                if len(a) != n:
+                    return False
+                offsets[mtype] = a
+                counts[mtype] = n
+                ofs += 8*n
+        except (ValueError, KeyError, TypeError, struct.error):
+            return False
+        finally:
+            idx_map.close()
+
+        self.offsets = offsets
+        self.counts = counts
+        self.name_to_id = {}
+        self.id_to_name = {}
+        self.instance_offsets = {}
+        self.instances = {}
+        self.type_nums = None
+        for (mtype, instances) in meta['instances']:
+            self.instances[mtype] = set(instances)
+        for mtype in offsets:
+            msg = mavlink.mavlink_map[mtype]
+            self.name_to_id[msg.name] = mtype
+            self.id_to_name[mtype] = msg.name
+            # the first message of each type populates self.messages, as in init_arrays()
+            self.f.seek(offsets[mtype][0])
+            m = self.recv_msg()
+            add_message(self.messages, msg.name, m)
+            if m._instance_field is not None:
+                self.instance_offsets[mtype] = m._instance_offset
+                self.instances.setdefault(mtype, set())
+                for instance in self.instances[mtype]:
+                    self.messages["%s[%s]" % (msg.name, str(instance))] = self.messages[msg.name]
+        self._indexed_len = indexed_len
+        self._scan(meta['scan_ofs'], progress_callback)
+        return True
+
+    def to_numpy(self, mtype, fields=None):
+        '''return a numpy structured array with one row for every message
+        of type mtype in the log. fields is a list of field names, defaulting
+        to all fields of the message, and a _timestamp column holding the
+        tlog timestamp is always added. Payloads are decoded in one
+        vectorised step; char[] fields are returned as unterminated bytes'''
+        import numpy as np
+        if mtype in self.name_to_id:
+            msgcls = mavlink.mavlink_map[self.name_to_id[mtype]]
+        else:
+            # not in this log, return an empty array of the right dtype
+            classes = [c for c in mavlink.mavlink_map.values() if c.name == mtype]
+            if len(classes) == 0:
+                raise KeyError("Unknown message type %s" % mtype)
+            msgcls = classes[0]
+        if fields is None:
+            fields = msgcls.fieldnames
+        offsets = np.array(self.offsets.get(msgcls.id, []), dtype=np.int64)
+
+        # build a dtype matching the wire layout of the payload
+        np_types = { 'f' : 'f4', 'd' : 'f8', 'c' : 'S1', 'b' : 'i1', 'B' : 'u1',
+                     'h' : 'i2', 'H' : 'u2', 'i' : 'i4', 'I' : 'u4', 'q' : 'i8', 'Q' : 'u8' }
+        endian = msgcls.format[0]
+        wire_fields = []
+        for (name, (count, fmt)) in zip(msgcls.ordered_fieldnames,
+                                        re.findall(r'(\d*)([a-zA-Z])', msgcls.format[1:])):
+            count = int(count) if count else 1
+            if fmt == 's':
+                wire_fields.append((name, 'S%u' % count))
+            elif count > 1:
+                wire_fields.append((name, endian + np_types[fmt], (count,)))
+            else:
+                wire_fields.append((name, endian + np_types[fmt]))
+        wire_dtype = np.dtype(wire_fields)
+        csize = wire_dtype.itemsize
+
+        data = np.frombuffer(self.data_map, dtype=np.uint8)
+        raw = np.zeros((len(offsets), csize), dtype=np.uint8)
+        tusec = np.empty(len(offsets), dtype='>u8')
+        # gather in chunks to bound the size of the index arrays
+        col = np.arange(csize)
+        tcol = np.arange(8)
+        chunk = 65536
+        for i in range(0, len(offsets), chunk):
+            ofs = offsets[i:i+chunk]
+            # payload start and length of each message, MAVLink2 payloads may be truncated
+            start = ofs + np.where(data[ofs + 8] == 0xFD, 18, 14)
+            mlen = np.minimum(data[ofs + 9].astype(np.int64), csize)
+            idx = start[:,np.newaxis] + col[np.newaxis,:]
+            mask = (col[np.newaxis,:] < mlen[:,np.newaxis]) & (idx < self.data_len)
+            raw[i:i+chunk][mask] = data[idx[mask]]
+            # tlog timestamps are big endian microseconds before each frame
+            tidx = ofs[:,np.newaxis] + tcol[np.newaxis,:]
+            tusec[i:i+chunk] = np.ascontiguousarray(data[tidx]).view('>u8').reshape(len(ofs))
+        payloads = raw.view(wire_dtype).reshape(len(offsets))
+
+        ret = np.zeros(len(offsets), dtype=[wire_dtype.descr[wire_dtype.names.index(f)] for f in fields] +
+                       [('_timestamp', 'f8')])
+        for f in fields:
+            ret[f] = payloads[f]
+        ret['_timestamp'] = tusec * 1.0e-6
+        return ret
+
     def skip_to_type(self, type):
         '''skip fwd to next msg matching given type set'''
         if self.type_nums is None:
             # always add some key msg types so we can track flightmode, params etc
             type = type.copy()
             type.update(set(['HEARTBEAT','PARAM_VALUE']))
-            self.indexes = []
-            self.type_nums = []
-            for t in type:
-                if not t in self.name_to_id:
-                    continue
-                self.type_nums.append(self.name_to_id[t])
-                self.indexes.append(0)
-        smallest_index = -1
-        smallest_offset = self.data_len
-        for i in range(len(self.type_nums)):
-            mtype = self.type_nums[i]
-            if self.indexes[i] >= self.counts[mtype]:
-                continue
-            ofs = self.offsets[mtype][self.indexes[i]]
-            if ofs < smallest_offset:
-                smallest_offset = ofs
-                smallest_index = i
-        if smallest_index >= 0:
-            self.indexes[smallest_index] += 1
-            self.offset = smallest_offset
-            self.f.seek(smallest_offset)
+            self.type_nums = [self.name_to_id[t] for t in type if t in self.name_to_id]
+            self.type_offsets = [self.offsets[mtype] for mtype in self.type_nums]
+            # start from the current position, which may follow a seek_time()
+            self.type_heap = offset_heap(self.type_offsets, self.f.tell())
+        ofs = pop_offset(self.type_heap, self.type_offsets)
+        if ofs is not None:
+            self.offset = ofs
+            self.f.seek(ofs)
+
+    def _checkpoint(self, prev, positions=None):
+        '''return the reader state needed to carry on reading from here'''
+        if positions is None:
+            positions = message_positions()
+        state = {}
+        for k in ['sysid', 'param_sysid', 'mav_loss', 'mav_count', 'uptime', 'timestamp',
+                  '_timestamp', '_last_timestamp', '_link']:
+            state[k] = getattr(self, k)
+        state['offset'] = self.f.tell()
+        state['last_seq'] = dict(self.last_seq)
+        # the messages of every sysid, and the last message, in one dictionary
+        messages = {}
+        sysid_state = {}
+        for (sysid, s) in self.sysid_state.items():
+            for (key, m) in s.messages.items():
+                if key != 'MAV':
+                    messages[(sysid, key)] = m
+            s2 = copy.copy(s)
+            s2.messages = None
+            sysid_state[sysid] = s2
+        if self._last_message is not None:
+            messages['_last_message'] = self._last_message
+        state['messages'] = positions.refs(messages, prev['messages'] if prev is not None else None)
+        state['sysid_state'] = sysid_state
+        state['param_state'] = copy_param_state(self.param_state,
+                                                prev['param_state'] if prev is not None else None)
+        return state
+
+    def _restore_checkpoint(self, state):
+        '''go back to a state returned by _checkpoint()'''
+        messages = restore_messages(state['messages'], self._decode_at, {})
+        self._rewind()
+        for k in ['sysid', 'param_sysid', 'mav_loss', 'mav_count', 'uptime', 'timestamp',
+                  '_timestamp', '_last_timestamp', '_link']:
+            setattr(self, k, state[k])
+        self.f.seek(state['offset'])
+        self.offset = state['offset']
+        self.last_seq = dict(state['last_seq'])
+        self._last_message = messages.pop('_last_message', None)
+        self.sysid_state = {}
+        for (sysid, s) in state['sysid_state'].items():
+            s2 = copy.copy(s)
+            s2.messages = {'MAV' : s2}
+            self.sysid_state[sysid] = s2
+        for ((sysid, key), m) in messages.items():
+            self.sysid_state[sysid].messages[key] = m
+        self.param_state = copy_param_state(state['param_state'])
+
+    def _tell(self):
+        '''return the position of the next message, for build_time_index()'''
+        return self.f.tell()
+
+    def _decode_at(self, ofs):
+        '''decode the message at offset ofs, for _restore_checkpoint()'''
+        self.f.seek(ofs)
+        return self.recv_msg()
+
+    def _clear_params(self):
+        '''forget all params seen so far'''
+        for state in self.param_state.values():
+            state.params.clear()
 
     def recv_match(self, condition=None, type=None, blocking=False, timeout=None):
         '''recv the next message that matches the given condition
@@ -1578,23 +2212,21 @@ class mavmmaplog(mavlogfile):
                 type = set([type])
             elif isinstance(type, list):
                 type = set(type)
+        start_time = time.time()
         while True:
             if type is not None:
                 self.skip_to_type(type)
             m = self.recv_msg()
             if m is None:
-                if blocking:
+                if blocking and (timeout is None or time.time() < start_time + timeout):
                     for hook in self.idle_hooks:
                         hook(self)
-                    if timeout is None:
-                        self.select(0.05)
-                    else:
-                        self.select(timeout/2)
+                    self.select(self.idle_timeout(start_time, timeout))
                     continue
                 return None
             if type is not None and not m.get_type() in type:
                 continue
-            if not evaluate_condition(condition, self.messages):
+            if not self.condition_cache.evaluate(condition, self.messages):
                 continue
             return m
         
@@ -1645,6 +2277,7 @@ class mavchildexec(mavfile):
 
     def close(self):
         self.child.close()
+        self.close_wakeup()
 
     def recv(self,n=None):
         try:
@@ -1663,8 +2296,10 @@ def mavlink_connection(device, baud=115200, source_system=255, source_component=
                        dialect=None, autoreconnect=False, zero_time_base=False,
                        retries=3, use_native=default_native,
                        force_connected=False, progress_callback=None,
-                       udp_timeout=0, **opts):
-    '''open a serial, UDP, TCP or file mavlink connection'''
+                       udp_timeout=0, index_cache=False, **opts):
+    '''open a serial, UDP, TCP or file mavlink connection. If index_cache
+    is True an index file is kept alongside DataFlash logs and tlogs to
+    speed up opening them again'''
     global mavfile_global
 
     if force_connected:
@@ -1697,7 +2332,8 @@ def mavlink_connection(device, baud=115200, source_system=255, source_component=
     if device.lower().endswith('.bin') or device.lower().endswith('.px4log'):
         # support dataflash logs
         from pymavlink import DFReader
-        m = DFReader.DFReader_binary(device, zero_time_base=zero_time_base, progress_callback=progress_callback)
+        m = DFReader.DFReader_binary(device, zero_time_base=zero_time_base, progress_callback=progress_callback,
+                                     index_cache=index_cache)
         mavfile_global = m
         return m
 
@@ -1739,7 +2375,7 @@ def mavlink_connection(device, baud=115200, source_system=255, source_component=
             print("executing '%s'" % device)
             return mavchildexec(device, source_system=source_system, source_component=source_component, use_native=use_native)
         elif not write and not append and not notimestamps:
-            return mavmmaplog(device, progress_callback=progress_callback)
+            return mavmmaplog(device, progress_callback=progress_callback, index_cache=index_cache)
         else:
             return mavlogfile(device, planner_format=planner_format, write=write,
                               append=append, robust_parsing=robust_parsing, notimestamps=notimestamps,
@@ -2221,27 +2857,6 @@ def mode_string_acm(mode_number):
         return mode_mapping_acm[mode_number]
     return "Mode(%u)" % mode_number
 
-class x25crc(object):
-    '''CRC-16/MCRF4XX - based on checksum.h from mavlink library'''
-    def __init__(self, buf=''):
-        self.crc = 0xffff
-        self.accumulate(buf)
-
-    def accumulate(self, buf):
-        '''add in some more bytes'''
-        byte_buf = array.array('B')
-        if isinstance(buf, array.array):
-            byte_buf.extend(buf)
-        else:
-            byte_buf.fromstring(buf)
-        accum = self.crc
-        for b in byte_buf:
-            tmp = b ^ (accum & 0xff)
-            tmp = (tmp ^ (tmp<<4)) & 0xFF
-            accum = (accum>>8) ^ (tmp<<8) ^ (tmp<<3) ^ (tmp>>4)
-            accum = accum & 0xFFFF
-        self.crc = accum
-
 class MavlinkSerialPort(object):
         '''an object that looks like a serial port, but
         transmits using mavlink SERIAL_CONTROL packets'''
@@ -9,7 +9,7 @@ from __future__ import absolute_import, division, print_function
 
 from builtins import object
 import numpy as np
-from .rotmat import Vector3, Matrix3
+from .rotmat import Vector3, Matrix3, Vector3Array, Matrix3Array
 
 __author__ = "Thomas Gubler"
 __copyright__ = "Copyright (C) 2014 Thomas Gubler"
@@ -627,6 +627,313 @@ class Quaternion(QuaternionBase):
         """
         return Quaternion(super(Quaternion, self).__truediv__(other))
 
+class QuaternionArray(object):
+
+    """
+    An array of N quaternions, held in an Nx4 array of [w, x, y, z], for
+    converting and combining whole logs of attitudes at once. Conversions
+    match QuaternionBase applied to each quaternion.
+
+    Usage:
+        >>> from quaternion import QuaternionArray
+        >>> import numpy as np
+        >>> q = QuaternionArray(np.radians([[20, 20, 20], [0, 0, 90]]))
+        >>> print(q.q)
+        [[0.9603483  0.13871646 0.19810763 0.13871646]
+         [0.70710678 0.         0.         0.70710678]]
+        >>> v = q.transform([[0, 1, 0], [1, 0, 0]])
+    """
+
+    def __init__(self, attitude):
+        """
+        Construct quaternions from attitudes
+
+        :param attitude: another QuaternionArray, a list of QuaternionBase,
+            Nx4 array of [w, x, y, z], Nx3 array of [roll, pitch, yaw],
+            Nx3x3 array of DCMs or a Matrix3Array
+        """
+        if isinstance(attitude, QuaternionArray):
+            self.q = attitude.q.copy()
+        elif isinstance(attitude, Matrix3Array):
+            self.dcm = attitude.m
+        elif len(attitude) > 0 and isinstance(attitude[0], QuaternionBase):
+            self.q = np.array([a.q for a in attitude])
+        else:
+            attitude = np.asarray(attitude, dtype=float)
+            if attitude.ndim == 3 and attitude.shape[1:] == (3, 3):
+                self.dcm = attitude
+            elif attitude.ndim == 2 and attitude.shape[1] == 4:
+                self.q = attitude
+            elif attitude.ndim == 2 and attitude.shape[1] == 3:
+                self.euler = attitude
+            elif attitude.size == 0:
+                self.q = np.zeros((0, 4))
+            else:
+                raise TypeError("attitude is not valid")
+
+    @property
+    def q(self):
+        """
+        Get the quaternions
+        :returns: Nx4 array of [w, x, y, z]
+        """
+        return self._q
+
+    @q.setter
+    def q(self, q):
+        """
+        Set the quaternions
+        :param q: Nx4 array of [w, x, y, z]
+        """
+        q = np.array(q, dtype=float)
+        assert(q.ndim == 2 and q.shape[1] == 4)
+        self._q = q
+
+    @property
+    def euler(self):
+        """
+        Get the euler angles, using the same convention as QuaternionBase
+        :returns: Nx3 array of [roll, pitch, yaw]
+        """
+        return self._dcm_to_euler(self.dcm)
+
+    @euler.setter
+    def euler(self, euler):
+        """
+        Set the quaternions from euler angles
+        :param euler: Nx3 array of [roll, pitch, yaw]
+        """
+        euler = np.asarray(euler, dtype=float)
+        assert(euler.ndim == 2 and euler.shape[1] == 3)
+        self._q = self._euler_to_q(euler)
+
+    @property
+    def dcm(self):
+        """
+        Get the DCMs
+        :returns: Nx3x3 array
+        """
+        return self._q_to_dcm(self._q)
+
+    @dcm.setter
+    def dcm(self, dcm):
+        """
+        Set the quaternions from DCMs
+        :param dcm: Nx3x3 array
+        """
+        dcm = np.asarray(dcm, dtype=float)
+        assert(dcm.ndim == 3 and dcm.shape[1:] == (3, 3))
+        self._q = self._dcm_to_q(dcm)
+
+    def __len__(self):
+        return len(self._q)
+
+    def __getitem__(self, i):
+        q = self._q[i]
+        if q.ndim == 1:
+            return QuaternionBase(q)
+        return QuaternionArray(q)
+
+    def __str__(self):
+        """String of quaternion values"""
+        return str(self._q)
+
+    @property
+    def norm(self):
+        """
+        Returns norms of the quaternions
+        :returns: array of N norms
+        """
+        return np.sqrt(np.einsum('ij,ij->i', self._q, self._q))
+
+    def normalize(self):
+        """Normalizes the quaternions"""
+        self._q = self._q / self.norm[:, np.newaxis]
+
+    @property
+    def inversed(self):
+        """
+        Get inversed quaternions
+        :returns: QuaternionArray
+        """
+        return QuaternionArray(self._q * [1, -1, -1, -1])
+
+    def close(self, other):
+        """
+        Equality test with tolerance for each quaternion
+        (same orientation, not necessarily same rotation)
+
+        :param other: a QuaternionArray, QuaternionBase or array
+        :returns: array of N booleans
+        """
+        o = self._other_q(other)
+        return (np.isclose(self._q, o).all(axis=-1) |
+                np.isclose(self._q, -o).all(axis=-1))
+
+    def _other_q(self, other):
+        """return quaternions to combine with as an array"""
+        if isinstance(other, QuaternionArray):
+            return other.q
+        if isinstance(other, QuaternionBase):
+            return other.q
+        return np.asarray(other, dtype=float)
+
+    def __mul__(self, other):
+        """
+        :param other: QuaternionArray, QuaternionBase or Nx4 array
+        :returns: multiplication of these quaternions with other
+        """
+        return QuaternionArray(self._mul_array(self._q, self._other_q(other)))
+
+    def __rmul__(self, other):
+        """
+        :param other: QuaternionBase or array of len 4
+        :returns: multiplication of other with these quaternions
+        """
+        return QuaternionArray(self._mul_array(self._other_q(other), self._q))
+
+    def __truediv__(self, other):
+        """
+        :param other: QuaternionArray, QuaternionBase or Nx4 array
+        :returns: division of these quaternions by other
+        """
+        o = self._other_q(other) * [1, -1, -1, -1]
+        return QuaternionArray(self._mul_array(self._q, o))
+
+    __div__ = __truediv__
+
+    def transform(self, v):
+        """
+        Calculates the vectors transformed by these quaternions
+        :param v: Vector3Array, Nx3 array or one vector of len 3
+        :returns: transformed vectors, as a Vector3Array for a
+            Vector3Array or Vector3 and an Nx3 array otherwise
+        """
+        vectors = isinstance(v, (Vector3, Vector3Array))
+        if isinstance(v, Vector3):
+            v = [v.x, v.y, v.z]
+        elif isinstance(v, Vector3Array):
+            v = v.v
+        # as QuaternionBase.transform, t = q * [0, v] * q^-1
+        q0 = self._q[:, 0:1]
+        qi = self._q[:, 1:4]
+        ui = np.broadcast_to(np.asarray(v, dtype=float), qi.shape)
+        a = q0 * ui + np.cross(qi, ui)
+        t = np.einsum('ij,ij->i', qi, ui)[:, np.newaxis] * qi + q0 * a - np.cross(a, qi)
+        if vectors:
+            return Vector3Array(t)
+        return t
+
+    @staticmethod
+    def _mul_array(p, q):
+        """
+        Performs multiplication of arrays of quaternions p and q
+        :param p: Nx4 array or array of len 4
+        :param q: Nx4 array or array of len 4
+        :returns: Nx4 array, result of p * q
+        """
+        (p, q) = np.broadcast_arrays(np.atleast_2d(p), np.atleast_2d(q))
+        res = np.empty(p.shape)
+        res[:, 0] = p[:, 0] * q[:, 0] - np.einsum('ij,ij->i', p[:, 1:4], q[:, 1:4])
+        res[:, 1:4] = (p[:, 0:1] * q[:, 1:4] + q[:, 0:1] * p[:, 1:4] +
+                       np.cross(p[:, 1:4], q[:, 1:4]))
+        return res
+
+    @staticmethod
+    def _euler_to_q(euler):
+        """
+        Create quaternions from euler angles
+        :param euler: Nx3 array of [roll, pitch, yaw] in rad
+        :returns: Nx4 array of [w, x, y, z]
+        """
+        c = np.cos(euler / 2)
+        s = np.sin(euler / 2)
+        (c_phi_2, c_theta_2, c_psi_2) = (c[:, 0], c[:, 1], c[:, 2])
+        (s_phi_2, s_theta_2, s_psi_2) = (s[:, 0], s[:, 1], s[:, 2])
+        q = np.empty((len(euler), 4))
+        q[:, 0] = (c_phi_2 * c_theta_2 * c_psi_2 +
+                   s_phi_2 * s_theta_2 * s_psi_2)
+        q[:, 1] = (s_phi_2 * c_theta_2 * c_psi_2 -
+                   c_phi_2 * s_theta_2 * s_psi_2)
+        q[:, 2] = (c_phi_2 * s_theta_2 * c_psi_2 +
+                   s_phi_2 * c_theta_2 * s_psi_2)
+        q[:, 3] = (c_phi_2 * c_theta_2 * s_psi_2 -
+                   s_phi_2 * s_theta_2 * c_psi_2)
+        return q
+
+    @staticmethod
+    def _q_to_dcm(q):
+        """
+        Create DCMs from quaternions
+        :param q: Nx4 array of [w, x, y, z]
+        :returns: Nx3x3 array
+        """
+        (a, b, c, d) = (q[:, 0], q[:, 1], q[:, 2], q[:, 3])
+        a_sq = a * a
+        b_sq = b * b
+        c_sq = c * c
+        d_sq = d * d
+        dcm = np.empty((len(q), 3, 3))
+        dcm[:, 0, 0] = a_sq + b_sq - c_sq - d_sq
+        dcm[:, 0, 1] = 2 * (b * c - a * d)
+        dcm[:, 0, 2] = 2 * (a * c + b * d)
+        dcm[:, 1, 0] = 2 * (b * c + a * d)
+        dcm[:, 1, 1] = a_sq - b_sq + c_sq - d_sq
+        dcm[:, 1, 2] = 2 * (c * d - a * b)
+        dcm[:, 2, 0] = 2 * (b * d - a * c)
+        dcm[:, 2, 1] = 2 * (a * b + c * d)
+        dcm[:, 2, 2] = a_sq - b_sq - c_sq + d_sq
+        return dcm
+
+    @staticmethod
+    def _dcm_to_q(dcm):
+        """
+        Create quaternions from DCMs, as QuaternionBase._dcm_to_q
+        :param dcm: Nx3x3 array
+        :returns: Nx4 array of [w, x, y, z]
+        """
+        q = np.empty((len(dcm), 4))
+        tr = np.trace(dcm, axis1=1, axis2=2)
+        pos = tr > 0
+        d = dcm[pos]
+        s = np.sqrt(tr[pos] + 1.0)
+        q[pos, 0] = s * 0.5
+        s = 0.5 / s
+        q[pos, 1] = (d[:, 2, 1] - d[:, 1, 2]) * s
+        q[pos, 2] = (d[:, 0, 2] - d[:, 2, 0]) * s
+        q[pos, 3] = (d[:, 1, 0] - d[:, 0, 1]) * s
+
+        dcm_i = np.argmax(np.diagonal(dcm, axis1=1, axis2=2), axis=1)
+        for i in range(3):
+            rows = ~pos & (dcm_i == i)
+            j = (i + 1) % 3
+            k = (i + 2) % 3
+            d = dcm[rows]
+            s = np.sqrt((d[:, i, i] - d[:, j, j] - d[:, k, k]) + 1.0)
+            q[rows, i + 1] = s * 0.5
+            s = 0.5 / s
+            q[rows, j + 1] = (d[:, i, j] + d[:, j, i]) * s
+            q[rows, k + 1] = (d[:, k, i] + d[:, i, k]) * s
+            q[rows, 0] = (d[:, k, j] - d[:, j, k]) * s
+        return q
+
+    @staticmethod
+    def _dcm_to_euler(dcm):
+        """
+        Create euler angles from DCMs, as QuaternionBase._dcm_to_euler
+        :param dcm: Nx3x3 array
+        :returns: Nx3 array of [roll, pitch, yaw] in rad
+        """
+        theta = np.arcsin(np.clip(-dcm[:, 2, 0], -1, 1))
+        # the gimbal lock cases only find the yaw
+        locked = np.abs(np.abs(theta) - np.pi/2) < 1.0e-3
+        phi = np.where(locked, 0.0, np.arctan2(dcm[:, 2, 1], dcm[:, 2, 2]))
+        psi = np.where(locked,
+                       np.arctan2(dcm[:, 1, 2] - dcm[:, 0, 1], dcm[:, 0, 2] + dcm[:, 1, 1]),
+                       np.arctan2(dcm[:, 1, 0], dcm[:, 0, 0]))
+        return np.stack([phi, theta, psi], axis=-1)
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -29,6 +29,8 @@ from math import sin, cos, sqrt, asin, atan2, pi, acos
 
 class Vector3(object):
     '''a vector'''
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x=None, y=None, z=None):
         if x is not None and y is not None and z is not None:
             self.x = float(x)
@@ -68,11 +70,23 @@ class Vector3(object):
 
     __radd__ = __add__
 
+    def __iadd__(self, v):
+        self.x += v.x
+        self.y += v.y
+        self.z += v.z
+        return self
+
     def __sub__(self, v):
         return Vector3(self.x - v.x,
                        self.y - v.y,
                        self.z - v.z)
 
+    def __isub__(self, v):
+        self.x -= v.x
+        self.y -= v.y
+        self.z -= v.z
+        return self
+
     def __neg__(self):
         return Vector3(-self.x, -self.y, -self.z)
 
@@ -91,6 +105,15 @@ class Vector3(object):
 
     __rmul__ = __mul__
 
+    def __imul__(self, v):
+        if isinstance(v, Vector3):
+            # a dot product isn't a vector
+            return NotImplemented
+        self.x *= v
+        self.y *= v
+        self.z *= v
+        return self
+
     def __div__(self, v):
         return Vector3(self.x / v,
                        self.y / v,
@@ -101,6 +124,14 @@ class Vector3(object):
                        self.y / v,
                        self.z / v)
 
+    def __itruediv__(self, v):
+        self.x /= v
+        self.y /= v
+        self.z /= v
+        return self
+
+    __idiv__ = __itruediv__
+
     def __floordiv__(self, v):
         return Vector3(self.x // v,
                        self.y // v,
@@ -136,6 +167,16 @@ class Vector3(object):
         self.y = v.y
         self.z = v.z
 
+    def rotate_inplace(self, m):
+        '''multiply this vector by a matrix, as m * self, without
+        creating a new vector'''
+        x = self.x
+        y = self.y
+        z = self.z
+        self.x = m.a.x * x + m.a.y * y + m.a.z * z
+        self.y = m.b.x * x + m.b.y * y + m.b.z * z
+        self.z = m.c.x * x + m.c.y * y + m.c.z * z
+
     def rotate_by_id(self, rot_id):
         '''rotate a vector using a rotation enum ID'''
         global rotations
@@ -153,6 +194,8 @@ class Vector3(object):
 
 class Matrix3(object):
     '''a 3x3 matrix, intended as a rotation matrix'''
+    __slots__ = ('a', 'b', 'c')
+
     def __init__(self, a=None, b=None, c=None):
         if a is not None and b is not None and c is not None:
             self.a = a.copy()
@@ -271,9 +314,21 @@ class Matrix3(object):
 
     __radd__ = __add__
 
+    def __iadd__(self, m):
+        self.a += m.a
+        self.b += m.b
+        self.c += m.c
+        return self
+
     def __sub__(self, m):
         return Matrix3(self.a - m.a, self.b - m.b, self.c - m.c)
 
+    def __isub__(self, m):
+        self.a -= m.a
+        self.b -= m.b
+        self.c -= m.c
+        return self
+
     def __rsub__(self, m):
         return Matrix3(m.a - self.a, m.b - self.b, m.c - self.c)
 
@@ -289,6 +344,8 @@ class Matrix3(object):
             return Vector3(self.a.x * v.x + self.a.y * v.y + self.a.z * v.z,
                            self.b.x * v.x + self.b.y * v.y + self.b.z * v.z,
                            self.c.x * v.x + self.c.y * v.y + self.c.z * v.z)
+        elif isinstance(other, (Vector3Array, Matrix3Array)):
+            return Matrix3Array([self]) * other
         elif isinstance(other, Matrix3):
             m = other
             return Matrix3(Vector3(self.a.x * m.a.x + self.a.y * m.b.x + self.a.z * m.c.x,
@@ -303,6 +360,25 @@ class Matrix3(object):
         v = other
         return Matrix3(self.a * v, self.b * v, self.c * v)
 
+    def __imul__(self, other):
+        if isinstance(other, Vector3):
+            return NotImplemented
+        if isinstance(other, Matrix3):
+            # take a copy of other first, as it may be self (m *= m)
+            (ax, ay, az) = (other.a.x, other.a.y, other.a.z)
+            (bx, by, bz) = (other.b.x, other.b.y, other.b.z)
+            (cx, cy, cz) = (other.c.x, other.c.y, other.c.z)
+            for r in (self.a, self.b, self.c):
+                (x, y, z) = (r.x, r.y, r.z)
+                r.x = x * ax + y * bx + z * cx
+                r.y = x * ay + y * by + z * cy
+                r.z = x * az + y * bz + z * cz
+            return self
+        self.a *= other
+        self.b *= other
+        self.c *= other
+        return self
+
     def __div__(self, v):
         return Matrix3(self.a / v, self.b / v, self.c / v)
 
@@ -321,22 +397,11 @@ class Matrix3(object):
         '''rotate the matrix by a given amount on 3 axes,
         where g is a vector of delta angles. Used
         with DCM updates in mavextra.py'''
-        temp_matrix = Matrix3()
-        a = self.a
-        b = self.b
-        c = self.c
-        temp_matrix.a.x = a.y * g.z - a.z * g.y
-        temp_matrix.a.y = a.z * g.x - a.x * g.z
-        temp_matrix.a.z = a.x * g.y - a.y * g.x
-        temp_matrix.b.x = b.y * g.z - b.z * g.y
-        temp_matrix.b.y = b.z * g.x - b.x * g.z
-        temp_matrix.b.z = b.x * g.y - b.y * g.x
-        temp_matrix.c.x = c.y * g.z - c.z * g.y
-        temp_matrix.c.y = c.z * g.x - c.x * g.z
-        temp_matrix.c.z = c.x * g.y - c.y * g.x
-        self.a += temp_matrix.a
-        self.b += temp_matrix.b
-        self.c += temp_matrix.c
+        for r in (self.a, self.b, self.c):
+            (x, y, z) = (r.x, r.y, r.z)
+            r.x = x + y * g.z - z * g.y
+            r.y = y + z * g.x - x * g.z
+            r.z = z + x * g.y - y * g.x
 
     def normalize(self):
         '''re-normalise a rotation matrix'''
@@ -385,6 +450,385 @@ class Matrix3(object):
     def close(self, m, tol=1e-7):
         return self.a.close(m.a, tol) and self.b.close(m.b, tol) and self.c.close(m.c, tol)
 
+def _vector_array(v):
+    '''return a Vector3, Vector3Array or array as a numpy array'''
+    import numpy as np
+    if isinstance(v, Vector3Array):
+        return v.v
+    if isinstance(v, Vector3):
+        return np.array([v.x, v.y, v.z])
+    return np.asarray(v, dtype=float)
+
+def _matrix_array(m):
+    '''return a Matrix3, Matrix3Array or array as a numpy array'''
+    import numpy as np
+    if isinstance(m, Matrix3Array):
+        return m.m
+    if isinstance(m, Matrix3):
+        return np.array([[r.x, r.y, r.z] for r in (m.a, m.b, m.c)])
+    return np.asarray(m, dtype=float)
+
+def _scale_array(v, dims):
+    '''return a scalar or an array with one value per element, shaped
+    to multiply arrays of elements with the given number of dimensions'''
+    import numpy as np
+    v = np.asarray(v)
+    if v.ndim == 1:
+        return v.reshape((-1,) + (1,) * dims)
+    return v
+
+
+class Vector3Array(object):
+    '''an array of vectors, held in an Nx3 numpy array, for applying the
+    Vector3 operations to many vectors at once'''
+    __slots__ = ('v',)
+    # stop numpy treating these as objects to put in arrays of its own
+    __array_ufunc__ = None
+
+    def __init__(self, x=None, y=None, z=None):
+        import numpy as np
+        if x is not None and y is not None and z is not None:
+            (x, y, z) = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                            np.asarray(y, dtype=float),
+                                            np.asarray(z, dtype=float))
+            self.v = np.stack([x, y, z], axis=-1).reshape(-1, 3)
+        elif x is None or len(x) == 0:
+            self.v = np.zeros((0, 3))
+        else:
+            if isinstance(x[0], Vector3):
+                x = [(v.x, v.y, v.z) for v in x]
+            self.v = np.array(x, dtype=float)
+            if self.v.ndim != 2 or self.v.shape[1] != 3:
+                raise ValueError('bad initialiser')
+
+    @staticmethod
+    def _wrap(v):
+        '''make a Vector3Array using an Nx3 array without copying it'''
+        ret = Vector3Array.__new__(Vector3Array)
+        ret.v = v
+        return ret
+
+    @property
+    def x(self):
+        return self.v[:, 0]
+
+    @x.setter
+    def x(self, x):
+        self.v[:, 0] = x
+
+    @property
+    def y(self):
+        return self.v[:, 1]
+
+    @y.setter
+    def y(self, y):
+        self.v[:, 1] = y
+
+    @property
+    def z(self):
+        return self.v[:, 2]
+
+    @z.setter
+    def z(self, z):
+        self.v[:, 2] = z
+
+    def __len__(self):
+        return len(self.v)
+
+    def __getitem__(self, i):
+        v = self.v[i]
+        if v.ndim == 1:
+            return Vector3(v[0], v[1], v[2])
+        return Vector3Array._wrap(v)
+
+    def __iter__(self):
+        for i in range(len(self.v)):
+            yield self[i]
+
+    def __repr__(self):
+        return 'Vector3Array(%u vectors)' % len(self.v)
+
+    def __eq__(self, v):
+        import numpy as np
+        return np.array_equal(self.v, _vector_array(v))
+
+    def __ne__(self, v):
+        return not self == v
+
+    def close(self, v, tol=1e-7):
+        import numpy as np
+        return bool(np.all(np.abs(self.v - _vector_array(v)) < tol))
+
+    def __add__(self, v):
+        return Vector3Array._wrap(self.v + _vector_array(v))
+
+    __radd__ = __add__
+
+    def __iadd__(self, v):
+        self.v += _vector_array(v)
+        return self
+
+    def __sub__(self, v):
+        return Vector3Array._wrap(self.v - _vector_array(v))
+
+    def __rsub__(self, v):
+        return Vector3Array._wrap(_vector_array(v) - self.v)
+
+    def __isub__(self, v):
+        self.v -= _vector_array(v)
+        return self
+
+    def __neg__(self):
+        return Vector3Array._wrap(-self.v)
+
+    def __mul__(self, v):
+        import numpy as np
+        if isinstance(v, (Vector3, Vector3Array)):
+            '''dot products'''
+            return np.einsum('...i,...i->...', self.v, _vector_array(v))
+        return Vector3Array._wrap(self.v * _scale_array(v, 1))
+
+    __rmul__ = __mul__
+
+    def __imul__(self, v):
+        if isinstance(v, (Vector3, Vector3Array)):
+            return NotImplemented
+        self.v *= _scale_array(v, 1)
+        return self
+
+    def __truediv__(self, v):
+        return Vector3Array._wrap(self.v / _scale_array(v, 1))
+
+    __div__ = __truediv__
+
+    def __itruediv__(self, v):
+        self.v /= _scale_array(v, 1)
+        return self
+
+    __idiv__ = __itruediv__
+
+    def __mod__(self, v):
+        '''cross products'''
+        import numpy as np
+        return Vector3Array._wrap(np.cross(self.v, _vector_array(v)))
+
+    def __copy__(self):
+        return Vector3Array._wrap(self.v.copy())
+
+    copy = __copy__
+
+    def length(self):
+        import numpy as np
+        return np.sqrt(np.einsum('...i,...i->...', self.v, self.v))
+
+    def zero(self):
+        self.v[:] = 0
+
+    def angle(self, v):
+        '''return the angles between these vectors and other vectors'''
+        import numpy as np
+        other = v if isinstance(v, (Vector3, Vector3Array)) else Vector3Array(v)
+        return np.arccos((self * other) / (self.length() * other.length()))
+
+    def normalized(self):
+        return self / self.length()
+
+    def normalize(self):
+        self /= self.length()
+
+
+class Matrix3Array(object):
+    '''an array of 3x3 matrices, held in an Nx3x3 numpy array, for
+    applying the Matrix3 operations to many matrices at once. An integer
+    gives that many identity matrices'''
+    __slots__ = ('m',)
+    # stop numpy treating these as objects to put in arrays of its own
+    __array_ufunc__ = None
+
+    def __init__(self, m=None):
+        import numpy as np
+        if m is None:
+            m = 0
+        if isinstance(m, int):
+            self.m = np.tile(np.eye(3), (m, 1, 1))
+            return
+        if len(m) > 0 and isinstance(m[0], Matrix3):
+            m = [_matrix_array(v) for v in m]
+        self.m = np.array(m, dtype=float).reshape(-1, 3, 3)
+
+    @staticmethod
+    def _wrap(m):
+        '''make a Matrix3Array using an Nx3x3 array without copying it'''
+        ret = Matrix3Array.__new__(Matrix3Array)
+        ret.m = m
+        return ret
+
+    @property
+    def a(self):
+        return Vector3Array._wrap(self.m[:, 0, :])
+
+    @property
+    def b(self):
+        return Vector3Array._wrap(self.m[:, 1, :])
+
+    @property
+    def c(self):
+        return Vector3Array._wrap(self.m[:, 2, :])
+
+    def __len__(self):
+        return len(self.m)
+
+    def __getitem__(self, i):
+        m = self.m[i]
+        if m.ndim == 2:
+            return Matrix3(Vector3(m[0]), Vector3(m[1]), Vector3(m[2]))
+        return Matrix3Array._wrap(m)
+
+    def __iter__(self):
+        for i in range(len(self.m)):
+            yield self[i]
+
+    def __repr__(self):
+        return 'Matrix3Array(%u matrices)' % len(self.m)
+
+    def identity(self):
+        import numpy as np
+        self.m[:] = np.eye(3)
+
+    def transposed(self):
+        return Matrix3Array._wrap(self.m.swapaxes(-1, -2).copy())
+
+    def from_euler(self, roll, pitch, yaw):
+        '''fill the matrices from arrays of Euler angles in radians'''
+        import numpy as np
+        (roll, pitch, yaw) = np.broadcast_arrays(np.asarray(roll, dtype=float),
+                                                 np.asarray(pitch, dtype=float),
+                                                 np.asarray(yaw, dtype=float))
+        cp = np.cos(pitch)
+        sp = np.sin(pitch)
+        sr = np.sin(roll)
+        cr = np.cos(roll)
+        sy = np.sin(yaw)
+        cy = np.cos(yaw)
+
+        m = np.empty(roll.shape + (3, 3))
+        m[..., 0, 0] = cp * cy
+        m[..., 0, 1] = (sr * sp * cy) - (cr * sy)
+        m[..., 0, 2] = (cr * sp * cy) + (sr * sy)
+        m[..., 1, 0] = cp * sy
+        m[..., 1, 1] = (sr * sp * sy) + (cr * cy)
+        m[..., 1, 2] = (cr * sp * sy) - (sr * cy)
+        m[..., 2, 0] = -sp
+        m[..., 2, 1] = sr * cp
+        m[..., 2, 2] = cr * cp
+        self.m = m.reshape(-1, 3, 3)
+
+    def to_euler(self):
+        '''find arrays of Euler angles (321 convention) for the matrices'''
+        import numpy as np
+        c_x = self.m[:, 2, 0]
+        pitch = np.where(c_x >= 1.0, pi, np.where(c_x <= -1.0, -pi, -np.arcsin(np.clip(c_x, -1, 1))))
+        roll = np.arctan2(self.m[:, 2, 1], self.m[:, 2, 2])
+        yaw = np.arctan2(self.m[:, 1, 0], self.m[:, 0, 0])
+        return (roll, pitch, yaw)
+
+    def determinant(self):
+        '''return determinants'''
+        import numpy as np
+        return np.linalg.det(self.m)
+
+    def invert(self):
+        '''invert the matrices, returning new matrices'''
+        import numpy as np
+        return Matrix3Array._wrap(np.linalg.inv(self.m))
+
+    def __add__(self, m):
+        return Matrix3Array._wrap(self.m + _matrix_array(m))
+
+    __radd__ = __add__
+
+    def __iadd__(self, m):
+        self.m += _matrix_array(m)
+        return self
+
+    def __sub__(self, m):
+        return Matrix3Array._wrap(self.m - _matrix_array(m))
+
+    def __rsub__(self, m):
+        return Matrix3Array._wrap(_matrix_array(m) - self.m)
+
+    def __isub__(self, m):
+        self.m -= _matrix_array(m)
+        return self
+
+    def __eq__(self, m):
+        import numpy as np
+        return np.array_equal(self.m, _matrix_array(m))
+
+    def __ne__(self, m):
+        return not self == m
+
+    def __mul__(self, other):
+        import numpy as np
+        if isinstance(other, (Vector3, Vector3Array)):
+            return Vector3Array._wrap(np.einsum('...ij,...j->...i', self.m, _vector_array(other)))
+        if isinstance(other, (Matrix3, Matrix3Array)):
+            return Matrix3Array._wrap(np.matmul(self.m, _matrix_array(other)))
+        return Matrix3Array._wrap(self.m * _scale_array(other, 2))
+
+    def __imul__(self, other):
+        import numpy as np
+        if isinstance(other, (Vector3, Vector3Array)):
+            return NotImplemented
+        if isinstance(other, (Matrix3, Matrix3Array)):
+            self.m[:] = np.matmul(self.m, _matrix_array(other))
+        else:
+            self.m *= _scale_array(other, 2)
+        return self
+
+    def __truediv__(self, v):
+        return Matrix3Array._wrap(self.m / _scale_array(v, 2))
+
+    __div__ = __truediv__
+
+    def __neg__(self):
+        return Matrix3Array._wrap(-self.m)
+
+    def __copy__(self):
+        return Matrix3Array._wrap(self.m.copy())
+
+    copy = __copy__
+
+    def rotate(self, g):
+        '''rotate the matrices by given amounts on 3 axes, where g is a
+        vector or an array of vectors of delta angles'''
+        import numpy as np
+        g = _vector_array(g)
+        if g.ndim == 2:
+            g = g[:, np.newaxis, :]
+        self.m += np.cross(self.m, g)
+
+    def normalize(self):
+        '''re-normalise rotation matrices'''
+        import numpy as np
+        a = self.m[:, 0, :]
+        b = self.m[:, 1, :]
+        error = np.einsum('...i,...i->...', a, b)[:, np.newaxis]
+        t0 = a - (b * (0.5 * error))
+        t1 = b - (a * (0.5 * error))
+        t2 = np.cross(t0, t1)
+        for (i, t) in enumerate((t0, t1, t2)):
+            self.m[:, i, :] = t / np.sqrt(np.einsum('...i,...i->...', t, t))[:, np.newaxis]
+
+    def trace(self):
+        '''the traces of the matrices'''
+        import numpy as np
+        return np.trace(self.m, axis1=1, axis2=2)
+
+    def close(self, m, tol=1e-7):
+        import numpy as np
+        return bool(np.all(np.abs(self.m - _matrix_array(m)) < tol))
+
 class Plane(object):
     '''a plane in 3 space, defined by a point and a vector normal'''
     def __init__(self, point=None, normal=None):
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for DFReader
+"""
+
+from __future__ import absolute_import, print_function
+import io
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+import pkg_resources
+
+from pymavlink import DFReader, mavutil
+
+
+class DFReaderTest(unittest.TestCase):
+
+    """
+    Class to test DFReader_binary
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Constructor, set up some data that is reused in many tests"""
+        super(DFReaderTest, self).__init__(*args, **kwargs)
+        self.filename = pkg_resources.resource_filename(__name__, "test.BIN")
+
+    def read_messages(self, log, mtype):
+        '''read all messages of one type the slow way'''
+        log.rewind()
+        ret = []
+        while True:
+            m = log.recv_match(type=mtype)
+            if m is None:
+                break
+            ret.append(m)
+        return ret
+
+    def test_message_fields(self):
+        """Test decoded field values are cached and updated on assignment"""
+        log = DFReader.DFReader_binary(self.filename)
+        m = log.recv_match(type='ATT')
+        self.assertEqual(m.Roll, m._elements[m.fmt.colhash['Roll']] * 0.01)
+        self.assertIs(m.Roll, m.Roll)
+        m.Roll = 12.5
+        self.assertAlmostEqual(m.Roll, 12.5)
+        self.assertAlmostEqual(m.to_dict()['Roll'], 12.5)
+        with self.assertRaises(AttributeError):
+            m.NotAField
+        m = log.recv_match(type='MSG')
+        # unicode on python2, as before fields were decoded lazily
+        self.assertTrue(isinstance(m.Message, type(u'')))
+        self.assertFalse('\0' in m.Message)
+        self.assertFalse(hasattr(m, '__dict__') and len(m.__dict__) > 0)
+
+    def test_extract_columns(self):
+        """Test columnar extraction matches message by message decoding"""
+        log = DFReader.DFReader_binary(self.filename)
+        for mtype in ['ATT', 'GPS', 'PARM', 'MODE']:
+            cols = log.extract_columns(mtype)
+            msgs = self.read_messages(log, mtype)
+            self.assertEqual(len(cols), len(msgs))
+            for (m, row) in zip(msgs, cols):
+                self.assertAlmostEqual(m._timestamp, row['_timestamp'], places=5)
+                for f in m.get_fieldnames():
+                    v = getattr(m, f)
+                    if isinstance(v, str):
+                        self.assertEqual(v, DFReader.null_term(row[f]))
+                    else:
+                        self.assertAlmostEqual(v, row[f], places=5)
+
+        cols = log.extract_columns('ATT', ['Roll', 'Pitch'])
+        self.assertEqual(cols.dtype.names, ('Roll', 'Pitch', '_timestamp'))
+        # the FMT message has no time field so needs a full read for timestamps
+        self.assertEqual(len(log.extract_columns('FMT')), log.counts[0x80])
+        with self.assertRaises(KeyError):
+            log.extract_columns('NOTATYPE')
+        with self.assertRaises(KeyError):
+            log.extract_columns('ATT', ['NotAField'])
+        with self.assertRaises(ValueError):
+            log.extract_columns('ATT', instance=0)
+
+    def test_extract_columns_fallback(self):
+        """Test timestamps read message by message match a sequential read"""
+        types = ['ATT', 'FMT', 'PARM']
+        log = DFReader.DFReader_binary(self.filename)
+        log.rewind()
+        expected = dict((t, []) for t in types)
+        while True:
+            m = log.recv_msg()
+            if m is None:
+                break
+            if m.get_type() in expected:
+                expected[m.get_type()].append(m._timestamp)
+
+        log = DFReader.DFReader_binary(self.filename)
+        log.rewind()
+        for i in range(1000):
+            log.recv_msg()
+        m = log.recv_match(type='ATT')
+        # as for a clock that can't be vectorised
+        log.clock.timestamps_numpy = lambda fmt, column: None
+        for t in types:
+            self.assertEqual(list(log.extract_columns(t)['_timestamp']), expected[t])
+        # the reader carries on where it was
+        self.assertEqual(str(log.messages['ATT']), str(m))
+        self.assertEqual(log.recv_match(type='ATT')._timestamp, expected['ATT'][expected['ATT'].index(m._timestamp) + 1])
+
+    def test_recv_match_types(self):
+        """Test reading several types through the index keeps log order"""
+        log = DFReader.DFReader_binary(self.filename)
+        expected = self.dump(log)
+        for types in [['ATT', 'GPS', 'IMU'], ['NKQ2', 'NOTATYPE'], list(log.name_to_id.keys())]:
+            log.rewind()
+            msgs = []
+            while True:
+                m = log.recv_match(type=types)
+                if m is None:
+                    break
+                msgs.append(str(m))
+            self.assertEqual(msgs, [m for (m, t) in expected if m.split()[0] in types])
+
+    def test_recv_match_condition(self):
+        """Test cached condition results match evaluating every message"""
+        for condition in ['ATT.Roll<-7.3', 'ATT.Roll<-7.3 and abs(GPS.Spd)<0.15', 'MAV.flightmode!="UNKNOWN"',
+                          'ATT.Roll<-7.3{GPS.Status>=3}']:
+            log = DFReader.DFReader_binary(self.filename)
+            log.rewind()
+            expected = []
+            while True:
+                m = log.recv_msg()
+                if m is None:
+                    break
+                if mavutil.evaluate_condition(condition, log.messages):
+                    expected.append(str(m))
+            log.rewind()
+            msgs = []
+            while True:
+                m = log.recv_match(condition=condition)
+                if m is None:
+                    break
+                msgs.append(str(m))
+            self.assertEqual(msgs, expected)
+            self.assertTrue(len(msgs) > 0)
+        self.assertEqual(log.condition_cache.depends, ['ATT', 'GPS'])
+
+        # functions keeping state must be called for every message
+        total = len(self.dump(log))
+        log.rewind()
+        n = 0
+        while log.recv_match(condition='downsample(7)') is not None:
+            n += 1
+        self.assertEqual(log.condition_cache.depends, None)
+        self.assertTrue(abs(n - total / 7.0) < 1)
+
+    def dump(self, log):
+        '''return every message in the log as text with its timestamp'''
+        log.rewind()
+        ret = []
+        while True:
+            m = log.recv_msg()
+            if m is None:
+                break
+            ret.append((str(m), m._timestamp))
+        return ret
+
+    def test_index_cache(self):
+        """Test logs opened from an index file match a full scan"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "test.BIN")
+            shutil.copy(self.filename, filename)
+            log = DFReader.DFReader_binary(filename, index_cache=True)
+            self.assertTrue(os.path.exists(filename + ".idx"))
+            expected = self.dump(log)
+
+            log = DFReader.DFReader_binary(filename)
+            self.assertTrue(log.load_index(filename + ".idx"))
+            log = DFReader.DFReader_binary(filename, index_cache=True)
+            self.assertEqual(self.dump(log), expected)
+            self.assertEqual(log.offsets, DFReader.DFReader_binary(filename).offsets)
+            self.assertEqual(type(log.offsets[0x80]), type(mavutil.offset_array()))
+            self.assertEqual(log.flightmode_list(), DFReader.DFReader_binary(filename).flightmode_list())
+            self.assertEqual(len(log.extract_columns('ATT')), 24)
+
+            # a modified log must not use the old index, which is replaced
+            with open(filename, 'ab') as f:
+                f.write(b'\0' * 16)
+            log = DFReader.DFReader_binary(filename)
+            self.assertFalse(log.load_index(filename + ".idx"))
+            log = DFReader.DFReader_binary(filename, index_cache=True)
+            self.assertTrue(DFReader.DFReader_binary(filename).load_index(filename + ".idx"))
+
+            # a failed save leaves no temporary file behind
+            os.mkdir(os.path.join(tmpdir, "dir.idx"))
+            self.assertFalse(log.save_index(os.path.join(tmpdir, "dir.idx")))
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, "dir.idx.tmp")))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_init_arrays_parallel(self):
+        """Test parallel indexing finds the same messages as a sequential scan"""
+        expected = DFReader.DFReader_binary(self.filename)
+        for chunk_size in [300, 4096, None]:
+            log = DFReader.DFReader_binary(self.filename)
+            log.init_arrays_parallel(processes=2, chunk_size=chunk_size)
+            self.assertEqual(log.offsets, expected.offsets)
+            self.assertEqual(log.counts, expected.counts)
+            self.assertEqual(log.name_to_id, expected.name_to_id)
+            self.assertEqual(sorted(log.messages.keys()), sorted(expected.messages.keys()))
+        log = DFReader.DFReader_binary(self.filename, index_processes=2)
+        self.assertEqual(self.dump(log), self.dump(expected))
+
+    def test_resync(self):
+        """Test reading resynchronises after a block of corruption"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "zeros.BIN")
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+            expected = DFReader.DFReader_binary(self.filename)
+            # corrupt the log between two messages
+            ofs = min(o for a in expected.offsets for o in a if o >= 40000)
+            with open(filename, 'wb') as f:
+                f.write(data[:ofs] + b'\0' * 100000 + b'\xa3\x95\xff' + data[ofs:])
+            log = DFReader.DFReader_binary(filename)
+            self.assertEqual(log.counts, expected.counts)
+            self.assertEqual([str(m) for (m, t) in self.dump(log)],
+                             [str(m) for (m, t) in self.dump(expected)])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_seek_time(self):
+        """Test seeking by time matches a fresh sequential read"""
+        expected = self.dump(DFReader.DFReader_binary(self.filename))
+        times = [t for (m, t) in expected]
+        log = DFReader.DFReader_binary(self.filename)
+        # a previous pass must not affect the index
+        self.dump(log)
+        log.build_time_index(interval=100)
+        (keys, checkpoints) = log._time_index
+        self.assertEqual(keys, sorted(keys))
+        # params are shared between checkpoints until they change
+        self.assertTrue(len(set(id(c['params']) for c in checkpoints)) < len(checkpoints))
+        # messages are held as log offsets and decoded again on restore
+        for c in checkpoints:
+            (mkeys, positions, timestamps, others) = c['messages']
+            self.assertEqual(len(mkeys), len(positions))
+            self.assertFalse(any(isinstance(m, DFReader.DFMessage) for m in others.values()))
+        m = log.seek_time(times[1000] + 0.001)
+        seq = DFReader.DFReader_binary(self.filename)
+        # forget the messages read while finding the clock
+        seq.rewind()
+        while seq.offset < log.offset:
+            seq.recv_msg()
+        self.assertEqual(self.message_dict(log), self.message_dict(seq))
+        for t in [times[0], times[500], times[1000] + 0.001, 1509241630.0, times[-1]]:
+            m = log.seek_time(t)
+            i = min(i for i in range(len(times)) if times[i] >= t)
+            self.assertEqual((str(m), m._timestamp), expected[i])
+            for j in range(i+1, min(i+20, len(expected))):
+                m = log.recv_msg()
+                self.assertEqual((str(m), m._timestamp), expected[j])
+        self.assertEqual(log.seek_time(times[-1] + 1000), None)
+
+        for (t0, t1) in [(times[300], times[1200]), (1509241630.0, 1509241630.2)]:
+            msgs = [(str(m), m._timestamp) for m in log.iter_range(t0, t1, types=['ATT'])]
+            self.assertEqual(msgs, [(m, t) for (m, t) in expected
+                                    if m.startswith('ATT ') and t0 <= t <= t1])
+            self.assertTrue(len(msgs) > 0)
+
+        stream = DFReader.DFReader_stream(self.filename)
+        self.assertRaises(io.UnsupportedOperation, stream.seek_time, times[500])
+        self.assertRaises(io.UnsupportedOperation, stream.iter_range, times[0], times[500])
+
+    def message_dict(self, log):
+        '''return the latest message of each type as strings'''
+        return dict((k, (str(m), m._timestamp)) for (k, m) in log.messages.items()
+                    if isinstance(m, DFReader.DFMessage))
+
+    def stream_dump(self, log, count=None):
+        '''return messages read from a stream, with timestamps for messages with TimeUS'''
+        ret = []
+        while count is None or len(ret) < count:
+            m = log.recv_msg()
+            if m is None:
+                break
+            ret.append((str(m), m._timestamp if 'TimeUS' in m.get_fieldnames() else None))
+        return ret
+
+    def test_stream(self):
+        """Test reading a log incrementally matches the indexed reader"""
+        log = DFReader.DFReader_binary(self.filename)
+        log.rewind()
+        expected = self.stream_dump(log)
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        log = DFReader.DFReader_stream(self.filename, chunk_size=100)
+        self.assertEqual(type(log.clock), DFReader.DFReaderClock_usec)
+        self.assertEqual(self.stream_dump(log), expected)
+        log = DFReader.DFReader_stream(iter([data[i:i+333] for i in range(0, len(data), 333)]),
+                                       chunk_size=1000)
+        self.assertEqual(self.stream_dump(log), expected)
+        # parsed data is discarded
+        self.assertTrue(len(log.buf) < 2000)
+
+    def test_stream_follow(self):
+        """Test following a log which is still being written"""
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "growing.BIN")
+            with open(filename, 'wb') as f:
+                f.write(data[:20000])
+
+            def writer():
+                with open(filename, 'ab') as f:
+                    for i in range(20000, len(data), 5000):
+                        time.sleep(0.02)
+                        f.write(data[i:i+5000])
+                        f.flush()
+            t = threading.Thread(target=writer)
+            t.start()
+            log = DFReader.DFReader_stream(filename, follow=True, poll_interval=0.01)
+            msgs = self.stream_dump(log, count=1731)
+            t.join()
+            self.assertEqual(len(msgs), 1731)
+            self.assertEqual(msgs[-1][0].split()[0], 'NKQ2')
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
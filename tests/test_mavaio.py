@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the asyncio mavlink connections
+"""
+
+from __future__ import absolute_import, print_function
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+import pkg_resources
+
+from pymavlink import mavaio, mavutil, DFReader
+from test_mavmmaplog import make_tlog
+
+
+def free_port(type=socket.SOCK_DGRAM):
+    '''return a free local port number'''
+    s = socket.socket(socket.AF_INET, type)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def run(coro):
+    '''run a coroutine in a new event loop'''
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(asyncio.wait_for(coro, 20))
+    finally:
+        loop.close()
+
+
+def send_heartbeats(link, count=1):
+    for i in range(count):
+        link.mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_QUADROTOR,
+                                mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA, 0, 0, i)
+
+
+class MAVAIOTest(unittest.TestCase):
+
+    """
+    Class to test mavaio
+    """
+
+    def test_udp(self):
+        """Test receiving, matching and subscribing on a UDP link"""
+        async def test():
+            port = free_port()
+            conn = await mavaio.aio_mavlink_connection('udpin:127.0.0.1:%u' % port)
+            out = mavutil.mavlink_connection('udpout:127.0.0.1:%u' % port, source_system=7)
+            heartbeats = conn.subscribe('HEARTBEAT')
+            both = conn.subscribe(['HEARTBEAT', 'SYSTEM_TIME'])
+
+            self.assertIsNone(await conn.recv_match(type='HEARTBEAT', timeout=0.05))
+            send_heartbeats(out, 3)
+            out.mav.system_time_send(1000, 20)
+            m = await conn.recv_match(type='SYSTEM_TIME', timeout=5)
+            self.assertEqual(m.time_boot_ms, 20)
+            # the heartbeats before it were consumed by recv_match
+            self.assertEqual(len(conn.queue), 0)
+            self.assertEqual(conn.target_system, 7)
+            self.assertEqual(conn.messages['HEARTBEAT'].system_status, 2)
+            self.assertEqual([(await heartbeats.get()).system_status for i in range(3)], [0, 1, 2])
+            self.assertEqual(both.qsize(), 4)
+
+            send_heartbeats(out, 5)
+            m = await conn.recv_match(condition='HEARTBEAT.system_status>=3', timeout=5)
+            self.assertEqual(m.system_status, 3)
+            self.assertEqual((await conn.recv_msg()).system_status, 4)
+            self.assertIsNone(await conn.recv_match(blocking=False))
+
+            conn.unsubscribe(heartbeats)
+            self.assertEqual(list(conn.subscriptions.keys()), ['HEARTBEAT', 'SYSTEM_TIME'])
+            conn.close()
+            out.close()
+            self.assertIsNone(await conn.recv_msg())
+            self.assertEqual(both.qsize(), 10)
+        run(test())
+
+    def test_thread_reader(self):
+        """Test receiving in a worker thread"""
+        async def test():
+            port = free_port()
+            conn = await mavaio.aio_mavlink_connection('udpin:127.0.0.1:%u' % port,
+                                                       reader=mavaio.thread_reader(timeout=0.01))
+            out = mavutil.mavlink_connection('udpout:127.0.0.1:%u' % port, source_system=7)
+            send_heartbeats(out, 3)
+            m = await conn.recv_match(condition='HEARTBEAT.system_status==2', timeout=5)
+            self.assertEqual(m.get_srcSystem(), 7)
+            conn.close()
+            out.close()
+        run(test())
+
+    def test_tcp(self):
+        """Test TCP server and client links"""
+        async def test():
+            port = free_port(socket.SOCK_STREAM)
+            server = await mavaio.aio_mavlink_connection('tcpin:127.0.0.1:%u' % port)
+            client = await mavaio.aio_mavlink_connection('tcp:127.0.0.1:%u' % port, source_system=3)
+            send_heartbeats(client, 2)
+            m = await server.recv_match(type='HEARTBEAT', condition='HEARTBEAT.system_status==1', timeout=5)
+            self.assertEqual(m.get_srcSystem(), 3)
+            send_heartbeats(server)
+            self.assertEqual((await client.wait_heartbeat(timeout=5)).get_srcSystem(), 255)
+
+            # the server goes back to listening when the client goes away
+            client.close()
+            client2 = await mavaio.aio_mavlink_connection('tcp:127.0.0.1:%u' % port, source_system=4)
+            send_heartbeats(client2)
+            m = await server.wait_heartbeat(timeout=5)
+            self.assertEqual(m.get_srcSystem(), 4)
+
+            # and the client sees EOF when the server goes away
+            server.close()
+            self.assertEqual([m async for m in client2], [])
+            self.assertTrue(client2.eof)
+            client2.close()
+        run(test())
+
+    def test_tlog_replay(self):
+        """Test replaying a tlog"""
+        fd, filename = tempfile.mkstemp(suffix='.tlog')
+        os.close(fd)
+        try:
+            make_tlog(filename)
+            async def test():
+                conn = await mavaio.aio_mavlink_connection(filename)
+                attitude = conn.subscribe('ATTITUDE')
+                types = [m.get_type() async for m in conn]
+                self.assertEqual(types.count('ATTITUDE'), 200)
+                self.assertEqual(types.count('HEARTBEAT'), 20)
+                self.assertEqual(attitude.qsize(), 201)
+                self.assertIsNone(await conn.recv_match(type='ATTITUDE'))
+                conn.close()
+
+                # replay at 5 times the recorded speed
+                conn = mavaio.aio_mavfile(mavutil.mavlink_connection(filename),
+                                          reader=mavaio.log_reader(speed=5))
+                conn.start()
+                start = conn.loop.time()
+                m = await conn.recv_match(type='ATTITUDE', condition='ATTITUDE.time_boot_ms==500')
+                self.assertGreater(conn.loop.time() - start, 0.15)
+                self.assertEqual(m.roll, conn.messages['ATTITUDE'].roll)
+                conn.close()
+            run(test())
+        finally:
+            os.unlink(filename)
+
+    def test_dataflash_replay(self):
+        """Test replaying a DataFlash log"""
+        filename = pkg_resources.resource_filename(__name__, "test.BIN")
+        expected = []
+        log = DFReader.DFReader_binary(filename)
+        while True:
+            m = log.recv_match(type='ATT')
+            if m is None:
+                break
+            expected.append(m.Roll)
+        log.rewind()
+        total = 0
+        while log.recv_msg() is not None:
+            total += 1
+
+        async def test():
+            conn = await mavaio.aio_mavlink_connection(filename, max_queue=None)
+            ret = []
+            while True:
+                m = await conn.recv_match(type='ATT')
+                if m is None:
+                    break
+                ret.append(m.Roll)
+            self.assertEqual(ret, expected)
+
+            # a slow consumer of a small queue and subscription misses nothing
+            conn = await mavaio.aio_mavlink_connection(filename, max_queue=10)
+            att = conn.subscribe('ATT', maxsize=10)
+            ret = []
+            count = 0
+            async for m in conn:
+                count += 1
+                while not att.empty():
+                    ret.append(att.get_nowait())
+                await asyncio.sleep(0)
+            while len(ret) == 0 or ret[-1] is not None:
+                ret.append(await att.get())
+            self.assertEqual([m.Roll for m in ret[:-1]], expected)
+            self.assertEqual(count, total)
+        run(test())
+
+
+if __name__ == '__main__':
+    unittest.main()
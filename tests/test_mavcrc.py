@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the mavcrc library
+"""
+
+from __future__ import absolute_import, print_function
+import unittest
+import random
+
+from pymavlink.generator import mavcrc
+
+
+def reference_crc(buf):
+    '''the original byte-at-a-time implementation'''
+    accum = 0xffff
+    for b in buf:
+        tmp = b ^ (accum & 0xff)
+        tmp = (tmp ^ (tmp<<4)) & 0xFF
+        accum = (accum>>8) ^ (tmp<<8) ^ (tmp<<3) ^ (tmp>>4)
+    return accum
+
+
+class CRCTest(unittest.TestCase):
+
+    """
+    Class to test x25crc and its backends
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Constructor, set up some data that is reused in many tests"""
+        super(CRCTest, self).__init__(*args, **kwargs)
+        rng = random.Random(42)
+        self.buffers = [bytearray(rng.randint(0, 255) for i in range(rng.randint(0, 300)))
+                        for j in range(50)]
+
+    def setUp(self):
+        self.saved_backend = mavcrc.backend
+
+    def tearDown(self):
+        mavcrc.set_backend(self.saved_backend)
+
+    def test_check_value(self):
+        """Test the CRC-16/MCRF4XX check value"""
+        for name in mavcrc.backends:
+            mavcrc.set_backend(name)
+            assert mavcrc.x25crc(b'123456789').crc == 0x6F91
+            assert mavcrc.x25crc('123456789').crc == 0x6F91
+
+    def test_backends(self):
+        """Test all backends match the reference implementation"""
+        for name in mavcrc.backends:
+            mavcrc.set_backend(name)
+            for buf in self.buffers:
+                assert mavcrc.x25crc(buf).crc == reference_crc(buf)
+                crc = mavcrc.x25crc()
+                crc.accumulate(buf[:10])
+                crc.accumulate(list(buf[10:]))
+                assert crc.crc == reference_crc(buf)
+                assert mavcrc.x25crc(memoryview(buf)[1:]).crc == reference_crc(buf[1:])
+        with self.assertRaises(ValueError):
+            mavcrc.set_backend('nonexistent')
+
+    def test_crc_many(self):
+        """Test bulk CRC calculation"""
+        assert mavcrc.crc_many(self.buffers) == [reference_crc(b) for b in self.buffers]
+        assert mavcrc.crc_many(self.buffers, crc_extra=50) == [reference_crc(b + bytearray([50]))
+                                                                for b in self.buffers]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,8 +8,9 @@ Unit tests for the mavexpression library
 from __future__ import print_function
 import unittest
 import random
+import pkg_resources
 
-from pymavlink import mavexpression
+from pymavlink import mavexpression, DFReader
 
 class ExpressionTest(unittest.TestCase):
 
@@ -41,6 +42,69 @@ class ExpressionTest(unittest.TestCase):
         """Test evaluate_expression using the functions in mavextra.py"""
         assert mavexpression.evaluate_expression('kmh(10)', {}) == 36
         assert mavexpression.evaluate_expression('angle_diff(170, -90)', {}) == -100
-        
+
+    def test_conditions(self):
+        """Test expressions with a {condition} suffix"""
+        assert mavexpression.evaluate_expression('lat*2{speed>5}', self.varsDict) == 11.34
+        assert mavexpression.evaluate_expression('lat*2{speed>10}', self.varsDict) is None
+        assert mavexpression.evaluate_expression('lat*2{speed>10}', self.varsDict, nocondition=True) == 11.34
+        assert mavexpression.evaluate_expression('lat*2{wrong>1}', self.varsDict) is None
+        assert mavexpression.evaluate_expression('lat*2{speed>}', self.varsDict) is None
+        assert mavexpression.evaluate_expression('lat*2}', self.varsDict) is None
+        assert mavexpression.evaluate_expression(' speed+1', self.varsDict) == 9
+
+    def test_compile_expression(self):
+        """Test compiled expressions are cached and report the names they use"""
+        expr = mavexpression.compile_expression('degrees(ATT.Roll)+pi{GPS.Status>=3}')
+        assert mavexpression.compile_expression('degrees(ATT.Roll)+pi{GPS.Status>=3}') is expr
+        assert expr.expression == 'degrees(ATT.Roll)+pi'
+        assert expr.condition == 'GPS.Status>=3'
+        assert expr.names == set(['ATT', 'GPS', 'pi'])
+        expr = mavexpression.compile_expression('speed+')
+        self.assertRaises(SyntaxError, expr.evaluate, self.varsDict)
+        for i in range(mavexpression.EXPRESSION_CACHE_SIZE + 10):
+            mavexpression.evaluate_expression('speed+%u' % i, self.varsDict)
+        assert len(mavexpression._expression_cache) == mavexpression.EXPRESSION_CACHE_SIZE
+
+    def evaluate_messages(self, log, expression, triggers):
+        '''evaluate an expression for each message of the trigger types the slow way'''
+        log.rewind()
+        messages = {}
+        ret = ([], [])
+        while True:
+            m = log.recv_msg()
+            if m is None:
+                break
+            messages[m.get_type()] = m
+            if m.get_type() in triggers:
+                v = mavexpression.evaluate_expression(expression, messages)
+                if v is not None:
+                    ret[0].append(m._timestamp)
+                    ret[1].append(v)
+        return ret
+
+    def test_evaluate_columns(self):
+        """Test vectorised evaluation matches evaluating message by message"""
+        log = DFReader.DFReader_binary(pkg_resources.resource_filename(__name__, "test.BIN"))
+        columns = mavexpression.log_columns(log)
+        for (expression, triggers) in [('ATT.Roll', ['ATT']),
+                                       ('ATT.Roll*2+GPS.Spd', ['ATT', 'GPS']),
+                                       ('degrees(atan2(ATT.Pitch, ATT.Roll))', ['ATT']),
+                                       ('GPS.Spd/GPS.VZ', ['GPS']),
+                                       ('ATT.Roll if GPS.Status>=3 else -1', ['ATT', 'GPS']),
+                                       ('GPS.Status>=3 and ATT.Roll or 5', ['ATT', 'GPS']),
+                                       ('IMU.AccX**2+IMU.AccY**2{1<GPS.NSats<12}', ['IMU', 'GPS']),
+                                       ('-ATT.Yaw % 7 + GPS.NSats//3', ['ATT']),
+                                       ('NOTATYPE.x+1', ['ATT'])]:
+            (t, v) = mavexpression.evaluate_columns(expression, triggers, columns)
+            (t2, v2) = self.evaluate_messages(log, expression, triggers)
+            self.assertEqual(len(t), len(t2))
+            for i in range(len(t)):
+                self.assertAlmostEqual(t[i], t2[i], places=5)
+                self.assertAlmostEqual(v[i], v2[i], places=4)
+        # mavextra functions and text are evaluated message by message
+        self.assertEqual(mavexpression.evaluate_columns('kmh(GPS.Spd)', ['GPS'], columns), None)
+        self.assertEqual(mavexpression.evaluate_columns('MSG.Message', ['MSG'], columns), None)
+
 if __name__ == '__main__':
     unittest.main()
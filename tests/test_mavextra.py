@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the mavextra library
+"""
+
+from __future__ import absolute_import, print_function
+import unittest
+import numpy
+import pkg_resources
+
+from pymavlink import mavextra, mavexpression, mavutil, DFReader
+
+
+class Row(object):
+    '''a message made from one row of a structured array'''
+    def __init__(self, row):
+        for name in row.dtype.names:
+            setattr(self, name, row[name].item())
+
+
+class MAVExtraTest(unittest.TestCase):
+
+    """
+    Class to test the array versions of mavextra functions
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Constructor, set up some data that is reused in many tests"""
+        super(MAVExtraTest, self).__init__(*args, **kwargs)
+        self.filename = pkg_resources.resource_filename(__name__, "test.BIN")
+        self.log = DFReader.DFReader_binary(self.filename)
+
+    def check_rows(self, values, expected, places=6):
+        '''check array results against results from each row'''
+        self.assertEqual(len(values), len(expected))
+        for (v, e) in zip(values, expected):
+            if hasattr(v, 'x'):
+                v = (v.x, v.y, v.z)
+            if hasattr(e, 'x'):
+                e = (e.x, e.y, e.z)
+            numpy.testing.assert_almost_equal(v, e, decimal=places)
+
+    def test_columns(self):
+        """Test functions of message columns match the per-message results"""
+        imu = self.log.extract_columns('IMU')
+        att = mavextra.columns_at(self.log.extract_columns('ATT'), imu['_timestamp'])
+        self.assertEqual(len(att), len(imu))
+        self.check_rows(mavextra.earth_accel_df(imu, att),
+                        [mavextra.earth_accel_df(Row(i), Row(a)) for (i, a) in zip(imu, att)])
+
+        gps = self.log.extract_columns('GPS')
+        self.check_rows(mavextra.gps_velocity_df(gps), [mavextra.gps_velocity_df(Row(g)) for g in gps])
+        gps2 = gps[::-1]
+        self.check_rows(mavextra.distance_two(gps, gps2),
+                        [mavextra.distance_two(Row(g), Row(g2)) for (g, g2) in zip(gps, gps2)], places=3)
+
+        q = self.log.extract_columns('NKQ1')
+        quats = numpy.stack([q['Q1'], q['Q2'], q['Q3'], q['Q4']], axis=-1)
+        expected = [mavextra.quat_to_euler(v) for v in quats]
+        self.check_rows(mavextra.quat_to_euler(quats), expected)
+        self.check_rows(mavextra.quat_to_euler(numpy.column_stack([q['Q1'], q['Q2'], q['Q3'], q['Q4']])),
+                        expected)
+        # a list of quaternions is read as rows, as an array is
+        quat_list = [[1, 0, 0, 0], [0.7071, 0.7071, 0, 0], [1, 0, 0, 0]]
+        self.check_rows(mavextra.quat_to_euler(quat_list), [mavextra.quat_to_euler(v) for v in quat_list])
+        self.assertEqual(mavextra.quat_to_euler(quat_list).shape, (3, 3))
+        for (name, i) in [('qroll', 0), ('qpitch', 1), ('qyaw', 2)]:
+            f = getattr(mavextra, name)
+            self.check_rows(f(q), [f(Row(row)) for row in q])
+        self.check_rows(mavextra.rotate_quat(quats, q['Q2'], 0.1, -0.2),
+                        [mavextra.rotate_quat(v, row['Q2'], 0.1, -0.2) for (v, row) in zip(quats, q)])
+
+        # messages can also be given as a dict of columns
+        raw_imu = {'xmag': numpy.array([100, -200, 30]), 'ymag': numpy.array([50, 10, -300]),
+                   'zmag': numpy.array([-400, 20, 10])}
+        attitude = {'roll': numpy.array([0.1, -0.5, 0.0]), 'pitch': numpy.array([0.0, 0.2, -1.0]),
+                    'yaw': numpy.zeros(3)}
+        rows = [Row(numpy.array((raw_imu['xmag'][i], raw_imu['ymag'][i], raw_imu['zmag'][i]),
+                                dtype=[('xmag', 'i2'), ('ymag', 'i2'), ('zmag', 'i2')])) for i in range(3)]
+        atts = [Row(numpy.array((attitude['roll'][i], attitude['pitch'][i], 0.0),
+                                dtype=[('roll', 'f8'), ('pitch', 'f8'), ('yaw', 'f8')])) for i in range(3)]
+        self.check_rows(mavextra.mag_heading(raw_imu, attitude, declination=5),
+                        [mavextra.mag_heading(r, a, declination=5) for (r, a) in zip(rows, atts)])
+
+        airspeed = {'airspeed': numpy.array([0.0, 10.0, 25.5])}
+        self.check_rows(mavextra.airspeed(airspeed, ratio=2.0, used_ratio=1.5, offset=-20),
+                        [mavextra.airspeed(Row(numpy.array((v,), dtype=[('airspeed', 'f8')])),
+                                           ratio=2.0, used_ratio=1.5, offset=-20)
+                         for v in airspeed['airspeed']])
+        pressure = {'press_abs': numpy.array([1013.25, 1000.0, 950.5])}
+        self.check_rows(mavextra.altitude(pressure, ground_pressure=101325, ground_temp=20),
+                        [mavextra.altitude(Row(numpy.array((p,), dtype=[('press_abs', 'f8')])),
+                                           ground_pressure=101325, ground_temp=20)
+                         for p in pressure['press_abs']])
+
+        angles = numpy.array([-350.0, -180.0, -90.5, 0.0, 179.0, 181.0, 359.0])
+        self.check_rows(mavextra.wrap_180(angles), [mavextra.wrap_180(a) for a in angles])
+
+    def filter_values(self, state=None):
+        '''return filtered ATT.Roll values for the log'''
+        self.log.rewind()
+        ret = []
+        while True:
+            m = self.log.recv_match(type='ATT')
+            if m is None:
+                break
+            ret.append([mavexpression.evaluate_expression(e, self.log.messages, state=state)
+                        for e in ['average(ATT.Roll,"r",4)', 'lowpass(ATT.Roll,"r",0.9)',
+                                  'diff(ATT.Roll,"r")', 'delta(ATT.Roll,"r")', 'sum(ATT.Roll,"r")',
+                                  'second_derivative_5(ATT.Roll,"r")', 'integral(ATT.Roll,"r",ATT.TimeUS)']])
+        return ret
+
+    def test_filter_state(self):
+        """Test filters keep separate state for each FilterState"""
+        # the default state takes timestamps from the last log opened
+        self.log = mavutil.mavlink_connection(self.filename)
+        mavextra.reset_state_data()
+        expected = self.filter_values()
+        self.assertAlmostEqual(expected[10][0], numpy.mean([m.Roll for m in self.read_att()][7:11]))
+
+        # the default state carries on from the first pass
+        self.assertNotEqual(self.filter_values(), expected)
+        mavextra.reset_state_data()
+        self.assertEqual(self.filter_values(), expected)
+
+        log = self.log
+        self.log = DFReader.DFReader_binary(self.filename)
+        self.assertTrue(mavutil.mavfile_global is log)
+        state1 = mavextra.FilterState(self.log)
+        state2 = mavextra.FilterState(self.log)
+        self.assertEqual(self.filter_values(state1), expected)
+        state2.lowpass['r'] = 1000
+        state1.reset('r')
+        self.assertEqual(self.filter_values(state1), expected)
+        self.assertNotEqual(self.filter_values(state2), expected)
+        self.assertEqual(mavextra.get_state(), mavextra._default_state)
+
+    def read_att(self):
+        '''return the ATT messages in the log'''
+        self.log.rewind()
+        ret = []
+        while True:
+            m = self.log.recv_match(type='ATT')
+            if m is None:
+                return ret
+            ret.append(m)
+
+
+if __name__ == '__main__':
+    unittest.main()
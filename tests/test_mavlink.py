@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the generated MAVLink python module
+"""
+
+from __future__ import absolute_import, print_function
+import unittest
+import array
+import copy
+import random
+
+from pymavlink.generator import mavcrc
+from pymavlink.dialects.v10 import ardupilotmega as mavlink1
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+
+class fifo(object):
+    def __init__(self):
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf.extend(data)
+
+
+class DecodeTest(unittest.TestCase):
+
+    """
+    Class to test MAVLink encode/decode
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Constructor, set up some data that is reused in many tests"""
+        super(DecodeTest, self).__init__(*args, **kwargs)
+
+    def make_frames(self, mavlink):
+        f = fifo()
+        mav = mavlink.MAVLink(f, srcSystem=1, srcComponent=2)
+        mav.heartbeat_send(mavlink.MAV_TYPE_QUADROTOR, mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA, 0, 0, 0)
+        mav.attitude_send(1234, 0.1, -0.2, 0.3, 0.01, 0.02, -0.03)
+        mav.param_value_send(b'SYSID_THISMAV', 1.0, mavlink.MAV_PARAM_TYPE_REAL32, 200, 3)
+        mav.servo_output_raw_send(5678, 1, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800)
+        return f.buf
+
+    def check_messages(self, msgs):
+        assert [m.get_type() for m in msgs] == ['HEARTBEAT', 'ATTITUDE', 'PARAM_VALUE', 'SERVO_OUTPUT_RAW']
+        assert msgs[0].autopilot == mavlink1.MAV_AUTOPILOT_ARDUPILOTMEGA
+        assert msgs[1].time_boot_ms == 1234
+        assert abs(msgs[1].pitch + 0.2) < 1.0e-6
+        assert msgs[2].param_id == 'SYSID_THISMAV'
+        assert msgs[2].param_count == 200
+        assert msgs[3].servo8_raw == 1800
+        for m in msgs:
+            assert m.get_srcSystem() == 1
+            assert m.get_srcComponent() == 2
+
+    def test_parse(self):
+        """Test parsing a stream of frames"""
+        for mavlink in [mavlink1, mavlink2]:
+            buf = self.make_frames(mavlink)
+            mav = mavlink.MAVLink(None)
+            msgs = mav.parse_buffer(buf)
+            self.check_messages(msgs)
+            # the frames round trip unchanged
+            assert bytearray().join([m.get_msgbuf() for m in msgs]) == buf
+
+    def test_parse_crc_backends(self):
+        """Test parsing with each CRC backend, including pure python"""
+        saved_backend = mavcrc.backend
+        try:
+            for name in mavcrc.backends:
+                mavcrc.set_backend(name)
+                for mavlink in [mavlink1, mavlink2]:
+                    buf = self.make_frames(mavlink)
+                    self.check_messages(mavlink.MAVLink(None).parse_buffer(buf))
+        finally:
+            mavcrc.set_backend(saved_backend)
+
+    def test_decode_buffer_types(self):
+        """Test decode of bytes, bytearray, array and memoryview frames"""
+        for mavlink in [mavlink1, mavlink2]:
+            buf = self.make_frames(mavlink)
+            frames = [m.get_msgbuf() for m in mavlink.MAVLink(None).parse_buffer(buf)]
+            mav = mavlink.MAVLink(None)
+            for convert in [bytes, bytearray, memoryview, lambda b: array.array('B', b)]:
+                msgs = [mav.decode(convert(f)) for f in frames]
+                self.check_messages(msgs)
+                for (m, f) in zip(msgs, frames):
+                    assert m.get_msgbuf() == f
+                    hlen = 10 if mavlink is mavlink2 else 6
+                    assert m.get_payload() == f[hlen:-2]
+
+            # a memoryview over a receive buffer is copied, so the buffer can be reused
+            rxbuf = bytearray(frames[1])
+            m = mav.decode(memoryview(rxbuf))
+            rxbuf[:] = bytearray(len(rxbuf))
+            rxbuf.extend(b'more')
+            assert m.get_msgbuf() == frames[1]
+            assert m.get_payload() == frames[1][hlen:-2]
+
+    def test_bad_crc(self):
+        """Test a corrupted frame is rejected"""
+        for mavlink in [mavlink1, mavlink2]:
+            buf = self.make_frames(mavlink)
+            buf[12] ^= 0xFF
+            mav = mavlink.MAVLink(None)
+            mav.robust_parsing = True
+            msgs = mav.parse_buffer(buf)
+            assert msgs[0].get_type() == 'BAD_DATA'
+            assert [m.get_type() for m in msgs[1:]] == ['ATTITUDE', 'PARAM_VALUE', 'SERVO_OUTPUT_RAW']
+
+    def test_slots(self):
+        """Test decoded messages keep their fields and header in slots"""
+        for mavlink in [mavlink1, mavlink2]:
+            msgs = mavlink.MAVLink(None).parse_buffer(self.make_frames(mavlink))
+            for m in msgs:
+                assert vars(m) == {}
+                h = m.get_header()
+                assert (h.msgId, h.srcSystem, h.srcComponent) == (m.id, 1, 2)
+                assert h.seq == m.get_seq()
+                assert h.mlen == len(m.get_payload())
+            m = copy.copy(msgs[1])
+            m._timestamp = 1.5
+            assert str(m) == str(msgs[1])
+            assert m.get_seq() == 1
+            assert getattr(msgs[1], '_timestamp', None) is None
+            # fields which clash with class attributes use __dict__
+            m = mavlink.MAVLink_named_value_float_message(0, b'X', 1.0)
+            assert m.name == b'X'
+            assert mavlink.MAVLink_named_value_float_message.name == 'NAMED_VALUE_FLOAT'
+
+    def test_parse_buffer_into(self):
+        """Test bulk parsing matches byte at a time parsing"""
+        for mavlink in [mavlink1, mavlink2]:
+            frames = self.make_frames(mavlink)
+            buf = bytearray(b'xx') + frames + bytearray(b'\x00') + frames
+            buf[len(buf)-5] ^= 0xFF
+            mav1 = mavlink.MAVLink(None)
+            mav1.robust_parsing = True
+            expected = []
+            for i in range(len(buf)):
+                m = mav1.parse_char(buf[i:i+1])
+                if m is not None:
+                    expected.append(m)
+            # split into chunks which don't line up with frame boundaries
+            mav2 = mavlink.MAVLink(None)
+            mav2.robust_parsing = True
+            msgs = []
+            for i in range(0, len(buf), 7):
+                mav2.parse_buffer_into(buf[i:i+7], msgs)
+            assert [str(m) for m in msgs] == [str(m) for m in expected]
+            assert mav2.total_receive_errors == mav1.total_receive_errors
+            assert mav2.total_packets_received == mav1.total_packets_received
+            assert mav2.buf_len() == 0
+
+    def test_parse_buffer_into_prefix_error(self):
+        """Test a bad prefix raises once, keeping earlier messages"""
+        mav = mavlink2.MAVLink(None)
+        frames = self.make_frames(mavlink2)
+        msgs = []
+        with self.assertRaises(mavlink2.MAVError):
+            mav.parse_buffer_into(frames + bytearray(b'abc') + frames, msgs)
+        assert len(msgs) == 4
+        mav.parse_buffer_into(b'', msgs)
+        self.check_messages(msgs[4:])
+
+    def test_generated_decoders(self):
+        """Test the per message decoders match the generic decoder"""
+        rng = random.Random(1)
+        for mavlink in [mavlink1, mavlink2]:
+            mav = mavlink.MAVLink(None)
+            for (msgid, (msgtype, decoder)) in mavlink.mavlink_decoders.items():
+                assert msgtype is mavlink.mavlink_map[msgid]
+                payload = bytearray(rng.randint(0, 255) for i in range(msgtype.unpacker.size))
+                m1 = decoder(payload, 0)
+                m2 = mav.decode_payload(msgtype, payload, 0, len(payload))
+                assert m1.get_type() == msgtype.name
+                assert str(m1) == str(m2)
+                for f in msgtype.fieldnames:
+                    assert type(getattr(m1, f)) == type(getattr(m2, f))
+
+    def test_replaced_class(self):
+        """Test decode() builds a class that replaced one in mavlink_map"""
+        class attitude(mavlink2.MAVLink_attitude_message):
+            pass
+        frames = self.make_frames(mavlink2)
+        saved = mavlink2.mavlink_map[mavlink2.MAVLINK_MSG_ID_ATTITUDE]
+        mavlink2.mavlink_map[mavlink2.MAVLINK_MSG_ID_ATTITUDE] = attitude
+        try:
+            msgs = mavlink2.MAVLink(None).parse_buffer(frames)
+        finally:
+            mavlink2.mavlink_map[mavlink2.MAVLINK_MSG_ID_ATTITUDE] = saved
+        self.check_messages(msgs)
+        assert type(msgs[1]) is attitude
+        assert type(msgs[0]) is mavlink2.MAVLink_heartbeat_message
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for mavutil.mavmmaplog
+"""
+
+from __future__ import absolute_import, print_function
+import unittest
+import os
+import struct
+import tempfile
+
+from pymavlink import mavutil
+from pymavlink.dialects.v10 import ardupilotmega as mavlink1
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+
+class fifo(object):
+    def __init__(self):
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf.extend(data)
+
+
+def make_tlog(filename, count=200):
+    '''write a tlog with a mix of MAVLink1 and (truncated) MAVLink2 frames'''
+    f = fifo()
+    mav1 = mavlink1.MAVLink(f, srcSystem=1, srcComponent=1)
+    mav2 = mavlink2.MAVLink(f, srcSystem=1, srcComponent=1)
+    with open(filename, 'wb') as out:
+        t = 1600000000.0
+        for i in range(count):
+            mav = mav2 if i % 3 == 0 else mav1
+            msgs = [mav.attitude_encode(i*10, 0.01*i, -0.02*i, 0.0, 0.1, 0.2, 0.3),
+                    mav.global_position_int_encode(i*10, -353632610 + i, 1491652300 - i, 584000, 0, 0, 0, 0, 0)]
+            if i % 10 == 0:
+                msgs.append(mav.heartbeat_encode(mavlink1.MAV_TYPE_QUADROTOR,
+                                                 mavlink1.MAV_AUTOPILOT_ARDUPILOTMEGA, 0, 3, 0))
+            for m in msgs:
+                out.write(struct.pack('>Q', int(t*1.0e6)) + m.pack(mav))
+                mav.seq = (mav.seq + 1) % 256
+                t += 0.01
+
+
+class MMapLogTest(unittest.TestCase):
+
+    """
+    Class to test mavmmaplog
+    """
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.tlog')
+        os.close(fd)
+        make_tlog(self.filename)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_recv_match(self):
+        """Test recv_match by type"""
+        mlog = mavutil.mavmmaplog(self.filename)
+        assert mlog.counts[mlog.name_to_id['ATTITUDE']] == 200
+        n = 0
+        while True:
+            m = mlog.recv_match(type='GLOBAL_POSITION_INT')
+            if m is None:
+                break
+            assert m.time_boot_ms == n*10
+            n += 1
+        assert n == 200
+        mlog.close()
+
+    def test_to_numpy(self):
+        """Test vectorised decode of a message type"""
+        mlog = mavutil.mavmmaplog(self.filename)
+        expected = []
+        while True:
+            m = mlog.recv_match(type='ATTITUDE')
+            if m is None:
+                break
+            expected.append(m)
+        a = mlog.to_numpy('ATTITUDE', fields=['time_boot_ms', 'roll', 'pitch', 'yawspeed'])
+        assert a.dtype.names == ('time_boot_ms', 'roll', 'pitch', 'yawspeed', '_timestamp')
+        assert len(a) == len(expected)
+        for (row, m) in zip(a, expected):
+            assert row['time_boot_ms'] == m.time_boot_ms
+            assert row['roll'] == m.roll
+            assert row['pitch'] == m.pitch
+            assert row['yawspeed'] == m.yawspeed
+            assert abs(row['_timestamp'] - m._timestamp) < 1.0e-6
+        # MAVLink2 GLOBAL_POSITION_INT payloads are truncated and need zero padding
+        gpi = mlog.to_numpy('GLOBAL_POSITION_INT')
+        assert len(gpi) == 200
+        assert (gpi['lat'] - (gpi['time_boot_ms'] // 10).astype('i4') == -353632610).all()
+        assert (gpi['alt'] == 584000).all()
+        assert (gpi['hdg'] == 0).all()
+        assert len(mlog.to_numpy('HEARTBEAT')) == 20
+        assert len(mlog.to_numpy('RAW_IMU')) == 0
+        mlog.close()
+
+    def check_same_index(self, mlog, expected):
+        '''check two mavmmaplogs have the same offset arrays'''
+        assert mlog.counts == expected.counts
+        assert mlog.name_to_id == expected.name_to_id
+        for mtype in expected.offsets:
+            assert list(mlog.offsets[mtype]) == list(expected.offsets[mtype])
+        assert sorted(mlog.messages.keys()) == sorted(expected.messages.keys())
+
+    def test_offsets(self):
+        """Test offsets are stored in index files as 64 bit little endian"""
+        offsets = mavutil.offset_array([0, 1, 2**32 + 5, 2**63 + 7])
+        self.assertEqual(list(offsets), [0, 1, 2**32 + 5, 2**63 + 7])
+        fd, idxname = tempfile.mkstemp(suffix='.idx')
+        os.close(fd)
+        try:
+            with open(idxname, 'wb') as f:
+                mavutil.write_offsets(f, offsets)
+            with open(idxname, 'rb') as f:
+                data = f.read()
+        finally:
+            os.unlink(idxname)
+        self.assertEqual(data, struct.pack('<4Q', *offsets))
+        self.assertEqual(list(mavutil.read_offsets(data)), list(offsets))
+
+    def test_index_cache(self):
+        """Test the tlog index is reused and extended as the log grows"""
+        idxname = self.filename + '.idx'
+        try:
+            # start with a log truncated part way through a message
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+            with open(self.filename, 'wb') as f:
+                f.write(data[:len(data)//2 + 7])
+            mlog = mavutil.mavmmaplog(self.filename, index_cache=True)
+            assert os.path.exists(idxname)
+            expected = mavutil.mavmmaplog(self.filename)
+            self.check_same_index(mlog, expected)
+            mlog.close()
+            expected.close()
+
+            mlog = mavutil.mavmmaplog(self.filename)
+            assert mlog.load_index(idxname)
+            mlog.close()
+
+            # the log keeps being written
+            make_tlog(self.filename)
+            mlog = mavutil.mavmmaplog(self.filename)
+            assert mlog.load_index(idxname)
+            assert mlog.counts[mlog.name_to_id['ATTITUDE']] == 200
+            mlog.close()
+            mlog = mavutil.mavmmaplog(self.filename, index_cache=True)
+            expected = mavutil.mavmmaplog(self.filename)
+            self.check_same_index(mlog, expected)
+            assert mlog.counts[mlog.name_to_id['ATTITUDE']] == 200
+            mlog.close()
+            expected.close()
+
+            # a log rewritten with different contents is not indexed from the old index
+            make_tlog(self.filename, count=150)
+            mlog = mavutil.mavmmaplog(self.filename)
+            assert not mlog.load_index(idxname)
+
+            # a failed save leaves no temporary file behind
+            os.unlink(idxname)
+            os.mkdir(idxname)
+            assert not mlog.save_index(idxname)
+            assert not os.path.exists(idxname + '.tmp')
+            mlog.close()
+        finally:
+            if os.path.isdir(idxname):
+                os.rmdir(idxname)
+            elif os.path.exists(idxname):
+                os.unlink(idxname)
+
+    def test_seek_time(self):
+        """Test seeking by time matches a sequential read"""
+        mlog = mavutil.mavmmaplog(self.filename)
+        mlog.build_time_index(interval=50)
+        expected = []
+        while True:
+            m = mlog.recv_msg()
+            if m is None:
+                break
+            expected.append((str(m), m._timestamp))
+        times = [t for (m, t) in expected]
+        for t in [times[0], times[123] + 0.001, times[-1]]:
+            m = mlog.seek_time(t)
+            assert m._timestamp >= t
+            i = expected.index((str(m), m._timestamp))
+            for j in range(i+1, min(i+20, len(expected))):
+                m = mlog.recv_msg()
+                assert (str(m), m._timestamp) == expected[j]
+        # messages are held as file offsets and decoded again on restore
+        (keys, checkpoints) = mlog._time_index
+        (mkeys, positions, timestamps, others) = checkpoints[5]['messages']
+        assert (1, 'ATTITUDE') in mkeys and len(mkeys) == len(positions)
+        mlog.seek_time(keys[5] + 0.001)
+        seq = mavutil.mavmmaplog(self.filename)
+        seq.rewind()
+        while seq.f.tell() < mlog.f.tell():
+            seq.recv_msg()
+        dump = lambda log: dict((k, str(m)) for (k, m) in log.messages.items() if k != 'MAV')
+        assert dump(mlog) == dump(seq)
+        assert str(mlog._last_message) == str(seq._last_message)
+        seq.close()
+        t0, t1 = times[100], times[300]
+        msgs = [(str(m), m._timestamp) for m in mlog.iter_range(t0, t1, types='ATTITUDE')]
+        assert msgs == [(m, t) for (m, t) in expected
+                        if m.startswith('ATTITUDE') and t0 <= t <= t1]
+        assert len(msgs) > 0
+        mlog.close()
+
+if __name__ == '__main__':
+    unittest.main()
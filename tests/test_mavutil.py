@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for waiting on mavutil links
+"""
+
+from __future__ import absolute_import, print_function
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from pymavlink import mavutil
+from test_mavmmaplog import make_tlog
+
+
+class MAVUtilWaitTest(unittest.TestCase):
+
+    """
+    Class to test blocking waits on mavutil links
+    """
+
+    def setUp(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+        s.close()
+        self.link = mavutil.mavlink_connection('udpin:127.0.0.1:%u' % port)
+        self.out = mavutil.mavlink_connection('udpout:127.0.0.1:%u' % port, source_system=5)
+
+    def tearDown(self):
+        self.link.close()
+        self.out.close()
+
+    def later(self, delay, func, *args):
+        '''call a function from another thread after a delay'''
+        t = threading.Timer(delay, func, args)
+        t.start()
+        self.addCleanup(t.join)
+
+    def test_recv_match_timeout(self):
+        """Test a blocking recv_match waits for the whole timeout"""
+        start = time.time()
+        self.assertIsNone(self.link.recv_match(type='HEARTBEAT', blocking=True, timeout=0.3))
+        self.assertGreaterEqual(time.time() - start, 0.3)
+
+    def test_recv_match_wakes_on_data(self):
+        """Test a blocking recv_match returns as soon as a message arrives"""
+        self.later(0.2, self.out.mav.system_time_send, 1000, 20)
+        start = time.time()
+        m = self.link.recv_match(type='SYSTEM_TIME', blocking=True, timeout=10)
+        self.assertEqual(m.time_boot_ms, 20)
+        self.assertLess(time.time() - start, 5)
+
+    def test_wakeup(self):
+        """Test wakeup() interrupts select() from another thread"""
+        self.later(0.1, self.link.wakeup)
+        start = time.time()
+        self.assertFalse(self.link.select(10))
+        self.assertLess(time.time() - start, 5)
+        # wakeups are not lost if nobody is waiting yet
+        self.link.wakeup()
+        self.link.wakeup()
+        self.assertFalse(self.link.select(10))
+        self.assertFalse(self.link.select(0.01))
+
+        # an idle hook is still called regularly while blocked
+        calls = []
+        self.link.idle_hooks.append(lambda link: calls.append(link))
+        self.assertIsNone(self.link.recv_match(blocking=True, timeout=0.3))
+        self.assertGreater(len(calls), 2)
+
+    def test_close_wakeup(self):
+        """Test close() closes the wakeup sockets"""
+        link = mavutil.mavlink_connection('udpin:127.0.0.1:0')
+        link.wakeup()
+        sockets = link.wakeup_sockets
+        self.assertEqual(len(sockets), 2)
+        link.close()
+        self.assertIsNone(link.wakeup_sockets)
+        self.assertEqual([s.fileno() for s in sockets], [-1, -1])
+
+    def test_tlog_timeout(self):
+        """Test a blocking recv_match on a tlog gives up at the timeout"""
+        fd, filename = tempfile.mkstemp(suffix='.tlog')
+        os.close(fd)
+        try:
+            make_tlog(filename, count=10)
+            mlog = mavutil.mavlink_connection(filename)
+            self.assertIsNotNone(mlog.recv_match(type='ATTITUDE', blocking=True, timeout=0.1))
+            self.assertIsNone(mlog.recv_match(type='RAW_IMU', blocking=True, timeout=0.1))
+            mlog.close()
+        finally:
+            os.unlink(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
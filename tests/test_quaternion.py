@@ -8,8 +8,8 @@ Unit tests for the quaternion library
 from __future__ import absolute_import, division, print_function
 import unittest
 import numpy as np
-from pymavlink.quaternion import QuaternionBase, Quaternion
-from pymavlink.rotmat import Vector3, Matrix3
+from pymavlink.quaternion import QuaternionBase, Quaternion, QuaternionArray
+from pymavlink.rotmat import Vector3, Matrix3, Vector3Array, Matrix3Array
 
 __author__ = "Thomas Gubler"
 __copyright__ = "Copyright (C) 2014 Thomas Gubler"
@@ -336,5 +336,75 @@ class QuaternionTest(QuaternionBaseTest):
                 assert r_dcm.close(r.dcm)
 
 
+
+class QuaternionArrayTest(unittest.TestCase):
+    """
+    Class to test QuaternionArray
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Constructor, set up some data that is reused in many tests"""
+        super(QuaternionArrayTest, self).__init__(*args, **kwargs)
+        step = np.radians(45)
+        angles = [[phi, theta, psi] for phi in np.arange(-np.pi + 0.5, np.pi - 0.5, step)
+                  for theta in np.arange(-np.pi/2 + 0.5, np.pi/2 - 0.5, step)
+                  for psi in np.arange(-np.pi + 0.5, np.pi - 0.5, step)]
+        # include the gimbal lock cases
+        angles += [[0.3, np.pi/2, 0.2], [0.3, -np.pi/2, -0.2]]
+        self.quaternions = [QuaternionBase(e) for e in angles]
+        self.array = QuaternionArray(self.quaternions)
+
+    def test_conversion(self):
+        """Test conversions match QuaternionBase"""
+        a = self.array
+        assert len(a) == len(self.quaternions)
+        euler = a.euler
+        dcm = a.dcm
+        for (i, q) in enumerate(self.quaternions):
+            np.testing.assert_almost_equal(a.q[i], q.q)
+            np.testing.assert_almost_equal(euler[i], QuaternionBase(q.q).euler)
+            np.testing.assert_almost_equal(dcm[i], QuaternionBase(q.q).dcm)
+        np.testing.assert_almost_equal(QuaternionArray(euler[:-2]).q, a.q[:-2])
+        assert QuaternionArray(dcm).close(a).all()
+        assert QuaternionArray(Matrix3Array(dcm)).close(a).all()
+        assert a[3].close(self.quaternions[3])
+        assert len(a[2:5]) == 3
+
+    def test_norm(self):
+        """Test batch normalisation"""
+        a = QuaternionArray([[1, 2, 3, 4], [0, 0, 0, 2]])
+        np.testing.assert_almost_equal(a.norm, [np.sqrt(30), 2])
+        a.normalize()
+        np.testing.assert_almost_equal(a.q[0], QuaternionBase.normalize_array([1, 2, 3, 4]))
+        np.testing.assert_almost_equal(a.norm, [1, 1])
+
+    def test_mul(self):
+        """Test multiplication, division and inverses match QuaternionBase"""
+        a = self.array
+        b = QuaternionArray(self.quaternions[::-1])
+        products = a * b
+        quotients = a / b
+        for (i, (q, p)) in enumerate(zip(self.quaternions, self.quaternions[::-1])):
+            assert products[i].close(q * p)
+            assert quotients[i].close(q / p)
+            assert a.inversed[i].close(q.inversed)
+        p = self.quaternions[5]
+        assert (a * p).close(QuaternionArray([q * p for q in self.quaternions])).all()
+        assert (p * a).close(QuaternionArray([p * q for q in self.quaternions])).all()
+
+    def test_transform(self):
+        """Test transforming arrays of vectors"""
+        a = self.array
+        v = np.array([[1, 2, 3]] * len(a)) * np.arange(len(a))[:, np.newaxis]
+        t = a.transform(v)
+        t1 = a.transform([1, 2, 3])
+        t2 = a.transform(Vector3Array(v))
+        for (i, q) in enumerate(self.quaternions):
+            np.testing.assert_almost_equal(t[i], q.transform(v[i]))
+            np.testing.assert_almost_equal(t1[i], q.transform([1, 2, 3]))
+            assert t2[i].close(Vector3(*t[i]))
+        assert isinstance(a.transform(Vector3(1, 2, 3)), Vector3Array)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -11,7 +11,7 @@ import unittest
 import random
 import numpy as np
 
-from pymavlink.rotmat import Vector3, Matrix3, Plane, Line
+from pymavlink.rotmat import Vector3, Matrix3, Vector3Array, Matrix3Array, Plane, Line
 
 class VectorTest(unittest.TestCase):
 
@@ -54,6 +54,23 @@ class VectorTest(unittest.TestCase):
         assert v2.normalized().close(Vector3(0.23, 0.69, 0.69), tol=1e-2)
         np.testing.assert_almost_equal(v1.angle(v2), 1.693733631245806)
 
+    def test_inplace(self):
+        """Test in-place maths changes the vector rather than making a new one"""
+        v1 = Vector3(1, 2, -3)
+        v = v1
+        v += Vector3(1, 3, 3)
+        assert v is v1 and v1 == Vector3(2, 5, 0)
+        v -= Vector3(1, 1, 1)
+        v *= 2
+        v /= 4.0
+        assert v is v1 and v1 == Vector3(0.5, 2, -0.5)
+        v *= Vector3(2, 0, 0)
+        assert v == 1.0
+        m = Matrix3(Vector3(1, 0, 0), Vector3(1, 5, 0), Vector3(1, 0, -7))
+        v1.rotate_inplace(m)
+        assert v1 == m * Vector3(0.5, 2, -0.5)
+        self.assertRaises(AttributeError, setattr, v1, 'w', 1)
+
 
 class MatrixTest(unittest.TestCase):
 
@@ -85,6 +102,22 @@ class MatrixTest(unittest.TestCase):
         assert m1 / 0.5 == Matrix3(Vector3(2, 0, 0), Vector3(2, 10, 0), Vector3(2, 0, -14))
         assert m1.transposed() == Matrix3(Vector3(1, 1, 1), Vector3(0, 5, 0), Vector3(0, 0, -7))
 
+    def test_inplace(self):
+        """Test in-place maths, including a matrix multiplied by itself"""
+        m1 = Matrix3(Vector3(1, 0, 0), Vector3(1, 5, 0), Vector3(1, 0, -7))
+        a = m1.a
+        m1 *= m1
+        assert m1.a is a
+        assert m1 == Matrix3(Vector3(1, 0, 0), Vector3(6, 25, 0), Vector3(-6, 0, 49))
+        m = Matrix3()
+        m.from_euler(0.1, 0.2, 0.3)
+        expected = m * m
+        m *= m
+        assert m.close(expected, tol=1e-12)
+        m *= 2
+        m -= expected
+        assert m.close(expected, tol=1e-12)
+
     def test_euler(self):
         '''check that from_euler() and to_euler() are consistent'''
         m = Matrix3()
@@ -146,6 +179,76 @@ class MatrixTest(unittest.TestCase):
             assert diff.length() < 0.001
 
 
+class ArrayTest(unittest.TestCase):
+
+    """
+    Class to test Vector3Array and Matrix3Array
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Constructor, set up some data that is reused in many tests"""
+        super(ArrayTest, self).__init__(*args, **kwargs)
+        random.seed(1)
+        self.vectors = [Vector3(random.uniform(-5, 5), random.uniform(-5, 5), random.uniform(-5, 5))
+                        for i in range(20)]
+        self.eulers = [(random.uniform(-3, 3), random.uniform(-1.5, 1.5), random.uniform(-3, 3))
+                       for i in range(20)]
+        self.matrices = []
+        for e in self.eulers:
+            m = Matrix3()
+            m.from_euler(*e)
+            self.matrices.append(m)
+
+    def test_vectors(self):
+        """Test vector array maths matches Vector3"""
+        va = Vector3Array(self.vectors)
+        vb = Vector3Array(self.vectors[::-1])
+        assert len(va) == 20
+        assert va[3] == self.vectors[3]
+        assert Vector3Array(va.x, va.y, va.z) == va
+        for (i, (v1, v2)) in enumerate(zip(self.vectors, self.vectors[::-1])):
+            assert (va + vb)[i].close(v1 + v2)
+            assert (va - v2)[i].close(v1 - v2)
+            assert (va % vb)[i].close(v1 % v2)
+            assert (va * 3)[i].close(v1 * 3)
+            assert (va / 2.0)[i].close(v1 / 2.0)
+            assert va.normalized()[i].close(v1.normalized())
+            np.testing.assert_almost_equal((va * vb)[i], v1 * v2)
+            np.testing.assert_almost_equal(va.length()[i], v1.length())
+            np.testing.assert_almost_equal(va.angle(vb)[i], v1.angle(v2))
+        v = va
+        v += vb
+        v *= np.arange(20)
+        assert v is va
+        assert va[5].close((self.vectors[5] + self.vectors[14]) * 5)
+
+    def test_matrices(self):
+        """Test matrix array maths matches Matrix3"""
+        ma = Matrix3Array()
+        ma.from_euler(*zip(*self.eulers))
+        assert len(ma) == 20
+        (roll, pitch, yaw) = ma.to_euler()
+        va = Vector3Array(self.vectors)
+        rotated = ma * va
+        products = ma * ma.transposed()
+        for (i, m) in enumerate(self.matrices):
+            assert ma[i].close(m)
+            np.testing.assert_almost_equal((roll[i], pitch[i], yaw[i]), m.to_euler())
+            assert rotated[i].close(m * self.vectors[i])
+            assert products[i].close(m * m.transposed())
+            assert (m * va)[i].close(m * self.vectors[i])
+        np.testing.assert_almost_equal(ma.determinant(), np.ones(20))
+        np.testing.assert_almost_equal(ma.trace(), [m.trace() for m in self.matrices])
+
+        ma.rotate(va * 0.01)
+        ma.normalize()
+        for (i, m) in enumerate(self.matrices):
+            m.rotate(self.vectors[i] * 0.01)
+            m.normalize()
+            assert ma[i].close(m)
+        assert Matrix3Array(3) == Matrix3Array([Matrix3()] * 3)
+
+
 class LinePlaneTest(unittest.TestCase):
 
     """
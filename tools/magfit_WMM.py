@@ -93,7 +93,7 @@ def correct(MAG, BAT, c):
         Vector3(c.offdiag.x, c.diag.y,     c.offdiag.z),
         Vector3(c.offdiag.y, c.offdiag.z,  c.diag.z))
 
-    mag = mat * mag
+    mag.rotate_inplace(mat)
 
     # apply compassmot corrections
     if BAT is not None and hasattr(BAT, 'Curr') and not math.isnan(BAT.Curr):
@@ -7,6 +7,7 @@ from __future__ import print_function
 from builtins import input
 from builtins import range
 
+import calendar
 import datetime
 import matplotlib
 import os
@@ -203,7 +204,7 @@ parser.add_argument("--timeshift", type=float, default=0, help="shift time on fi
 parser.add_argument("logs_fields", metavar="<LOG or FIELD>", nargs="+")
 args = parser.parse_args()
 
-from pymavlink import mavutil
+from pymavlink import mavutil, mavexpression
 
 if args.flightmode is not None and args.xaxis:
     print("Cannot request flightmode backgrounds with an x-axis expression")
@@ -258,13 +259,7 @@ def add_data(t, msg, vars, flightmode):
     for i in range(0, len(fields)):
         if mtype not in field_types[i]:
             continue
-        f = fields[i]
-        if f.endswith(":2"):
-            axes[i] = 2
-            f = f[:-2]
-        if f.endswith(":1"):
-            first_only[i] = True
-            f = f[:-2]
+        f = field_name(i)
         v = mavutil.evaluate_expression(f, vars)
         if v is None:
             continue
@@ -277,10 +272,60 @@ def add_data(t, msg, vars, flightmode):
         y[i].append(v)
         x[i].append(xv)
 
+def field_name(i):
+    '''return field i without its axis suffix, setting the axis options'''
+    f = fields[i]
+    if f.endswith(":2"):
+        axes[i] = 2
+        f = f[:-2]
+    if f.endswith(":1"):
+        first_only[i] = True
+        f = f[:-2]
+    return f
+
+def timestamps_to_days(t):
+    '''convert an array of unix timestamps to matplotlib dates in local
+    time, as date2num(datetime.fromtimestamp()) does for one timestamp'''
+    if len(t) == 0:
+        return []
+    if t.min() < 0 or t.max() >= 253402300800:
+        # fromtimestamp() would fail
+        return None
+    utc_offsets = [calendar.timegm(time.localtime(v)) - int(v) for v in (t.min(), t.max())]
+    if utc_offsets[0] != utc_offsets[1]:
+        # daylight saving changes during the log
+        return [matplotlib.dates.date2num(datetime.datetime.fromtimestamp(v)) for v in t]
+    epoch = matplotlib.dates.date2num(datetime.datetime(1970, 1, 1))
+    return (epoch + (t + utc_offsets[0]) / 86400.0).tolist()
+
+def process_file_vectorised(mlog, timeshift):
+    '''graph the fields using whole columns of the log, returning False if
+    the messages need processing one at a time instead'''
+    columns = mavexpression.log_columns(mlog)
+    if columns is None:
+        return False
+    results = []
+    for i in range(0, len(fields)):
+        triggers = set([t for t in field_types[i] if t in mlog.name_to_id])
+        r = mavexpression.evaluate_columns(field_name(i), triggers, columns)
+        if r is None:
+            return False
+        tdays = timestamps_to_days(r[0] + timeshift)
+        if tdays is None:
+            return False
+        results.append((tdays, r[1].tolist()))
+    for i in range(0, len(fields)):
+        x[i].extend(results[i][0])
+        y[i].extend(results[i][1])
+    return True
+
 def process_file(filename, timeshift):
     '''process one file'''
     print("Processing %s" % filename)
     mlog = mavutil.mavlink_connection(filename, notimestamps=args.notimestamps, zero_time_base=args.zero_time_base, dialect=args.dialect)
+    if (args.condition is None and args.xaxis is None and args.flightmode is None and
+        not args.notimestamps and process_file_vectorised(mlog, timeshift)):
+        return
     vars = {}
     all_messages = {}
 
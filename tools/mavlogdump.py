@@ -74,11 +74,21 @@ if args.format == 'mat':
     import numpy as np
 
 filename = args.log
-mlog = mavutil.mavlink_connection(filename, planner_format=args.planner,
-                                  notimestamps=args.notimestamps,
-                                  robust_parsing=args.robust,
-                                  dialect=args.dialect,
-                                  zero_time_base=args.zero_time_base)
+ext = os.path.splitext(filename)[1]
+isbin = ext in ['.bin', '.BIN', '.px4log']
+islog = ext in ['.log', '.LOG'] # NOTE: "islog" does not mean a tlog
+istlog = ext in ['.tlog', '.TLOG']
+
+if isbin and args.follow:
+    # the indexed reader can't see data written after it is opened
+    from pymavlink import DFReader
+    mlog = DFReader.DFReader_stream(filename, zero_time_base=args.zero_time_base, follow=True)
+else:
+    mlog = mavutil.mavlink_connection(filename, planner_format=args.planner,
+                                      notimestamps=args.notimestamps,
+                                      robust_parsing=args.robust,
+                                      dialect=args.dialect,
+                                      zero_time_base=args.zero_time_base)
 
 output = None
 if args.output:
@@ -92,11 +102,6 @@ nottypes = args.nottypes
 if nottypes is not None:
     nottypes = nottypes.split(',')
 
-ext = os.path.splitext(filename)[1]
-isbin = ext in ['.bin', '.BIN', '.px4log']
-islog = ext in ['.log', '.LOG'] # NOTE: "islog" does not mean a tlog
-istlog = ext in ['.tlog', '.TLOG']
-
 # list of msgs to reduce in rate when --reduce is used
 reduction_msgs = ['NKF*', 'XKF*', 'IMU*', 'AHR2', 'BAR*', 'ATT', 'BAT*', 'CTUN', 'NTUN', 'GP*', 'IMT*', 'MAG*', 'PL', 'POS', 'POW*', 'RATE', 'RC*', 'RFND', 'UBX*', 'VIBE', 'NKQ*', 'MOT*', 'CTRL', 'FTS*', 'DSF', 'CST*', 'LOS*', 'UWB*']
 reduction_yes = set()
@@ -177,7 +182,7 @@ if types is not None and hasattr(mlog, 'name_to_id'):
                 match_types = []
             match_types.append(k)
 
-if isbin and args.format == 'csv':
+if isbin and args.format == 'csv' and match_types is not None:
     # we need FMT messages for column headings
     match_types.append("FMT")
 
@@ -213,7 +218,7 @@ while True:
             output.write(struct.pack('>Q', int(timestamp*1.0e6)) + m.get_msgbuf())
             continue
 
-    if not mavutil.evaluate_condition(args.condition, mlog.messages) and (
+    if not mlog.check_condition(args.condition) and (
             not (m.get_type() in ['FMT', 'FMTU', 'MULT','PARM','MODE'] and args.meta)):
         continue
     if args.source_system is not None and args.source_system != m.get_srcSystem():